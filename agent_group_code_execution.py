@@ -1,15 +1,14 @@
 import asyncio
-import datetime
+import atexit
 import os
 import dotenv
 import logging
 import tempfile
+import time
 
-from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import DefaultAzureCredential
-from functools import reduce
+from uuid import uuid4
 from semantic_kernel import Kernel
-from semantic_kernel.agents import AgentGroupChat, ChatCompletionAgent
+from semantic_kernel.agents import AgentGroupChat
 from semantic_kernel.agents.strategies.selection.kernel_function_selection_strategy import (
     KernelFunctionSelectionStrategy,
 )
@@ -22,25 +21,81 @@ from semantic_kernel.connectors.ai.function_choice_behavior import (
 from semantic_kernel.connectors.ai.open_ai.prompt_execution_settings.azure_chat_prompt_execution_settings import (
     AzureChatPromptExecutionSettings,
 )
-from semantic_kernel.connectors.ai.open_ai.services.azure_chat_completion import (
-    AzureChatCompletion,
-)
 from semantic_kernel.contents.chat_message_content import ChatMessageContent
 from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import (
     SessionsPythonTool,
 )
 from semantic_kernel.contents.utils.author_role import AuthorRole
 from semantic_kernel.functions.kernel_function_from_prompt import KernelFunctionFromPrompt
-from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
+from agent_strategies import USER_STATE, LayeredTerminationStrategy, StateMachineSelectionStrategy
+from kernel_factory import ConnectionSettings, KernelFactory, close_shared_clients
+from rate_limiter import RateLimitScheduler
+from history_reducer import HistoryReducer, ReducingChatCompletionAgent, create_prompt_summarizer
 from logging_utils import log_message, log_flow, log_from_agent, log_separator
-from local_python_plugin import LocalPythonPlugin
+from stream_renderer import StreamRenderer
+from artifact_store import shared_artifact_store
+from audit_log import CodeAuditLog
+from execution_router import ExecutionRouterPlugin, LocalBackend, SessionsBackend
+from execution_result import ExecutionLimits
+from fake_chat_completion import PipelineProfile, create_fake_chat_completion_factory, load_script
+from file_attachments import attach_file
+from local_python_plugin import ARTIFACT_DIRECTORY_HINT, AsyncLocalPythonPlugin
+from sessions_pool import WarmSessionPool, close_session_pools, register_session_pool
+from sessions_pool_server import (
+    DEFAULT_POOL_MANAGEMENT_ENDPOINT,
+    create_local_sessions_http_client,
+    local_sessions_auth_callback,
+)
+from token_provider import COGNITIVE_SERVICES_SCOPE, SESSIONS_SCOPE, close_token_providers, get_token_provider
+from worker_pool import WorkerPool
 
 # Load environment variables
 dotenv.load_dotenv()
 
 # Config
 USE_CODE_INTERPRETER_SESSIONS_TOOL = False  # Set to False to use LocalCodeExecutionTool
+USE_LOCAL_WORKER_POOL = False  # Set to True to run LocalPythonPlugin code in warm worker processes
+LOCAL_WORKER_POOL_PRELOAD_MODULES = ("math",)  # e.g. ("math", "numpy", "pandas")
+AUDIT_GENERATED_CODE = False  # Set to True to append the generated code to a rotating generated_code.log
+# Set to True to keep the figures and files produced by LocalPythonPlugin code in the shared artifact store;
+# the agents then get references to them instead of nothing
+CAPTURE_ARTIFACTS = False
+USE_LLM_SELECTION_FALLBACK = False  # Set to True to let a model pick the next agent when the transitions are ambiguous
+USE_LLM_TERMINATION_FALLBACK = True  # Set to False to never ask a model whether the chat is done
+AGENT_HISTORY_MAX_TOKENS = 8000  # The history budget of each agent; older tool results are truncated
+STRATEGY_HISTORY_MAX_MESSAGES = 4  # The number of messages sent to the selection and termination prompts
+SUMMARIZE_REDUCED_HISTORY = False  # Set to True to send agents a rolling summary of the messages left out
+USE_STREAMING = False  # Set to True to render the agents' replies token by token and log their time to first token and tokens/s
+# The connection pool shared by the chat completion services of every agent and strategy
+CHAT_COMPLETION_CONNECTION_SETTINGS = ConnectionSettings(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry_seconds=30.0
+)
+# Per-execution limits; only max_output_chars applies unless USE_LOCAL_WORKER_POOL is True
+LOCAL_EXECUTION_LIMITS = ExecutionLimits(
+    wall_clock_seconds=60, cpu_seconds=60, memory_bytes=2 * 1024 * 1024 * 1024, max_output_chars=1_000_000
+)
 azure_code_interpreter_pool_endpoint = os.getenv("AZURE_CODE_INTERPRETER_POOL_ENDPOINT")
+# Set to True, with USE_CODE_INTERPRETER_SESSIONS_TOOL, to run the code in the local pool of sessions_pool_server.py,
+# at AZURE_CODE_INTERPRETER_POOL_ENDPOINT or else https://127.0.0.1:8090/ (served over plain http)
+USE_LOCAL_SESSIONS_POOL = False
+# Session identifiers kept warm and leased to conversations, so their first execution does not wait for a
+# session to be allocated; 0 to start every conversation on a new identifier
+SESSIONS_POOL_WARM_SESSIONS = 4
+SESSIONS_POOL_MAX_LEASE_WAIT_SECONDS = 5.0  # How long a conversation waits for a warm session before starting cold
+SESSIONS_POOL_RECYCLE = "reset"  # "reset" to clear released sessions and lease them again, or "discard"
+# Set to True to route each execution to LocalPythonPlugin or to the sessions pool from live load, latency, cost
+# and isolation signals, failing over between them (ignores USE_CODE_INTERPRETER_SESSIONS_TOOL)
+USE_EXECUTION_ROUTER = False
+# The quotas of the deployment, enforced client-side across every agent and strategy; None for no limit.
+# Throttled requests are retried after their Retry-After either way.
+CHAT_COMPLETION_REQUESTS_PER_MINUTE = None
+CHAT_COMPLETION_TOKENS_PER_MINUTE = None
+# Set to True to replay the scripted replies of FAKE_CHAT_COMPLETION_SCRIPT instead of calling Azure OpenAI,
+# and log how the time of each turn splits between the models, the code execution and the orchestration
+USE_FAKE_CHAT_COMPLETION = False
+FAKE_CHAT_COMPLETION_SCRIPT = "fake_chat_script.json"
+FAKE_CHAT_COMPLETION_LATENCY_SECONDS = 0.5  # The simulated time to first token
+FAKE_CHAT_COMPLETION_TOKENS_PER_SECOND = 50.0
 azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 azure_openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
@@ -55,66 +110,181 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def auth_callback_factory(scope):
-    auth_token = None
-
-    async def auth_callback() -> str:
-        """Auth callback for the SessionsPythonTool.
-        This is a sample auth callback that shows how to use Azure's DefaultAzureCredential
-        to get an access token.
-        """
-        nonlocal auth_token
-        current_utc_timestamp = int(
-            datetime.datetime.now(datetime.timezone.utc).timestamp()
-        )
+_worker_pool: WorkerPool | None = None
 
-        if not auth_token or auth_token.expires_on < current_utc_timestamp:
-            credential = DefaultAzureCredential()
 
-            try:
-                auth_token = credential.get_token(scope)
-            except ClientAuthenticationError as cae:
-                err_messages = getattr(cae, "messages", [])
-                raise FunctionExecutionException(
-                    f"Failed to retrieve the client auth token with messages: {' '.join(err_messages)}"
-                ) from cae
-
-        return auth_token.token
-
-    return auth_callback
-
-
-def _create_kernel_with_chat_completion(service_id: str) -> Kernel:
-    kernel = Kernel()
-    kernel.add_service(
-        AzureChatCompletion(
-            service_id=service_id,
-            endpoint=azure_openai_endpoint,
-            deployment_name=azure_openai_deployment,
-            api_key=azure_openai_api_key,
-            api_version=azure_openai_api_version,
+def _get_worker_pool() -> WorkerPool | None:
+    """Lazily start the worker pool shared by every LocalPythonPlugin in this process."""
+    global _worker_pool
+    if USE_LOCAL_WORKER_POOL and _worker_pool is None:
+        _worker_pool = WorkerPool(preload_modules=LOCAL_WORKER_POOL_PRELOAD_MODULES)
+    return _worker_pool
+
+
+_code_audit_log: CodeAuditLog | None = None
+
+
+def _get_code_audit_log() -> CodeAuditLog | None:
+    """Lazily open the generated code audit log shared by every LocalPythonPlugin in this process."""
+    global _code_audit_log
+    if AUDIT_GENERATED_CODE and _code_audit_log is None:
+        _code_audit_log = CodeAuditLog()
+        # Writes the records still queued when the process exits, whichever entry point started it
+        atexit.register(_code_audit_log.close)
+    return _code_audit_log
+
+
+CodeExecutionPlugin = SessionsPythonTool | AsyncLocalPythonPlugin | ExecutionRouterPlugin
+
+_sessions_pool: WarmSessionPool | None = None
+
+
+def _get_sessions_pool() -> WarmSessionPool | None:
+    """Lazily create the pool of warm sessions shared by every SessionsPythonTool in this process."""
+    global _sessions_pool
+    if (USE_CODE_INTERPRETER_SESSIONS_TOOL or USE_EXECUTION_ROUTER) and SESSIONS_POOL_WARM_SESSIONS and _sessions_pool is None:
+        _sessions_pool = register_session_pool(
+            WarmSessionPool(
+                _get_pool_management_endpoint(),
+                _get_sessions_auth_callback(),
+                warm_sessions=SESSIONS_POOL_WARM_SESSIONS,
+                max_lease_wait_seconds=SESSIONS_POOL_MAX_LEASE_WAIT_SECONDS,
+                recycle=SESSIONS_POOL_RECYCLE,
+                http_client=create_local_sessions_http_client() if USE_LOCAL_SESSIONS_POOL else None,
+            )
         )
+    return _sessions_pool
+
+
+def _get_pool_management_endpoint() -> str | None:
+    if USE_LOCAL_SESSIONS_POOL:
+        return azure_code_interpreter_pool_endpoint or DEFAULT_POOL_MANAGEMENT_ENDPOINT
+    return azure_code_interpreter_pool_endpoint
+
+
+def _get_sessions_auth_callback():
+    return local_sessions_auth_callback if USE_LOCAL_SESSIONS_POOL else get_token_provider(SESSIONS_SCOPE)
+
+
+def _create_local_python_plugin() -> AsyncLocalPythonPlugin:
+    return AsyncLocalPythonPlugin(
+        worker_pool=_get_worker_pool(),
+        audit_log=_get_code_audit_log(),
+        execution_limits=LOCAL_EXECUTION_LIMITS,
+        artifact_store=shared_artifact_store if CAPTURE_ARTIFACTS else None,
     )
-    
-    if USE_CODE_INTERPRETER_SESSIONS_TOOL:
-        # Add the code interpreter sessions pool to the Kernel
-        kernel.add_plugin(
-            plugin_name="CodeInterpreterSessionsTool",
-            plugin=SessionsPythonTool(
-                auth_callback=auth_callback_factory("https://dynamicsessions.io/.default"),
-                pool_management_endpoint=azure_code_interpreter_pool_endpoint,
-            ),
+
+
+def _get_code_execution_plugin_name() -> str:
+    if USE_EXECUTION_ROUTER:
+        return "CodeExecutionRouter"
+    return "CodeInterpreterSessionsTool" if USE_CODE_INTERPRETER_SESSIONS_TOOL else "LocalCodeExecutionTool"
+
+
+def _create_sessions_python_tool() -> SessionsPythonTool:
+    sessions_pool = _get_sessions_pool()
+    if sessions_pool is not None:
+        # The plugins share the connections of the pool
+        http_client = sessions_pool.http_client
+    else:
+        http_client = create_local_sessions_http_client() if USE_LOCAL_SESSIONS_POOL else None
+    return SessionsPythonTool(
+        auth_callback=_get_sessions_auth_callback(),
+        pool_management_endpoint=_get_pool_management_endpoint(),
+        http_client=http_client,
+    )
+
+
+def _create_code_execution_plugin() -> CodeExecutionPlugin:
+    if USE_EXECUTION_ROUTER:
+        # Cheap snippets stay local, the rest bursts to the sessions pool when the local workers are busy
+        return ExecutionRouterPlugin(
+            backends=[
+                LocalBackend(_create_local_python_plugin()),
+                SessionsBackend(_create_sessions_python_tool(), new_session=_reset_code_execution_session),
+            ]
         )
+    if USE_CODE_INTERPRETER_SESSIONS_TOOL:
+        return _create_sessions_python_tool()
+    return _create_local_python_plugin()
+
+
+async def _reset_code_execution_session(plugin: CodeExecutionPlugin) -> None:
+    """Drop the variables and imports accumulated by the code execution plugin."""
+    if isinstance(plugin, SessionsPythonTool):
+        # Move to a new remote session, a warm one from the pool if enabled
+        sessions_pool = _get_sessions_pool()
+        if sessions_pool is None:
+            plugin.settings.session_id = str(uuid4())
+        else:
+            sessions_pool.release(plugin.settings.session_id)
+            plugin.settings.session_id = await sessions_pool.lease()
+    elif isinstance(plugin, ExecutionRouterPlugin):
+        await plugin.reset_session()
     else:
-        kernel.add_plugin(plugin_name="LocalCodeExecutionTool", plugin=LocalPythonPlugin())
-    
+        plugin.reset_session()
+
+
+pipeline_profile = PipelineProfile()
+
+kernel_factory = KernelFactory(
+    endpoint=azure_openai_endpoint,
+    deployment_name=azure_openai_deployment,
+    api_key=azure_openai_api_key,
+    api_version=azure_openai_api_version,
+    # Azure AD authentication when no API key is set
+    ad_token_provider=None if azure_openai_api_key else get_token_provider(COGNITIVE_SERVICES_SCOPE),
+    connection_settings=CHAT_COMPLETION_CONNECTION_SETTINGS,
+    rate_limit_scheduler=RateLimitScheduler(CHAT_COMPLETION_REQUESTS_PER_MINUTE, CHAT_COMPLETION_TOKENS_PER_MINUTE),
+    chat_completion_factory=create_fake_chat_completion_factory(
+        load_script(FAKE_CHAT_COMPLETION_SCRIPT),
+        latency_seconds=FAKE_CHAT_COMPLETION_LATENCY_SECONDS,
+        tokens_per_second=FAKE_CHAT_COMPLETION_TOKENS_PER_SECOND,
+        profile=pipeline_profile,
+    )
+    if USE_FAKE_CHAT_COMPLETION
+    else None,
+)
+
+
+def _create_kernel_with_chat_completion(
+    service_id: str, code_execution_plugin: CodeExecutionPlugin | None = None
+) -> Kernel:
+    # Only the kernels of agents that execute code get the plugin
+    plugins = {}
+    if code_execution_plugin is not None:
+        plugin_name = _get_code_execution_plugin_name()
+        plugins[plugin_name] = lambda: code_execution_plugin
+    kernel = kernel_factory.create_kernel(service_id, plugins)
+    if USE_FAKE_CHAT_COMPLETION and code_execution_plugin is not None:
+        # Times the code execution, to tell it apart from the models and the orchestration
+        kernel.add_filter("function_invocation", pipeline_profile.function_invocation_filter)
     return kernel
 
-async def main():
-    agent_writer = ChatCompletionAgent(
+
+def _create_agent_history_reducer() -> HistoryReducer:
+    """Create the history reducer of an agent; each agent has its own, since they cache rolling summaries."""
+    summarizer = (
+        create_prompt_summarizer(_create_kernel_with_chat_completion("summarization"))
+        if SUMMARIZE_REDUCED_HISTORY
+        else None
+    )
+    return HistoryReducer(max_tokens=AGENT_HISTORY_MAX_TOKENS, summarizer=summarizer)
+
+
+def _log_agent_reply(name: str) -> None:
+    log_separator()
+    log_message(f"Invoking {name} agent")
+    log_from_agent(name)
+
+
+def create_group_chat(code_execution_plugin: CodeExecutionPlugin) -> AgentGroupChat:
+    """Create the group chat of the CodeWriter and the CodeExecutor, which executes code with the plugin."""
+    agent_writer = ReducingChatCompletionAgent(
         service_id=CODEWRITER_NAME,
         kernel=_create_kernel_with_chat_completion(CODEWRITER_NAME),
         name=CODEWRITER_NAME,
+        history_reducer=_create_agent_history_reducer(),
         instructions=f"""
             You are a {CODEWRITER_NAME} agent. 
             You use your coding skill to solve problems. 
@@ -123,6 +293,7 @@ async def main():
             All necessary libraries have already been installed.
             You are entering a work session with other agents: {CODEEXECUTOR_NAME}.
             Do NOT execute code. Only return the code you write for it to be executed by the {CODEEXECUTOR_NAME} agent.
+            {ARTIFACT_DIRECTORY_HINT if CAPTURE_ARTIFACTS else ""}
         """,
         execution_settings=AzureChatPromptExecutionSettings(
             service_id=CODEWRITER_NAME,
@@ -132,10 +303,11 @@ async def main():
         ),
     )
 
-    agent_executor = ChatCompletionAgent(
+    agent_executor = ReducingChatCompletionAgent(
         service_id=CODEEXECUTOR_NAME,
-        kernel=_create_kernel_with_chat_completion(CODEEXECUTOR_NAME),
+        kernel=_create_kernel_with_chat_completion(CODEEXECUTOR_NAME, code_execution_plugin),
         name=CODEEXECUTOR_NAME,
+        history_reducer=_create_agent_history_reducer(),
         instructions=f"""
             You are a {CODEEXECUTOR_NAME} agent.
             You have access to an IPython kernel to execute Python code. 
@@ -153,7 +325,7 @@ async def main():
             temperature=0.0,
             max_tokens=1000,
             function_choice_behavior=FunctionChoiceBehavior.Required(
-                filters={"included_plugins": ["CodeInterpreterSessionsTool"]} if USE_CODE_INTERPRETER_SESSIONS_TOOL else {"included_plugins": ["LocalCodeExecutionTool"]}
+                filters={"included_plugins": [_get_code_execution_plugin_name()]}
             ),
         ),
     )
@@ -196,22 +368,49 @@ async def main():
 
     chat = AgentGroupChat(
         agents=[agent_writer, agent_executor],
-        selection_strategy=KernelFunctionSelectionStrategy(
-            function=selection_function,
-            kernel=_create_kernel_with_chat_completion("selection"),
-            result_parser=lambda result: str(result.value[0]) if result.value is not None else CODEWRITER_NAME,
-            agent_variable_name="agents",
-            history_variable_name="history",
+        selection_strategy=StateMachineSelectionStrategy(
+            transitions={
+                USER_STATE: CODEWRITER_NAME,
+                CODEWRITER_NAME: CODEEXECUTOR_NAME,
+                CODEEXECUTOR_NAME: CODEWRITER_NAME,
+            },
+            # Only consulted for states without a single transition
+            fallback=KernelFunctionSelectionStrategy(
+                function=selection_function,
+                kernel=_create_kernel_with_chat_completion("selection"),
+                result_parser=lambda result: str(result.value[0]) if result.value is not None else CODEWRITER_NAME,
+                agent_variable_name="agents",
+                history_variable_name="history",
+            )
+            if USE_LLM_SELECTION_FALLBACK
+            else None,
+            history_reducer=HistoryReducer(max_messages=STRATEGY_HISTORY_MAX_MESSAGES, tool_results="drop"),
         ),
-        termination_strategy=KernelFunctionTerminationStrategy(
+        termination_strategy=LayeredTerminationStrategy(
             agents=[agent_executor],
-            function=termination_function,
-            kernel=_create_kernel_with_chat_completion("termination"),
-            result_parser=lambda result: TERMINATION_KEYWORD in str(result.value[0]).lower(),
-            history_variable_name="history",
             maximum_iterations=10,
+            max_turns=3,
+            # Only consulted when the local checks on the executor's turn are inconclusive
+            fallback=KernelFunctionTerminationStrategy(
+                agents=[agent_executor],
+                function=termination_function,
+                kernel=_create_kernel_with_chat_completion("termination"),
+                result_parser=lambda result: TERMINATION_KEYWORD in str(result.value[0]).lower(),
+                history_variable_name="history",
+            )
+            if USE_LLM_TERMINATION_FALLBACK
+            else None,
+            history_reducer=HistoryReducer(max_messages=STRATEGY_HISTORY_MAX_MESSAGES, tool_results="drop"),
         ),
     )
+    return chat
+
+
+async def main():
+    code_execution_plugin = _create_code_execution_plugin()
+    chat = create_group_chat(code_execution_plugin)
+    # Leases a warm session when the sessions pool is enabled
+    await _reset_code_execution_session(code_execution_plugin)
 
     is_complete: bool = False
     while not is_complete:
@@ -225,19 +424,23 @@ async def main():
 
         if user_input.lower() == "reset":
             await chat.reset()
+            await _reset_code_execution_session(code_execution_plugin)
             print("[Conversation has been reset]")
             continue
 
         if user_input.startswith("@") and len(user_input) > 1:
-            file_path = user_input[1:]
+            # "@path" or "@path question": the file is staged for the code, the agents get its summary
+            file_path, prompt = user_input[1:], None
+            if not os.path.exists(file_path):
+                file_path, _, prompt = file_path.partition(" ")
             try:
                 if not os.path.exists(file_path):
                     print(f"Unable to access file: {file_path}")
                     continue
-                with open(file_path) as file:
-                    user_input = file.read()
-            except Exception:
-                print(f"Unable to access file: {file_path}")
+                attachment = await attach_file(code_execution_plugin, file_path)
+                user_input = attachment.to_message(prompt)
+            except Exception as e:
+                print(f"Unable to attach file {file_path}: {e}")
                 continue
 
         log_separator()
@@ -247,16 +450,28 @@ async def main():
 
         await chat.add_chat_message(ChatMessageContent(role=AuthorRole.USER, content=user_input))
 
-        async for response in chat.invoke():
-            log_separator()
-            log_message(f"Invoking {response.name} agent")
-            log_from_agent(response.name)
-            print(f"\033[94m{response.content}'\n")
+        pipeline_profile.reset()
+        started = time.perf_counter()
+        if USE_STREAMING:
+            renderer = StreamRenderer(on_reply_start=_log_agent_reply)
+            async for chunk in chat.invoke_stream():
+                renderer.write(chunk)
+            renderer.close()
+        else:
+            async for response in chat.invoke():
+                _log_agent_reply(response.name)
+                print(f"\033[94m{response.content}'\n")
+        if USE_FAKE_CHAT_COMPLETION:
+            logger.info(f"Pipeline profile: {pipeline_profile.summary(time.perf_counter() - started)}")
 
         if chat.is_complete:
             is_complete = True
             print(chat.history)
             break
 
+    await close_shared_clients()
+    await close_token_providers()
+    await close_session_pools()
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -13,17 +13,27 @@ from semantic_kernel.agents.strategies.selection.kernel_function_selection_strat
 from semantic_kernel.agents.strategies.termination.kernel_function_termination_strategy import (
     KernelFunctionTerminationStrategy,
 )
-from semantic_kernel.connectors.ai.open_ai.services.azure_chat_completion import AzureChatCompletion
 from semantic_kernel.contents.chat_message_content import ChatMessageContent
 from semantic_kernel.contents.utils.author_role import AuthorRole
 from semantic_kernel.functions.kernel_function_decorator import kernel_function
 from semantic_kernel.functions.kernel_function_from_prompt import KernelFunctionFromPrompt
 from semantic_kernel.kernel import Kernel
+from agent_strategies import USER_STATE, StateMachineSelectionStrategy
+from kernel_factory import KernelFactory, close_shared_clients
+from rate_limiter import RateLimitScheduler
 from logging_utils import log_message, log_flow, log_from_agent, log_separator
+from stream_renderer import StreamRenderer
 
 # Load environment variables
 dotenv.load_dotenv()
 
+# Config
+USE_LLM_SELECTION_FALLBACK = False  # Set to True to let a model pick the next agent when the transitions are ambiguous
+USE_STREAMING = False  # Set to True to render the agents' replies token by token and log their time to first token and tokens/s
+# The quotas of the deployment, enforced client-side across every agent and strategy; None for no limit.
+# Throttled requests are retried after their Retry-After either way.
+CHAT_COMPLETION_REQUESTS_PER_MINUTE = None
+CHAT_COMPLETION_TOKENS_PER_MINUTE = None
 azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 azure_openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
@@ -56,18 +66,24 @@ REVIEWER_NAME = "Reviewer"
 COPYWRITER_NAME = "Writer"
 
 
+# The agents and strategies share one pooled client
+kernel_factory = KernelFactory(
+    endpoint=azure_openai_endpoint,
+    deployment_name=azure_openai_deployment,
+    api_key=azure_openai_api_key,
+    api_version=azure_openai_api_version,
+    rate_limit_scheduler=RateLimitScheduler(CHAT_COMPLETION_REQUESTS_PER_MINUTE, CHAT_COMPLETION_TOKENS_PER_MINUTE),
+)
+
+
 def _create_kernel_with_chat_completion(service_id: str) -> Kernel:
-    kernel = Kernel()
-    kernel.add_service(
-        AzureChatCompletion(
-            service_id=service_id,
-            endpoint=azure_openai_endpoint,
-            deployment_name=azure_openai_deployment,
-            api_key=azure_openai_api_key,
-            api_version=azure_openai_api_version,
-        )
-    )
-    return kernel
+    return kernel_factory.create_kernel(service_id)
+
+
+def _log_agent_reply(name: str) -> None:
+    log_separator()
+    log_message(f"Invoking {name} agent")
+    log_from_agent(name)
 
 
 async def main():
@@ -142,12 +158,22 @@ async def main():
 
     chat = AgentGroupChat(
         agents=[agent_writer, agent_reviewer],
-        selection_strategy=KernelFunctionSelectionStrategy(
-            function=selection_function,
-            kernel=_create_kernel_with_chat_completion("selection"),
-            result_parser=lambda result: str(result.value[0]) if result.value is not None else COPYWRITER_NAME,
-            agent_variable_name="agents",
-            history_variable_name="history",
+        selection_strategy=StateMachineSelectionStrategy(
+            transitions={
+                USER_STATE: COPYWRITER_NAME,
+                COPYWRITER_NAME: REVIEWER_NAME,
+                REVIEWER_NAME: COPYWRITER_NAME,
+            },
+            # Only consulted for states without a single transition
+            fallback=KernelFunctionSelectionStrategy(
+                function=selection_function,
+                kernel=_create_kernel_with_chat_completion("selection"),
+                result_parser=lambda result: str(result.value[0]) if result.value is not None else COPYWRITER_NAME,
+                agent_variable_name="agents",
+                history_variable_name="history",
+            )
+            if USE_LLM_SELECTION_FALLBACK
+            else None,
         ),
         termination_strategy=KernelFunctionTerminationStrategy(
             agents=[agent_reviewer],
@@ -193,16 +219,22 @@ async def main():
 
         await chat.add_chat_message(ChatMessageContent(role=AuthorRole.USER, content=user_input))
 
-        async for response in chat.invoke():
-            log_separator()
-            log_message(f"Invoking {response.name} agent")
-            log_from_agent(response.name)
-            print(f"\033[94m{response.content}'\n")
+        if USE_STREAMING:
+            renderer = StreamRenderer(on_reply_start=_log_agent_reply)
+            async for chunk in chat.invoke_stream():
+                renderer.write(chunk)
+            renderer.close()
+        else:
+            async for response in chat.invoke():
+                _log_agent_reply(response.name)
+                print(f"\033[94m{response.content}'\n")
 
         if chat.is_complete:
             is_complete = True
             break
 
+    await close_shared_clients()
+
 if __name__ == "__main__":
     asyncio.run(main())
     
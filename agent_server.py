@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+
+from aiohttp import web
+
+from agent_sessions import SESSION_TYPES, close_shared_resources
+from artifact_store import shared_artifact_store
+from metrics import LatencyHistogram
+from sessions_pool import render_session_pools
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 300.0
+# The Retry-After of the first rejections, before any latency has been observed
+DEFAULT_RETRY_AFTER_SECONDS = 5
+
+
+class AgentService:
+    """Answers prompts over HTTP with warm agents, admitting a bounded number of requests.
+
+    `concurrency` sessions, each with its agents and code execution plugin, are created once at startup and
+    reused for every request. They share the chat completion client and, if enabled, the worker pool.
+    Up to `max_queue` requests wait for a free session; beyond that, requests are rejected with a 429 and
+    a Retry-After estimated from the observed latency.
+    """
+
+    def __init__(
+        self,
+        mode: str = "agent",
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        request_timeout_seconds: float | None = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+    ):
+        """Initializes the service; the sessions are created when the application starts.
+
+        Args:
+            mode (str): "agent" for the coder agent of code_execution_example, or "group" for the group chat
+                of agent_group_code_execution.
+            concurrency (int): The number of requests answered at once.
+            max_queue (int): The number of requests that may wait for a session.
+            request_timeout_seconds (float | None): How long answering a request may take.
+        """
+        self.session_type = SESSION_TYPES[mode]
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.request_timeout_seconds = request_timeout_seconds
+        self.waiting = 0
+        self.in_flight = 0
+        self.status_counts: dict[int, int] = {}
+        self.queue_wait = LatencyHistogram("agent_queue_wait_seconds")
+        self.latency = LatencyHistogram("agent_request_latency_seconds")
+        self._sessions: asyncio.Queue | None = None
+
+    # region Helper Methods
+    async def _start(self, app: web.Application) -> None:
+        self._sessions = asyncio.Queue()
+        for _ in range(self.concurrency):
+            self._sessions.put_nowait(self.session_type())
+        logger.info(f"AgentService: {self.concurrency} {self.session_type.__name__}s ready")
+
+    async def _stop(self, app: web.Application) -> None:
+        await close_shared_resources()
+
+    def _retry_after_seconds(self) -> int:
+        """Estimate how long until a queued request would be admitted."""
+        mean = self.latency.mean
+        if mean is None:
+            return DEFAULT_RETRY_AFTER_SECONDS
+        return max(1, math.ceil(mean * (self.waiting + 1) / self.concurrency))
+
+    def _count(self, status: int) -> None:
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def _reject(self) -> web.Response:
+        self._count(429)
+        retry_after = self._retry_after_seconds()
+        return web.json_response(
+            {"error": "Too many requests", "retry_after_seconds": retry_after},
+            status=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def _acquire(self):
+        """Wait for a free session; the caller must have checked there is room in the queue."""
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            session = await self._sessions.get()
+        finally:
+            self.waiting -= 1
+        self.queue_wait.observe(time.perf_counter() - start)
+        self.in_flight += 1
+        return session
+
+    def _release(self, session) -> None:
+        self.in_flight -= 1
+        self._sessions.put_nowait(session)
+
+    def _is_saturated(self) -> bool:
+        # Requests only wait when every session is busy
+        return self._sessions.empty() and self.waiting >= self.max_queue
+
+    async def _stream(self, request: web.Request, session, prompt: str, start: float) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(event: str, data: dict) -> None:
+            await response.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+        try:
+            try:
+                tokens = 0
+                async with asyncio.timeout(self.request_timeout_seconds):
+                    async for name, text in session.stream(prompt):
+                        await send("token", {"agent": name, "text": text})
+                        tokens += 1
+                if tokens:
+                    await send("done", {"latency_seconds": round(time.perf_counter() - start, 3)})
+                    self._count(200)
+                else:
+                    # A turn that ended without a reply, rather than a successful empty one
+                    logger.error("AgentService: The agents streamed no reply")
+                    await send("error", {"error": "The agents streamed no reply"})
+                    self._count(500)
+            except TimeoutError:
+                await send("error", {"error": f"Timed out after {self.request_timeout_seconds}s"})
+                self._count(504)
+            except ConnectionResetError:
+                raise
+            except Exception as e:
+                logger.exception("AgentService: Streaming the reply failed")
+                await send("error", {"error": f"{type(e).__name__}: {e}"})
+                self._count(500)
+            await response.write_eof()
+        except ConnectionResetError:
+            # 499, as nginx logs requests whose client closed the connection
+            logger.info("AgentService: The client disconnected from the stream")
+            self._count(499)
+        return response
+
+    # endregion
+
+    async def handle_execute(self, request: web.Request) -> web.StreamResponse:
+        """POST /v1/execute with {"prompt": "...", "stream": false}.
+
+        Replies with {"response": "...", "latency_seconds": ...}, or with server-sent events when "stream" is
+        true or the client accepts text/event-stream: a "token" event per chunk, then "done" or "error". A
+        stream without any token ends with "error".
+        """
+        try:
+            body = await request.json()
+            prompt = body["prompt"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self._count(400)
+            return web.json_response({"error": 'Expected a JSON body with a "prompt"'}, status=400)
+        stream = bool(body.get("stream")) or "text/event-stream" in request.headers.get("Accept", "")
+
+        if self._is_saturated():
+            return self._reject()
+        start = time.perf_counter()
+        session = await self._acquire()
+        try:
+            if stream:
+                return await self._stream(request, session, prompt, start)
+            try:
+                reply = await asyncio.wait_for(session.answer(prompt), self.request_timeout_seconds)
+            except asyncio.TimeoutError:
+                self._count(504)
+                return web.json_response(
+                    {"error": f"Timed out after {self.request_timeout_seconds}s"}, status=504
+                )
+            except Exception as e:
+                logger.exception("AgentService: Answering the request failed")
+                self._count(500)
+                return web.json_response({"error": f"{type(e).__name__}: {e}"}, status=500)
+            latency = time.perf_counter() - start
+            self._count(200)
+            return web.json_response({"response": reply, "latency_seconds": round(latency, 3)})
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+            self._release(session)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """GET /healthz: whether the sessions are up, and the current load."""
+        ready = self._sessions is not None
+        return web.json_response(
+            {
+                "status": "ok" if ready else "starting",
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "capacity": self.concurrency,
+                "max_queue": self.max_queue,
+            },
+            status=200 if ready else 503,
+        )
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """GET /metrics: the load, status counts and latency histograms in the Prometheus text format."""
+        lines = [
+            "# TYPE agent_queue_depth gauge",
+            f"agent_queue_depth {self.waiting}",
+            "# TYPE agent_in_flight gauge",
+            f"agent_in_flight {self.in_flight}",
+            "# TYPE agent_requests_total counter",
+            *(f'agent_requests_total{{status="{status}"}} {count}' for status, count in sorted(self.status_counts.items())),
+            *self.queue_wait.render(),
+            *self.latency.render(),
+            *render_session_pools(),
+            *shared_artifact_store.render(),
+        ]
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+    async def handle_artifact(self, request: web.Request) -> web.Response:
+        """GET /v1/artifacts/{digest}: a figure or file referenced by a reply, as artifact://{digest}."""
+        artifact = shared_artifact_store.get(request.match_info["digest"])
+        if artifact is None:
+            return web.json_response({"error": "The artifact does not exist or was evicted"}, status=404)
+        return web.Response(
+            body=artifact.data,
+            content_type=artifact.media_type,
+            headers={"Content-Disposition": f'inline; filename="{artifact.name}"'},
+        )
+
+    def create_app(self) -> web.Application:
+        """Create the aiohttp application serving the endpoints."""
+        app = web.Application()
+        app.router.add_post("/v1/execute", self.handle_execute)
+        app.router.add_get("/v1/artifacts/{digest}", self.handle_artifact)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the code execution agent over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-m", "--mode", choices=sorted(SESSION_TYPES), default="agent", help="The agent or group chat to serve")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="The requests answered at once")
+    parser.add_argument("-q", "--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="The requests that may wait")
+    parser.add_argument("-t", "--timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT_SECONDS, help="The seconds a request may take")
+    args = parser.parse_args()
+
+    service = AgentService(args.mode, args.concurrency, args.max_queue, args.timeout)
+    web.run_app(service.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from collections.abc import AsyncIterable
+
+from rate_limiter import new_conversation
+
+
+class AgentSession:
+    """Answers prompts with the coder agent of code_execution_example, reusing its kernel and plugin.
+
+    Each prompt is a new conversation, in a fresh code execution session. A session answers one prompt
+    at a time; create one per concurrent prompt.
+    """
+
+    def __init__(self):
+        # Imported here, so only the mode in use sets up its agents
+        import code_execution_example
+
+        self._module = code_execution_example
+        self._plugin = code_execution_example._create_code_execution_plugin()
+        self._agent = code_execution_example.create_coder_agent(self._plugin)
+
+    async def _new_history(self, prompt: str):
+        from semantic_kernel.contents.chat_history import ChatHistory
+
+        await self._module._reset_code_execution_session(self._plugin)
+        history = ChatHistory()
+        history.add_user_message(prompt)
+        return history
+
+    async def answer(self, prompt: str) -> str:
+        """Return the reply of the agent to the prompt."""
+        from semantic_kernel.contents.chat_history import ChatHistory
+
+        await self._module._reset_code_execution_session(self._plugin)
+        # Waits behind the calls of the conversations already in flight when the quota is tight
+        with new_conversation():
+            message = await self._module.invoke_agent(self._agent, "User", prompt, ChatHistory())
+        return str(message.content)
+
+    async def stream(self, prompt: str) -> AsyncIterable[tuple[str, str]]:
+        """Yield the name of the agent and the text of each chunk of its reply, as they arrive."""
+        with new_conversation():
+            async for chunk in self._agent.invoke_stream(await self._new_history(prompt)):
+                if chunk.content:
+                    yield chunk.name or "", chunk.content
+
+
+class GroupChatSession:
+    """Answers prompts with the group chat of agent_group_code_execution, reusing its agents and plugin.
+
+    Each prompt is a new conversation, in a fresh code execution session. A session answers one prompt
+    at a time; create one per concurrent prompt.
+    """
+
+    def __init__(self):
+        import agent_group_code_execution
+
+        self._module = agent_group_code_execution
+        self._plugin = agent_group_code_execution._create_code_execution_plugin()
+        self._chat = agent_group_code_execution.create_group_chat(self._plugin)
+
+    async def _start(self, prompt: str) -> None:
+        from semantic_kernel.contents.chat_message_content import ChatMessageContent
+        from semantic_kernel.contents.utils.author_role import AuthorRole
+
+        await self._chat.reset()
+        self._chat.is_complete = False
+        await self._module._reset_code_execution_session(self._plugin)
+        await self._chat.add_chat_message(ChatMessageContent(role=AuthorRole.USER, content=prompt))
+
+    async def answer(self, prompt: str) -> str:
+        """Return the last reply of the group chat to the prompt."""
+        await self._start(prompt)
+        response = None
+        with new_conversation():
+            async for message in self._chat.invoke():
+                response = message.content
+        return str(response)
+
+    async def stream(self, prompt: str) -> AsyncIterable[tuple[str, str]]:
+        """Yield the name of the agent and the text of each chunk of the replies, as they arrive."""
+        await self._start(prompt)
+        with new_conversation():
+            async for chunk in self._chat.invoke_stream():
+                if chunk.content:
+                    yield chunk.name or "", chunk.content
+
+
+SESSION_TYPES = {"agent": AgentSession, "group": GroupChatSession}
+
+
+async def close_shared_resources() -> None:
+    """Close the chat completion clients, token providers and sessions pools shared by the sessions."""
+    from kernel_factory import close_shared_clients
+    from sessions_pool import close_session_pools
+    from token_provider import close_token_providers
+
+    await close_shared_clients()
+    await close_token_providers()
+    await close_session_pools()
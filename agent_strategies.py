@@ -0,0 +1,172 @@
+import logging
+import re
+from typing import TYPE_CHECKING
+
+from pydantic import Field
+
+from semantic_kernel.agents.strategies.selection.selection_strategy import SelectionStrategy
+from semantic_kernel.agents.strategies.termination.termination_strategy import TerminationStrategy
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+from semantic_kernel.exceptions.agent_exceptions import AgentExecutionException
+from history_reducer import HistoryReducer
+
+if TYPE_CHECKING:
+    from semantic_kernel.agents import Agent
+
+logger = logging.getLogger(__name__)
+
+# The state of a conversation whose last message comes from the user
+USER_STATE = AuthorRole.USER.value
+# The markers of failed executions: both plugins format their results as "Status:\n<status>\nResult:...", and
+# the LocalPythonPlugin prefixes the result of a failure outside the executed code with "Error executing code"
+DEFAULT_FAILURE_MARKERS = ("Status:\nFailure", "Error executing code")
+
+
+def _conversation_state(history: list[ChatMessageContent]) -> str:
+    """Return the name of the agent that wrote the last message, or USER_STATE.
+
+    Tool results are skipped, since they belong to the turn of the agent that called the tool.
+    """
+    for message in reversed(history):
+        if message.role == AuthorRole.USER:
+            return USER_STATE
+        if message.role == AuthorRole.ASSISTANT and message.name:
+            return message.name
+    return USER_STATE
+
+
+class StateMachineSelectionStrategy(SelectionStrategy):
+    """Selects the next agent from declared transitions between agent names, without calling a model.
+
+    `transitions` maps the author of the last message, an agent name or USER_STATE, to the agent or
+    agents that may take the next turn. A state with a single candidate is resolved in-process. A state
+    with several candidates, or no transition, is ambiguous: it is resolved by `fallback`, e.g. a
+    KernelFunctionSelectionStrategy offered only the candidates, or else by taking the first candidate.
+    The fallback is given the history reduced by `history_reducer`, if set.
+    """
+
+    transitions: dict[str, str | list[str]] = Field(default_factory=dict)
+    fallback: SelectionStrategy | None = None
+    history_reducer: HistoryReducer | None = None
+
+    async def next(self, agents: list["Agent"], history: list[ChatMessageContent]) -> "Agent":
+        """Select the next agent from the transition of the current conversation state.
+
+        Args:
+            agents: The list of agents to select from.
+            history: The history of messages in the conversation.
+
+        Returns:
+            The next agent to interact with.
+
+        Raises:
+            AgentExecutionException: If a transition names an agent that is not in the chat.
+        """
+        state = _conversation_state(history)
+        targets = self.transitions.get(state)
+        if targets is None:
+            candidates = list(agents)
+        else:
+            names = [targets] if isinstance(targets, str) else targets
+            agents_by_name = {agent.name: agent for agent in agents}
+            missing = [name for name in names if name not in agents_by_name]
+            if missing:
+                raise AgentExecutionException(
+                    f"Agent Failure - Strategy unable to select next agent: {', '.join(missing)}"
+                )
+            candidates = [agents_by_name[name] for name in names]
+
+        if len(candidates) == 1:
+            logger.info(f"StateMachineSelectionStrategy: {state} -> {candidates[0].name}")
+            return candidates[0]
+        if self.fallback is not None and candidates:
+            logger.info(f"StateMachineSelectionStrategy: {state} is ambiguous, consulting the fallback strategy")
+            if self.history_reducer is not None:
+                history = await self.history_reducer.reduce(history)
+            return await self.fallback.next(candidates, history)
+        if not candidates:
+            raise AgentExecutionException("Agent Failure - Strategy unable to determine next agent.")
+        logger.info(f"StateMachineSelectionStrategy: {state} -> {candidates[0].name} (first candidate)")
+        return candidates[0]
+
+
+def _latest_turn(agent: "Agent", history: list[ChatMessageContent]) -> list[ChatMessageContent]:
+    """Return the messages of the agent's latest turn, including its tool calls and their results."""
+    start = len(history)
+    while start > 0:
+        message = history[start - 1]
+        if message.role == AuthorRole.USER or (message.role == AuthorRole.ASSISTANT and message.name != agent.name):
+            break
+        start -= 1
+    return history[start:]
+
+
+class LayeredTerminationStrategy(TerminationStrategy):
+    """Decides termination with local checks first, and consults `fallback` only when they are inconclusive.
+
+    The checks run in order on the agent's latest turn:
+    1. The agent has replied `max_turns` times since the last user message: terminate.
+    2. A tool result or reply contains one of `failure_markers`: continue, so the failure can be fixed.
+    3. The reply matches `termination_pattern`: terminate.
+    4. `terminate_on_tool_success` is set and the turn called tools that all succeeded: terminate.
+    Otherwise the decision is left to `fallback`, e.g. a KernelFunctionTerminationStrategy, or is `default`.
+    The fallback is given the history reduced by `history_reducer`, if set.
+    """
+
+    max_turns: int | None = None
+    failure_markers: list[str] = Field(default_factory=lambda: list(DEFAULT_FAILURE_MARKERS))
+    termination_pattern: str | None = None
+    terminate_on_tool_success: bool = True
+    fallback: TerminationStrategy | None = None
+    default: bool = False
+    history_reducer: HistoryReducer | None = None
+
+    def _check_locally(self, agent: "Agent", history: list[ChatMessageContent]) -> bool | None:
+        """Return the decision of the local checks, or None if they are inconclusive."""
+        if self.max_turns is not None:
+            turns = 0
+            for message in reversed(history):
+                if message.role == AuthorRole.USER:
+                    break
+                if message.role == AuthorRole.ASSISTANT and message.name == agent.name and message.content:
+                    turns += 1
+            if turns >= self.max_turns:
+                return True
+
+        turn = _latest_turn(agent, history)
+        tool_results = [
+            str(item.result) for message in turn for item in message.items if isinstance(item, FunctionResultContent)
+        ]
+        texts = tool_results + [message.content for message in turn if message.content]
+        if any(marker in text for marker in self.failure_markers for text in texts):
+            return False
+
+        reply = history[-1].content if history else ""
+        if self.termination_pattern is not None and re.search(self.termination_pattern, reply or ""):
+            return True
+        if self.terminate_on_tool_success and tool_results:
+            return True
+        return None
+
+    async def should_agent_terminate(self, agent: "Agent", history: list[ChatMessageContent]) -> bool:
+        """Check if the agent should terminate.
+
+        Args:
+            agent: The agent to check.
+            history: The history of messages in the conversation.
+
+        Returns:
+            True if the agent should terminate, False otherwise
+        """
+        decision = self._check_locally(agent, history)
+        if decision is not None:
+            logger.info(f"LayeredTerminationStrategy: Decided locally, should terminate: {decision}")
+            return decision
+        if self.fallback is not None:
+            logger.info("LayeredTerminationStrategy: Local checks inconclusive, consulting the fallback strategy")
+            if self.history_reducer is not None:
+                history = await self.history_reducer.reduce(history)
+            return await self.fallback.should_agent_terminate(agent, history)
+        return self.default
@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from execution_result import CapturedArtifact
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ARTIFACTS = 256
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ARTIFACT_URI_PREFIX = "artifact://"
+
+
+@dataclass
+class StoredArtifact:
+    """An artifact held by the ArtifactStore, under the SHA-256 digest of its content."""
+
+    digest: str
+    name: str
+    media_type: str
+    data: bytes
+    # The base64 encoding, computed on the first request for it
+    encoded: str | None = None
+
+    @property
+    def uri(self) -> str:
+        return f"{ARTIFACT_URI_PREFIX}{self.digest}"
+
+    def reference(self) -> dict:
+        """Return the lightweight reference given to the agents in place of the content."""
+        return {"uri": self.uri, "name": self.name, "media_type": self.media_type, "size_bytes": len(self.data)}
+
+
+class ArtifactStore:
+    """A content-addressed in-memory store of the figures and files produced by code executions.
+
+    Artifacts are keyed by the SHA-256 digest of their content, so an artifact produced again, e.g. the same
+    plot by a retried snippet, is stored once and its base64 encoding computed once. The least recently used
+    artifacts are evicted beyond `max_artifacts` or `max_bytes` in total.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_artifacts: int = DEFAULT_MAX_ARTIFACTS):
+        """Initializes the store.
+
+        Args:
+            max_bytes (int): The maximum total size of the stored artifacts.
+            max_artifacts (int): The maximum number of stored artifacts.
+        """
+        self.max_bytes = max_bytes
+        self.max_artifacts = max_artifacts
+        self.size_bytes = 0
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self._artifacts: OrderedDict[str, StoredArtifact] = OrderedDict()
+        self._lock = threading.Lock()
+
+    # region Helper Methods
+    def _evict(self) -> None:
+        while self._artifacts and (len(self._artifacts) > self.max_artifacts or self.size_bytes > self.max_bytes):
+            _, artifact = self._artifacts.popitem(last=False)
+            self.size_bytes -= len(artifact.data)
+            self.evicted += 1
+
+    # endregion
+
+    def put(self, artifact: CapturedArtifact) -> dict | None:
+        """Store a captured artifact, unless an identical one is stored already, and return its reference.
+
+        Returns:
+            dict | None: The reference of the artifact, or None if it is larger than the whole store.
+        """
+        if len(artifact.data) > self.max_bytes:
+            logger.warning(f"ArtifactStore: {artifact.name} is larger than the store, {len(artifact.data)} bytes")
+            return None
+        digest = hashlib.sha256(artifact.data).hexdigest()
+        with self._lock:
+            stored = self._artifacts.get(digest)
+            if stored is not None:
+                self._artifacts.move_to_end(digest)
+                self.deduplicated += 1
+                return stored.reference()
+            stored = self._artifacts[digest] = StoredArtifact(digest, artifact.name, artifact.media_type, artifact.data)
+            self.size_bytes += len(artifact.data)
+            self.stored += 1
+            self._evict()
+            return stored.reference()
+
+    def get(self, uri: str) -> StoredArtifact | None:
+        """Return the artifact of a reference URI, or its bare digest, or None if it was evicted."""
+        digest = uri.removeprefix(ARTIFACT_URI_PREFIX)
+        with self._lock:
+            artifact = self._artifacts.get(digest)
+            if artifact is not None:
+                self._artifacts.move_to_end(digest)
+            return artifact
+
+    def encoded(self, uri: str) -> str | None:
+        """Return the base64 encoding of an artifact, e.g. to embed it in a data URL, or None if it was evicted."""
+        artifact = self.get(uri)
+        if artifact is None:
+            return None
+        if artifact.encoded is None:
+            artifact.encoded = base64.b64encode(artifact.data).decode("ascii")
+        return artifact.encoded
+
+    def metrics(self) -> dict[str, int]:
+        """Return the size of the store and its counts of stored, deduplicated and evicted artifacts."""
+        with self._lock:
+            return {
+                "artifacts": len(self._artifacts),
+                "size_bytes": self.size_bytes,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted,
+            }
+
+    def render(self) -> list[str]:
+        """Return the metrics in the Prometheus text exposition format."""
+        metrics = self.metrics()
+        lines = []
+        for name in ("artifacts", "size_bytes"):
+            lines += [f"# TYPE artifact_store_{name} gauge", f"artifact_store_{name} {metrics[name]}"]
+        for name in ("stored", "deduplicated", "evicted"):
+            lines += [f"# TYPE artifact_store_{name}_total counter", f"artifact_store_{name}_total {metrics[name]}"]
+        return lines
+
+    def clear(self) -> None:
+        """Remove every stored artifact."""
+        with self._lock:
+            self._artifacts.clear()
+            self.size_bytes = 0
+
+
+shared_artifact_store = ArtifactStore()
@@ -0,0 +1,53 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_AUDIT_LOG_PATH = "generated_code.log"
+DEFAULT_AUDIT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_AUDIT_LOG_BACKUP_COUNT = 5
+
+
+class CodeAuditLog:
+    """An append-only, rotating audit log of the generated code.
+
+    Records are handed to a background thread through a queue, so recording never blocks the
+    caller on file I/O, and concurrent sessions append to the log instead of overwriting one file.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_AUDIT_LOG_PATH,
+        max_bytes: int = DEFAULT_AUDIT_LOG_MAX_BYTES,
+        backup_count: int = DEFAULT_AUDIT_LOG_BACKUP_COUNT,
+    ):
+        """Initializes the audit log and starts its writer thread.
+
+        Args:
+            path (str): The path of the log file.
+            max_bytes (int): Rotate the log file once it reaches this size.
+            backup_count (int): The number of rotated log files to keep.
+        """
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("# %(asctime)s session=%(session_id)s\n%(message)s\n"))
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._file_handler = file_handler
+        self._listener = QueueListener(self._queue, file_handler)
+        self._listener.start()
+        self._closed = False
+
+        # A standalone logger, so records do not propagate to the application's handlers
+        self._logger = logging.Logger(f"{__name__}.{path}")
+        self._logger.addHandler(QueueHandler(self._queue))
+
+    def record(self, code: str, session_id: str | None = None) -> None:
+        """Queue the code for writing to the audit log."""
+        self._logger.info(code, extra={"session_id": session_id or "-"})
+
+    def close(self) -> None:
+        """Flush the queued records and stop the writer thread; later calls do nothing."""
+        if self._closed:
+            return
+        self._closed = True
+        self._listener.stop()
+        self._file_handler.close()
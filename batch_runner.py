@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections.abc import Iterator, Sequence
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from agent_sessions import SESSION_TYPES, close_shared_resources
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ID_FIELDS = ("request_id", "id")
+# A "prompt" field, or else the "title" and "body" fields joined, as in requests.jsonl
+DEFAULT_PROMPT_FIELDS = ("prompt", "title", "body")
+DEFAULT_CONCURRENCY = 4
+DEFAULT_OUTPUT_PATH = "batch_results.jsonl"
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+
+
+@dataclass
+class BatchRequest:
+    """A prompt read from the input file."""
+
+    id: str
+    prompt: str
+
+
+@dataclass
+class BatchResult:
+    """The outcome of a request, written as a line of the output file.
+
+    Attributes:
+        id (str): The identifier of the request.
+        status (str): STATUS_OK, STATUS_ERROR or STATUS_TIMEOUT.
+        latency_seconds (float): How long the agent took to answer.
+        response (str | None): The last reply of the agent.
+        error (str | None): Why the request failed.
+        started_at (str): When the request started, in ISO 8601 format.
+    """
+
+    id: str
+    status: str
+    latency_seconds: float
+    response: str | None = None
+    error: str | None = None
+    started_at: str = ""
+
+
+def read_requests(
+    path: str,
+    id_fields: Sequence[str] = DEFAULT_ID_FIELDS,
+    prompt_fields: Sequence[str] = DEFAULT_PROMPT_FIELDS,
+) -> Iterator[BatchRequest]:
+    """Read the requests of a JSONL file one line at a time, so the file is never loaded whole.
+
+    The prompt is the first of `prompt_fields` if the record has it, or else the other fields it has, joined.
+    A request without an identifier is identified by its line number. Lines that are not JSON objects or
+    have no prompt are skipped.
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping line {line_number} of {path}: {e}")
+                continue
+            if not isinstance(record, dict):
+                logger.warning(f"Skipping line {line_number} of {path}: not a JSON object")
+                continue
+            request_id = next((str(record[field]) for field in id_fields if record.get(field)), f"line-{line_number}")
+            if record.get(prompt_fields[0]):
+                prompt = str(record[prompt_fields[0]])
+            else:
+                prompt = "\n\n".join(str(record[field]) for field in prompt_fields[1:] if record.get(field))
+            if not prompt:
+                logger.warning(f"Skipping line {line_number} of {path}: no prompt in {', '.join(prompt_fields)}")
+                continue
+            yield BatchRequest(id=request_id, prompt=prompt)
+
+
+def completed_ids(output_path: str) -> set[str]:
+    """Return the identifiers of the requests that already succeeded, according to the output file.
+
+    A line left incomplete by a crash is ignored, so its request runs again.
+    """
+    done: set[str] = set()
+    try:
+        with open(output_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and record.get("status") == STATUS_OK:
+                    done.add(str(record.get("id")))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str = DEFAULT_OUTPUT_PATH,
+    mode: str = "agent",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout_seconds: float | None = None,
+    id_fields: Sequence[str] = DEFAULT_ID_FIELDS,
+    prompt_fields: Sequence[str] = DEFAULT_PROMPT_FIELDS,
+) -> dict[str, int]:
+    """Answer the prompts of a JSONL file concurrently, appending each result to the output file as it completes.
+
+    Each of the `concurrency` workers creates its agents once and reuses them for every prompt it takes,
+    with a new conversation and code execution session per prompt. Requests that already succeeded
+    according to the output file are skipped, so a crashed run is resumed by running it again.
+
+    Args:
+        input_path (str): The JSONL file of the requests.
+        output_path (str): The JSONL file the results are appended to.
+        mode (str): "agent" to use the coder agent of code_execution_example, or "group" to use the
+            group chat of agent_group_code_execution.
+        concurrency (int): The maximum number of requests answered at once.
+        timeout_seconds (float | None): How long a request may take, without limit if None.
+        id_fields (Sequence[str]): The fields holding the identifier of a request, the first one found is used.
+        prompt_fields (Sequence[str]): The fields holding the prompt, see read_requests.
+    Returns:
+        dict[str, int]: The number of requests by status, and of requests skipped as already done.
+    """
+    session_type = SESSION_TYPES[mode]
+    done = completed_ids(output_path)
+    counts = {STATUS_OK: 0, STATUS_ERROR: 0, STATUS_TIMEOUT: 0, "skipped": 0}
+    # Bounded, so the input file is read only as fast as the requests are answered
+    queue: asyncio.Queue[BatchRequest | None] = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def produce() -> None:
+        for request in read_requests(input_path, id_fields, prompt_fields):
+            if request.id in done:
+                counts["skipped"] += 1
+                continue
+            # Also skips the duplicates of the input file
+            done.add(request.id)
+            await queue.put(request)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work(output) -> None:
+        session = session_type()
+        while (request := await queue.get()) is not None:
+            started_at = datetime.now(timezone.utc).isoformat()
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(session.answer(request.prompt), timeout_seconds)
+                result = BatchResult(request.id, STATUS_OK, 0.0, response=response)
+            except asyncio.TimeoutError:
+                result = BatchResult(request.id, STATUS_TIMEOUT, 0.0, error=f"Timed out after {timeout_seconds}s")
+            except Exception as e:
+                logger.exception(f"Request {request.id} failed")
+                result = BatchResult(request.id, STATUS_ERROR, 0.0, error=f"{type(e).__name__}: {e}")
+            result.latency_seconds = round(time.perf_counter() - start, 3)
+            result.started_at = started_at
+            counts[result.status] += 1
+            # One write per line, flushed, so a crash loses at most the requests in flight
+            output.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+            output.flush()
+            logger.info(f"Request {request.id}: {result.status} in {result.latency_seconds}s")
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        try:
+            await asyncio.gather(produce(), *(work(output) for _ in range(concurrency)))
+        finally:
+            await close_shared_resources()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Answer the prompts of a JSONL file without user interaction.")
+    parser.add_argument("input", help="The JSONL file of the requests, e.g. requests.jsonl")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_PATH, help="The JSONL file the results are appended to")
+    parser.add_argument("-m", "--mode", choices=sorted(SESSION_TYPES), default="agent", help="The agent or group chat to use")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="The requests answered at once")
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="The seconds a request may take")
+    parser.add_argument("--id-fields", nargs="+", default=list(DEFAULT_ID_FIELDS))
+    parser.add_argument("--prompt-fields", nargs="+", default=list(DEFAULT_PROMPT_FIELDS))
+    args = parser.parse_args()
+
+    counts = asyncio.run(
+        run_batch(
+            args.input,
+            args.output,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            timeout_seconds=args.timeout,
+            id_fields=args.id_fields,
+            prompt_fields=args.prompt_fields,
+        )
+    )
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,81 @@
+import atexit
 import os
 import dotenv
-import datetime
 import logging
 import tempfile
+import time
 
-from azure.core.exceptions import ClientAuthenticationError
-from azure.identity import DefaultAzureCredential
-from functools import reduce
-from semantic_kernel import Kernel
-from semantic_kernel.agents.chat_completion.chat_completion_agent import (
-    ChatCompletionAgent,
-)
+from uuid import uuid4
 from semantic_kernel.connectors.ai.function_choice_behavior import (
     FunctionChoiceBehavior,
 )
 from semantic_kernel.connectors.ai.open_ai.prompt_execution_settings.azure_chat_prompt_execution_settings import (
     AzureChatPromptExecutionSettings,
 )
-from semantic_kernel.connectors.ai.open_ai.services.azure_chat_completion import (
-    AzureChatCompletion,
-)
 from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.utils.author_role import AuthorRole
 from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import (
     SessionsPythonTool,
 )
-from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
 from logging_utils import log_message, log_flow, log_separator
-from local_python_plugin import LocalPythonPlugin
+from artifact_store import shared_artifact_store
+from audit_log import CodeAuditLog
+from execution_router import ExecutionRouterPlugin, LocalBackend, SessionsBackend
+from execution_result import ExecutionEvent, ExecutionLimits
+from fake_chat_completion import PipelineProfile, create_fake_chat_completion_factory, load_script
+from kernel_factory import KernelFactory, close_shared_clients
+from local_python_plugin import ARTIFACT_DIRECTORY_HINT, AsyncLocalPythonPlugin
+from rate_limiter import RateLimitScheduler
+from result_cache import ExecutionResultCache
+from sessions_pool import WarmSessionPool, close_session_pools, register_session_pool
+from sessions_pool_server import (
+    DEFAULT_POOL_MANAGEMENT_ENDPOINT,
+    create_local_sessions_http_client,
+    local_sessions_auth_callback,
+)
+from stream_renderer import StreamRenderer
+from streaming_agent import ToolReplyChatCompletionAgent
+from token_provider import COGNITIVE_SERVICES_SCOPE, SESSIONS_SCOPE, close_token_providers, get_token_provider
+from worker_pool import WorkerPool
 
 # Config
 dotenv.load_dotenv()
-streaming = False
+streaming = False  # Set to True to render the reply token by token and log its time to first token and tokens/s
 USE_CODE_INTERPRETER_SESSIONS_TOOL = False  # Set to False to use LocalPythonPlugin
+USE_LOCAL_WORKER_POOL = False  # Set to True to run LocalPythonPlugin code in warm worker processes
+LOCAL_WORKER_POOL_PRELOAD_MODULES = ("math",)  # e.g. ("math", "numpy", "pandas")
+AUDIT_GENERATED_CODE = False  # Set to True to append the generated code to a rotating generated_code.log
+# Set to True to keep the figures and files produced by LocalPythonPlugin code in the shared artifact store;
+# the agents then get references to them instead of nothing
+CAPTURE_ARTIFACTS = False
+CACHE_EXECUTION_RESULTS = False  # Set to True to reuse the results of deterministic snippets (runs each snippet in a fresh namespace)
+EXECUTION_RESULT_CACHE_PATH = "execution_result_cache.db"  # Set to None to keep the cache in memory only
+# Per-execution limits; only max_output_chars applies unless USE_LOCAL_WORKER_POOL is True
+LOCAL_EXECUTION_LIMITS = ExecutionLimits(
+    wall_clock_seconds=60, cpu_seconds=60, memory_bytes=2 * 1024 * 1024 * 1024, max_output_chars=1_000_000
+)
 azure_code_interpreter_pool_endpoint = os.getenv("AZURE_CODE_INTERPRETER_POOL_ENDPOINT")
+# Set to True, with USE_CODE_INTERPRETER_SESSIONS_TOOL, to run the code in the local pool of sessions_pool_server.py,
+# at AZURE_CODE_INTERPRETER_POOL_ENDPOINT or else https://127.0.0.1:8090/ (served over plain http)
+USE_LOCAL_SESSIONS_POOL = False
+# Session identifiers kept warm and leased to conversations, so their first execution does not wait for a
+# session to be allocated; 0 to start every conversation on a new identifier
+SESSIONS_POOL_WARM_SESSIONS = 4
+SESSIONS_POOL_MAX_LEASE_WAIT_SECONDS = 5.0  # How long a conversation waits for a warm session before starting cold
+SESSIONS_POOL_RECYCLE = "reset"  # "reset" to clear released sessions and lease them again, or "discard"
+# Set to True to route each execution to LocalPythonPlugin or to the sessions pool from live load, latency, cost
+# and isolation signals, failing over between them (ignores USE_CODE_INTERPRETER_SESSIONS_TOOL)
+USE_EXECUTION_ROUTER = False
+# The quotas of the deployment, enforced client-side across every agent and strategy; None for no limit.
+# Throttled requests are retried after their Retry-After either way.
+CHAT_COMPLETION_REQUESTS_PER_MINUTE = None
+CHAT_COMPLETION_TOKENS_PER_MINUTE = None
+# Set to True to replay the scripted replies of FAKE_CHAT_COMPLETION_SCRIPT instead of calling Azure OpenAI,
+# and log how the time splits between the model, the code execution and the orchestration
+USE_FAKE_CHAT_COMPLETION = False
+FAKE_CHAT_COMPLETION_SCRIPT = "fake_chat_script.json"
+FAKE_CHAT_COMPLETION_LATENCY_SECONDS = 0.5  # The simulated time to first token
+FAKE_CHAT_COMPLETION_TOKENS_PER_SECOND = 50.0
 azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 azure_openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
@@ -45,118 +88,226 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_worker_pool: WorkerPool | None = None
 
-def auth_callback_factory(scope):
-    auth_token = None
 
-    async def auth_callback() -> str:
-        """Auth callback for the SessionsPythonTool.
-        This is a sample auth callback that shows how to use Azure's DefaultAzureCredential
-        to get an access token.
-        """
-        nonlocal auth_token
-        current_utc_timestamp = int(
-            datetime.datetime.now(datetime.timezone.utc).timestamp()
-        )
+def _get_worker_pool() -> WorkerPool | None:
+    """Lazily start the worker pool shared by every LocalPythonPlugin in this process."""
+    global _worker_pool
+    if USE_LOCAL_WORKER_POOL and _worker_pool is None:
+        _worker_pool = WorkerPool(preload_modules=LOCAL_WORKER_POOL_PRELOAD_MODULES)
+    return _worker_pool
 
-        if not auth_token or auth_token.expires_on < current_utc_timestamp:
-            credential = DefaultAzureCredential()
 
-            try:
-                auth_token = credential.get_token(scope)
-            except ClientAuthenticationError as cae:
-                err_messages = getattr(cae, "messages", [])
-                raise FunctionExecutionException(
-                    f"Failed to retrieve the client auth token with messages: {' '.join(err_messages)}"
-                ) from cae
+_code_audit_log: CodeAuditLog | None = None
 
-        return auth_token.token
 
-    return auth_callback
+def _get_code_audit_log() -> CodeAuditLog | None:
+    """Lazily open the generated code audit log shared by every LocalPythonPlugin in this process."""
+    global _code_audit_log
+    if AUDIT_GENERATED_CODE and _code_audit_log is None:
+        _code_audit_log = CodeAuditLog()
+        # Writes the records still queued when the process exits, whichever entry point started it
+        atexit.register(_code_audit_log.close)
+    return _code_audit_log
 
 
-async def invoke_agent(
-    agent: ChatCompletionAgent, to_agent: str, input: str, history: ChatHistory
-):
-    """Invoke the agent with the user input."""
-    history.add_user_message(input)
+def _print_execution_event(event: ExecutionEvent) -> None:
+    """Show the output of the code executed by the agent as it is produced."""
+    if event.kind in ("stdout", "stderr"):
+        print(f"\033[90m{event.text}\033[0m", end="", flush=True)
 
-    if streaming:
-        contents = []
-        content_name = ""
-        async for content in agent.invoke_stream(history):
-            content_name = content.name
-            contents.append(content)
-        streaming_chat_message = reduce(lambda first, second: first + second, contents)
-        log_flow(content_name, to_agent)
-        print(f"\033[94m{streaming_chat_message}'\n")
-        history.add_message(content)
-    else:
-        async for content in agent.invoke(history):
-            log_flow(content.name, to_agent)
-            print(f"\033[94m{content.content}'\n")
-            history.add_message(content)
 
-    if history.messages:
-        last_message = history.messages[-1]
-    return last_message
+def _create_local_python_plugin() -> AsyncLocalPythonPlugin:
+    # When streaming, the output of the executed code is shown live instead of only once the agent replies
+    event_listener = _print_execution_event if streaming else None
+    if CACHE_EXECUTION_RESULTS:
+        return AsyncLocalPythonPlugin(
+            worker_pool=_get_worker_pool(),
+            audit_log=_get_code_audit_log(),
+            session_id=None,
+            result_cache=ExecutionResultCache(path=EXECUTION_RESULT_CACHE_PATH),
+            execution_limits=LOCAL_EXECUTION_LIMITS,
+            event_listener=event_listener,
+            artifact_store=shared_artifact_store if CAPTURE_ARTIFACTS else None,
+        )
+    return AsyncLocalPythonPlugin(
+        worker_pool=_get_worker_pool(),
+        audit_log=_get_code_audit_log(),
+        event_listener=event_listener,
+        execution_limits=LOCAL_EXECUTION_LIMITS,
+        artifact_store=shared_artifact_store if CAPTURE_ARTIFACTS else None,
+    )
 
 
-async def main():
-    message = input("Enter your message: ")
+pipeline_profile = PipelineProfile()
+
+kernel_factory = KernelFactory(
+    endpoint=azure_openai_endpoint,
+    deployment_name=azure_openai_deployment,
+    api_key=azure_openai_api_key,
+    api_version=azure_openai_api_version,
+    # Azure AD authentication when no API key is set
+    ad_token_provider=None if azure_openai_api_key else get_token_provider(COGNITIVE_SERVICES_SCOPE),
+    rate_limit_scheduler=RateLimitScheduler(CHAT_COMPLETION_REQUESTS_PER_MINUTE, CHAT_COMPLETION_TOKENS_PER_MINUTE),
+    chat_completion_factory=create_fake_chat_completion_factory(
+        load_script(FAKE_CHAT_COMPLETION_SCRIPT),
+        latency_seconds=FAKE_CHAT_COMPLETION_LATENCY_SECONDS,
+        tokens_per_second=FAKE_CHAT_COMPLETION_TOKENS_PER_SECOND,
+        profile=pipeline_profile,
+    )
+    if USE_FAKE_CHAT_COMPLETION
+    else None,
+)
 
-    # Instantiate the Kernel
-    kernel = Kernel()
 
-    # Add AzureChatCompletion service for the agent.
-    kernel.add_service(
-        AzureChatCompletion(
-            service_id="coder_agent",
-            # ad_token_provider=auth_callback_factory(
-            #     "https://cognitiveservices.azure.com/.default"
-            # ),
-            endpoint=azure_openai_endpoint,
-            deployment_name=azure_openai_deployment,
-            api_key=azure_openai_api_key,
-            api_version=azure_openai_api_version,
+CodeExecutionPlugin = SessionsPythonTool | AsyncLocalPythonPlugin | ExecutionRouterPlugin
+
+_sessions_pool: WarmSessionPool | None = None
+
+
+def _get_sessions_pool() -> WarmSessionPool | None:
+    """Lazily create the pool of warm sessions shared by every SessionsPythonTool in this process."""
+    global _sessions_pool
+    if (USE_CODE_INTERPRETER_SESSIONS_TOOL or USE_EXECUTION_ROUTER) and SESSIONS_POOL_WARM_SESSIONS and _sessions_pool is None:
+        _sessions_pool = register_session_pool(
+            WarmSessionPool(
+                _get_pool_management_endpoint(),
+                _get_sessions_auth_callback(),
+                warm_sessions=SESSIONS_POOL_WARM_SESSIONS,
+                max_lease_wait_seconds=SESSIONS_POOL_MAX_LEASE_WAIT_SECONDS,
+                recycle=SESSIONS_POOL_RECYCLE,
+                http_client=create_local_sessions_http_client() if USE_LOCAL_SESSIONS_POOL else None,
+            )
         )
+    return _sessions_pool
+
+
+def _get_pool_management_endpoint() -> str | None:
+    if USE_LOCAL_SESSIONS_POOL:
+        return azure_code_interpreter_pool_endpoint or DEFAULT_POOL_MANAGEMENT_ENDPOINT
+    return azure_code_interpreter_pool_endpoint
+
+
+def _get_sessions_auth_callback():
+    return local_sessions_auth_callback if USE_LOCAL_SESSIONS_POOL else get_token_provider(SESSIONS_SCOPE)
+
+
+def _get_code_execution_plugin_name() -> str:
+    if USE_EXECUTION_ROUTER:
+        return "CodeExecutionRouter"
+    return "CodeInterpreterSessionsTool" if USE_CODE_INTERPRETER_SESSIONS_TOOL else "LocalCodeExecutionTool"
+
+
+def _create_sessions_python_tool() -> SessionsPythonTool:
+    sessions_pool = _get_sessions_pool()
+    if sessions_pool is not None:
+        # The plugins share the connections of the pool
+        http_client = sessions_pool.http_client
+    else:
+        http_client = create_local_sessions_http_client() if USE_LOCAL_SESSIONS_POOL else None
+    return SessionsPythonTool(
+        auth_callback=_get_sessions_auth_callback(),
+        pool_management_endpoint=_get_pool_management_endpoint(),
+        http_client=http_client,
     )
 
-    if USE_CODE_INTERPRETER_SESSIONS_TOOL:
-        # Add the code interpreter sessions pool to the Kernel
-        kernel.add_plugin(
-            plugin_name="CodeInterpreterSessionsTool",
-            plugin=SessionsPythonTool(
-                auth_callback=auth_callback_factory("https://dynamicsessions.io/.default"),
-                pool_management_endpoint=azure_code_interpreter_pool_endpoint,
-            ),
+
+def _create_code_execution_plugin() -> CodeExecutionPlugin:
+    if USE_EXECUTION_ROUTER:
+        # Cheap snippets stay local, the rest bursts to the sessions pool when the local workers are busy
+        return ExecutionRouterPlugin(
+            backends=[
+                LocalBackend(_create_local_python_plugin()),
+                SessionsBackend(_create_sessions_python_tool(), new_session=_reset_code_execution_session),
+            ]
         )
+    if USE_CODE_INTERPRETER_SESSIONS_TOOL:
+        # Run the code in the code interpreter sessions pool
+        return _create_sessions_python_tool()
+    return _create_local_python_plugin()
+
+
+async def _reset_code_execution_session(plugin: CodeExecutionPlugin) -> None:
+    """Drop the variables and imports accumulated by the code execution plugin."""
+    if isinstance(plugin, SessionsPythonTool):
+        # Move to a new remote session, a warm one from the pool if enabled
+        sessions_pool = _get_sessions_pool()
+        if sessions_pool is None:
+            plugin.settings.session_id = str(uuid4())
+        else:
+            sessions_pool.release(plugin.settings.session_id)
+            plugin.settings.session_id = await sessions_pool.lease()
+    elif isinstance(plugin, ExecutionRouterPlugin):
+        await plugin.reset_session()
     else:
-        kernel.add_plugin(plugin_name="LocalCodeExecutionTool", plugin=LocalPythonPlugin())
+        plugin.reset_session()
+
+
+def create_coder_agent(code_execution_plugin: CodeExecutionPlugin) -> ToolReplyChatCompletionAgent:
+    """Create the coder agent, which executes code with the plugin."""
+    plugin_name = _get_code_execution_plugin_name()
+    # The chat completion services of every agent created in this process share one pooled client
+    kernel = kernel_factory.create_kernel("coder_agent", {plugin_name: lambda: code_execution_plugin})
+    if USE_FAKE_CHAT_COMPLETION:
+        # Times the code execution, to tell it apart from the model and the orchestration
+        kernel.add_filter("function_invocation", pipeline_profile.function_invocation_filter)
 
     # Create the agent with specific instructions
-    coder_agent = ChatCompletionAgent(
+    return ToolReplyChatCompletionAgent(
         kernel=kernel,
         service_id="coder_agent",
         name="coder_agent",
-        instructions="""
+        instructions=f"""
             You are a Python Code agent.
             Your task is to solve the user's prompts by writing Python code and executing the code using the provided tool.
             Your output should be the result from executing the generated Python code.
             This code will be executed in a sandbox, resulting in result, stdout, or stderr.
             All necessary libraries have already been installed.
             Ensure the response to the user is readable and does not contain any code.
+            {ARTIFACT_DIRECTORY_HINT if CAPTURE_ARTIFACTS else ""}
         """,
         execution_settings=AzureChatPromptExecutionSettings(
             service_id="coder_agent",
             temperature=0.0,
             max_tokens=1000,
             function_choice_behavior=FunctionChoiceBehavior.Required(
-                filters={"included_plugins": ["CodeInterpreterSessionsTool"]} if USE_CODE_INTERPRETER_SESSIONS_TOOL else {"included_plugins": ["LocalCodeExecutionTool"]}
+                filters={"included_plugins": [_get_code_execution_plugin_name()]}
             ),
         ),
     )
 
+
+async def invoke_agent(
+    agent: ToolReplyChatCompletionAgent, to_agent: str, input: str, history: ChatHistory
+):
+    """Invoke the agent with the user input."""
+    history.add_user_message(input)
+
+    if streaming:
+        renderer = StreamRenderer(on_reply_start=lambda name: log_flow(name or "", to_agent))
+        # The agent adds the merged reply, and any tool calls, to the history itself
+        async for content in agent.invoke_stream(history):
+            renderer.write(content)
+        renderer.close()
+    else:
+        async for content in agent.invoke(history):
+            log_flow(content.name, to_agent)
+            print(f"\033[94m{content.content}'\n")
+            history.add_message(content)
+
+    # The reply of the agent, rather than the tool call or result it may have ended with
+    return next((message for message in reversed(history.messages) if message.role == AuthorRole.ASSISTANT), None)
+
+
+async def main():
+    message = input("Enter your message: ")
+
+    code_execution_plugin = _create_code_execution_plugin()
+    coder_agent = create_coder_agent(code_execution_plugin)
+    # Leases a warm session when the sessions pool is enabled
+    await _reset_code_execution_session(code_execution_plugin)
+
     chat_history = ChatHistory()
 
     # Main logical flow to invoke the agent for code execution
@@ -169,9 +320,13 @@ async def main():
         # Invoke coder agent
         log_separator()
         log_message("Invoking coder agent")
+        pipeline_profile.reset()
+        started = time.perf_counter()
         execution_result = await invoke_agent(
             coder_agent, "User", message, chat_history
         )
+        if USE_FAKE_CHAT_COMPLETION:
+            logger.info(f"Pipeline profile: {pipeline_profile.summary(time.perf_counter() - started)}")
 
         response = {
             "execution_result": str(execution_result),
@@ -198,6 +353,11 @@ async def main():
         with open("execution_result.txt", "w") as file:
             file.write(str(response))
 
+    finally:
+        await close_shared_clients()
+        await close_token_providers()
+        await close_session_pools()
+
 if __name__ == "__main__":
     import asyncio
 
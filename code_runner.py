@@ -0,0 +1,351 @@
+import ast
+import hashlib
+import io
+import linecache
+import logging
+import mimetypes
+import os
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from collections.abc import Callable
+from types import CodeType
+
+from execution_result import (
+    ARTIFACT_DIRECTORY_NAME,
+    ArtifactLimits,
+    CapturedArtifact,
+    ExecutionLimitExceeded,
+    ExecutionLimits,
+    ExecutionResult,
+    HeadTailBuffer,
+    OutputLimits,
+    summarize_namespace,
+    summarize_value,
+    truncate_middle,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CODE_CACHE_SIZE = 256
+DEFAULT_OUTPUT_CHUNK_CHARS = 4096
+GENERATED_CODE_FILENAME_PREFIX = "<generated_code-"
+# Holds the value of the trailing expression of code run with evaluate_trailing_expression
+TRAILING_EXPRESSION_NAME = "__trailing_expression__"
+
+
+def _assign_trailing_expression(tree: ast.Module) -> ast.Module:
+    """Return the tree with its trailing expression statement, if any, assigned to TRAILING_EXPRESSION_NAME."""
+    if not tree.body or not isinstance(tree.body[-1], ast.Expr):
+        return tree
+    expression = tree.body[-1]
+    assignment = ast.copy_location(
+        ast.Assign(targets=[ast.Name(id=TRAILING_EXPRESSION_NAME, ctx=ast.Store())], value=expression.value),
+        expression,
+    )
+    return ast.fix_missing_locations(ast.Module(body=[*tree.body[:-1], assignment], type_ignores=tree.type_ignores))
+
+
+class CodeCache:
+    """An LRU cache of compiled code objects keyed by the SHA-256 hash of their source."""
+
+    def __init__(self, maxsize: int = DEFAULT_CODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._code_objects: OrderedDict[str, CodeType] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(
+        self, code: str, tree: ast.Module | None = None, evaluate_trailing_expression: bool = False
+    ) -> CodeType:
+        """Return the compiled code object of the source, compiling it only on a cache miss.
+
+        Args:
+            code (str): The source code.
+            tree (ast.Module | None): The already parsed source, compiled instead of parsing it again.
+            evaluate_trailing_expression (bool): Stores the value of a trailing expression statement in
+                TRAILING_EXPRESSION_NAME, as a REPL displays it.
+        Raises:
+            SyntaxError: If the source is not valid Python code.
+        """
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        key = f"{digest}-repl" if evaluate_trailing_expression else digest
+        with self._lock:
+            code_object = self._code_objects.get(key)
+            if code_object is not None:
+                self._code_objects.move_to_end(key)
+                return code_object
+
+        filename = f"{GENERATED_CODE_FILENAME_PREFIX}{digest[:12]}>"
+        if evaluate_trailing_expression:
+            tree = _assign_trailing_expression(tree if tree is not None else ast.parse(code))
+        code_object = compile(tree if tree is not None else code, filename, "exec")
+        with self._lock:
+            self._code_objects[key] = code_object
+            # Lets tracebacks show the offending source lines
+            linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+            while len(self._code_objects) > self.maxsize:
+                _, evicted = self._code_objects.popitem(last=False)
+                linecache.cache.pop(evicted.co_filename, None)
+        return code_object
+
+    def __len__(self) -> int:
+        return len(self._code_objects)
+
+
+# Each process, including every worker of the WorkerPool, keeps its own cache
+code_cache = CodeCache()
+
+
+class _ThreadRoutingStream:
+    """Replaces sys.stdout or sys.stderr, sending writes from threads that capture output to their buffer.
+
+    Redirecting the process-wide stream would mix the output of snippets running concurrently in other threads.
+    """
+
+    def __init__(self, original, captures: threading.local, name: str):
+        self._original = original
+        self._captures = captures
+        self._name = name
+
+    def _target(self):
+        return getattr(self._captures, self._name, None) or self._original
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+
+class _StreamingBuffer:
+    """Tees the writes to a captured stream into a callback, a line or `chunk_chars` characters at a time."""
+
+    def __init__(
+        self,
+        buffer: HeadTailBuffer,
+        name: str,
+        on_output: Callable[[str, str], None],
+        chunk_chars: int = DEFAULT_OUTPUT_CHUNK_CHARS,
+    ):
+        self._buffer = buffer
+        self._name = name
+        self._on_output = on_output
+        self._chunk_chars = chunk_chars
+        self._pending: list[str] = []
+        self._pending_chars = 0
+
+    def write(self, text: str) -> int:
+        self._buffer.write(text)
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if "\n" in text or self._pending_chars >= self._chunk_chars:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self._on_output(self._name, text)
+
+
+_captures = threading.local()
+_install_lock = threading.Lock()
+
+
+def _install_routing_streams() -> None:
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadRoutingStream):
+            sys.stdout = _ThreadRoutingStream(sys.stdout, _captures, "stdout")
+        if not isinstance(sys.stderr, _ThreadRoutingStream):
+            sys.stderr = _ThreadRoutingStream(sys.stderr, _captures, "stderr")
+
+
+def _format_exception(e: BaseException) -> str:
+    """Format the traceback of the exception, starting at the first frame of the generated code."""
+    tb = e.__traceback__
+    while tb is not None and not tb.tb_frame.f_code.co_filename.startswith(GENERATED_CODE_FILENAME_PREFIX):
+        tb = tb.tb_next
+    return "".join(traceback.format_exception(type(e), e, tb))
+
+
+def _snapshot_files(directory: str) -> dict[str, tuple[int, int, int]]:
+    """Return the inode, size and modification time of each file directly in the directory."""
+    snapshot = {}
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        logger.warning(f"Unable to list the artifact directory {directory}: {e}")
+        return snapshot
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                snapshot[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            # Removed since it was listed
+            continue
+    return snapshot
+
+
+def _open_figures() -> set[int]:
+    """Return the numbers of the open matplotlib figures."""
+    # Only code that imported pyplot can have open figures
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    return set(pyplot.get_fignums()) if pyplot is not None else set()
+
+
+def _capture_artifacts(
+    files_before: dict[str, tuple[int, int, int]], figures_before: set[int], artifact_limits: ArtifactLimits
+) -> list[CapturedArtifact]:
+    """Collect the matplotlib figures opened by the execution, closing them, and the files it wrote.
+
+    Figures are those opened since `figures_before` was taken, rendered to PNG in memory; figures that other
+    code left open are not touched. Files are those created or changed in the artifact directory since
+    `files_before` was taken, which is why it should be a directory of the session rather than a shared one.
+    """
+    artifacts: list[CapturedArtifact] = []
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        for number in pyplot.get_fignums():
+            if number in figures_before:
+                continue
+            figure = pyplot.figure(number)
+            buffer = io.BytesIO()
+            try:
+                figure.savefig(buffer, format="png")
+            except Exception as e:
+                logger.warning(f"Unable to render figure {number}: {e}")
+                continue
+            finally:
+                pyplot.close(figure)
+            artifacts.append(CapturedArtifact(f"figure_{number}.png", "image/png", buffer.getvalue()))
+
+    for name, signature in sorted(_snapshot_files(artifact_limits.directory).items()):
+        if files_before.get(name) == signature:
+            continue
+        path = os.path.join(artifact_limits.directory, name)
+        try:
+            with open(path, "rb") as file:
+                data = file.read(artifact_limits.max_artifact_bytes + 1)
+        except OSError:
+            continue
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        artifacts.append(CapturedArtifact(name, media_type, data))
+
+    captured = []
+    for artifact in artifacts:
+        if len(artifact.data) > artifact_limits.max_artifact_bytes:
+            logger.info(f"Not capturing {artifact.name}: it is over the artifact size limit")
+        elif len(captured) < artifact_limits.max_artifacts:
+            captured.append(artifact)
+    return captured
+
+
+def run_code(
+    code: str | CodeType,
+    namespace: dict | None = None,
+    limits: OutputLimits | None = None,
+    on_output: Callable[[str, str], None] | None = None,
+    execution_limits: ExecutionLimits | None = None,
+    artifact_limits: ArtifactLimits | None = None,
+    evaluate_trailing_expression: bool = False,
+) -> ExecutionResult:
+    """Executes the provided Python code with unrestricted access to built-in functions.
+
+    This is the execution core shared by the in-process path of the LocalPythonPlugin and
+    the worker processes of the WorkerPool, so it must not import Semantic Kernel.
+
+    Args:
+        code (str | CodeType): The valid Python code to execute, or its compiled code object
+        namespace (dict | None): A persistent session namespace to execute the code in. A fresh
+            namespace is used when not provided.
+        limits (OutputLimits | None): The size budgets of the result fields.
+        on_output (Callable[[str, str], None] | None): Called with the stream name ("stdout" or "stderr")
+            and each chunk of output as the code produces it. May block to apply backpressure.
+        execution_limits (ExecutionLimits | None): Only the output limit is enforced here, the other
+            limits need the code to run in a worker process of the WorkerPool.
+        artifact_limits (ArtifactLimits | None): When given, the figures and files the code produced are
+            captured in `metadata["captured_artifacts"]`, as CapturedArtifact. The code finds the directory
+            whose files are captured in its ARTIFACT_DIRECTORY variable.
+        evaluate_trailing_expression (bool): Reports the value of the trailing expression of the code as
+            the result, as a REPL does, instead of the variables it defined. Only applies to source code.
+    Returns:
+        ExecutionResult: The captured stdout and stderr, and a summary of the variables defined or
+            reassigned by the executed code (not execution metadata), or the value of its trailing expression
+    """
+    limits = limits or OutputLimits()
+    _install_routing_streams()
+    max_output_chars = execution_limits.max_output_chars if execution_limits else None
+    stdout = HeadTailBuffer(limits.max_stdout_chars, max_output_chars)
+    stderr = HeadTailBuffer(limits.max_stderr_chars, max_output_chars)
+
+    if namespace is None:
+        # Unrestricted execution: Allow all built-in functions
+        namespace = {"__builtins__": __builtins__}  # Allow all built-ins
+
+    if artifact_limits is not None:
+        namespace[ARTIFACT_DIRECTORY_NAME] = artifact_limits.directory
+    previous_ids = {key: id(value) for key, value in namespace.items()}
+    files_before = _snapshot_files(artifact_limits.directory) if artifact_limits is not None else None
+    figures_before = _open_figures() if artifact_limits is not None else None
+
+    if on_output is None:
+        _captures.stdout, _captures.stderr = stdout, stderr
+    else:
+        _captures.stdout = _StreamingBuffer(stdout, "stdout", on_output)
+        _captures.stderr = _StreamingBuffer(stderr, "stderr", on_output)
+    try:
+        if isinstance(code, str):
+            code = code_cache.compile(code, evaluate_trailing_expression=evaluate_trailing_expression)
+        # A single namespace for globals and locals, so functions can see top-level names
+        exec(code, namespace)
+    except ExecutionLimitExceeded as e:
+        return ExecutionResult.from_limit_exceeded(e, stdout=stdout.getvalue(), stderr=stderr.getvalue())
+    except Exception as e:
+        _captures.stdout.flush()
+        # The traceback is reported even if the code already used up its output limit
+        stderr.max_total_chars = None
+        _captures.stderr.write(_format_exception(e))
+        _captures.stderr.flush()
+        result = ExecutionResult.failure(
+            f"{type(e).__name__}: {e}",
+            stdout=stdout.getvalue(),
+            stderr=truncate_middle(stderr.getvalue(), limits.max_stderr_chars),
+            exception_type=type(e).__name__,
+        )
+        # What the code produced before failing may help to find the error
+        if artifact_limits is not None:
+            result.metadata["captured_artifacts"] = _capture_artifacts(files_before, figures_before, artifact_limits)
+        return result
+    else:
+        _captures.stdout.flush()
+        _captures.stderr.flush()
+    finally:
+        _captures.stdout = _captures.stderr = None
+
+    if evaluate_trailing_expression:
+        value = namespace.pop(TRAILING_EXPRESSION_NAME, None)
+        summary = "" if value is None else summarize_value(value, limits.max_result_chars)
+    else:
+        # Return only defined variables (not execution metadata)
+        defined = {
+            key: value
+            for key, value in namespace.items()
+            if not key.startswith("__") and key != ARTIFACT_DIRECTORY_NAME and previous_ids.get(key) != id(value)
+        }
+        summary = summarize_namespace(defined, limits)
+    result = ExecutionResult(
+        result=summary,
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+    )
+    if artifact_limits is not None:
+        result.metadata["captured_artifacts"] = _capture_artifacts(files_before, figures_before, artifact_limits)
+    return result
@@ -0,0 +1,269 @@
+import reprlib
+from dataclasses import dataclass, field
+from types import BuiltinFunctionType, FunctionType, ModuleType
+
+TRUNCATION_MARKER = "\n... [{omitted} characters truncated] ...\n"
+DEFAULT_ARTIFACT_DIRECTORY = "/tmp"
+# The variable holding the artifact directory in the namespace of code whose artifacts are captured
+ARTIFACT_DIRECTORY_NAME = "ARTIFACT_DIRECTORY"
+# The start of the result of a failed execution
+FAILURE_RESULT_PREFIX = "Error executing code: "
+
+
+@dataclass
+class OutputLimits:
+    """Size budgets, in characters, for each field of an ExecutionResult (roughly 4 characters per token)."""
+
+    max_result_chars: int = 4000
+    max_stdout_chars: int = 8000
+    max_stderr_chars: int = 4000
+    max_value_chars: int = 500
+
+
+@dataclass
+class ExecutionLimits:
+    """Resource limits applied to each code execution. None disables a limit.
+
+    Attributes:
+        wall_clock_seconds (float | None): The maximum elapsed time of an execution.
+        cpu_seconds (float | None): The maximum CPU time an execution may use.
+        memory_bytes (int | None): The maximum memory an execution may allocate on top of what the
+            worker process already holds.
+        max_output_chars (int | None): The maximum number of characters an execution may write to
+            stdout, and to stderr.
+    """
+
+    wall_clock_seconds: float | None = None
+    cpu_seconds: float | None = None
+    memory_bytes: int | None = None
+    max_output_chars: int | None = None
+
+
+@dataclass
+class ArtifactLimits:
+    """What an execution captures as artifacts: the figures it opened, and the files it wrote in `directory`.
+
+    Attributes:
+        directory (str): The directory whose files written during the execution are captured, not recursively.
+            LocalPythonPlugin captures in a directory of each session, which it creates in this one. The code
+            finds the directory in its ARTIFACT_DIRECTORY variable.
+        max_artifacts (int): The maximum number of artifacts captured per execution.
+        max_artifact_bytes (int): Larger figures and files are left out.
+    """
+
+    directory: str = DEFAULT_ARTIFACT_DIRECTORY
+    max_artifacts: int = 10
+    max_artifact_bytes: int = 10 * 1024 * 1024
+
+
+@dataclass
+class CapturedArtifact:
+    """A figure or file produced by an execution, as captured in the process that ran it."""
+
+    name: str
+    media_type: str
+    data: bytes
+
+
+class ExecutionLimitExceeded(BaseException):
+    """Raised inside the running code when it exceeds one of its ExecutionLimits.
+
+    Derives from BaseException so that `except Exception` blocks in the executed code do not swallow it.
+    """
+
+    def __init__(self, limit: str, value):
+        super().__init__(f"The execution exceeded its {limit} limit of {value}")
+        self.limit = limit
+        self.value = value
+
+
+@dataclass
+class ExecutionResult:
+    """The structured result of a code execution.
+
+    Attributes:
+        status (str): "Success" or "Failure".
+        result (str): A summary of the variables defined by the code, or the error message on failure.
+        stdout (str): The captured standard output.
+        stderr (str): The captured standard error, including the traceback on failure.
+        metadata (dict): Details about the execution, such as timings.
+        artifacts (list[dict]): References to the figures and files the execution produced, each with its
+            "uri", "name", "media_type" and "size_bytes".
+    """
+
+    status: str = "Success"
+    result: str = ""
+    stdout: str = ""
+    stderr: str = ""
+    metadata: dict = field(default_factory=dict)
+    artifacts: list[dict] = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == "Success"
+
+    @property
+    def limit_exceeded(self) -> str | None:
+        """The name of the ExecutionLimits field that stopped the execution, if any."""
+        return self.metadata.get("limit_exceeded")
+
+    @classmethod
+    def failure(cls, message: str, stdout: str = "", stderr: str = "", **metadata) -> "ExecutionResult":
+        return cls(
+            status="Failure",
+            result=f"{FAILURE_RESULT_PREFIX}{message}",
+            stdout=stdout,
+            stderr=stderr,
+            metadata=metadata,
+        )
+
+    @classmethod
+    def from_limit_exceeded(
+        cls, error: ExecutionLimitExceeded, stdout: str = "", stderr: str = ""
+    ) -> "ExecutionResult":
+        return cls.failure(str(error), stdout=stdout, stderr=stderr, limit_exceeded=error.limit)
+
+    def __str__(self) -> str:
+        # Same layout as the SessionsPythonTool, so agents see one format whatever the backend
+        text = f"Status:\n{self.status}\nResult:\n{self.result}\nStdout:\n{self.stdout}\nStderr:\n{self.stderr}"
+        if not self.artifacts:
+            return text
+        references = "\n".join(
+            f"{artifact['name']} ({artifact['media_type']}, {artifact['size_bytes']} bytes): {artifact['uri']}"
+            for artifact in self.artifacts
+        )
+        return f"{text}\nArtifacts:\n{references}"
+
+
+@dataclass
+class ExecutionEvent:
+    """An event emitted while streaming a code execution.
+
+    Attributes:
+        kind (str): "stdout" or "stderr" for an output chunk, "progress" for a heartbeat while the code
+            runs silently, and "result" for the final event.
+        text (str): The output chunk.
+        elapsed_seconds (float): The time since the execution started.
+        result (ExecutionResult | None): The result of the execution, on the final event.
+    """
+
+    kind: str
+    text: str = ""
+    elapsed_seconds: float = 0.0
+    result: ExecutionResult | None = None
+
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Keep the head and the tail of the text within `max_chars`, marking how much was dropped."""
+    if len(text) <= max_chars:
+        return text
+    keep = max(max_chars - len(TRUNCATION_MARKER), 0)
+    head = keep - keep // 2
+    tail = keep // 2
+    omitted = len(text) - head - tail
+    return f"{text[:head]}{TRUNCATION_MARKER.format(omitted=omitted)}{text[len(text) - tail:]}"
+
+
+class HeadTailBuffer:
+    """A write-only text stream that keeps only the head and the tail of what is written to it.
+
+    Memory stays bounded however much output the code produces, e.g. a print in a million-iteration loop.
+    Writing more than `max_total_chars` in total raises an ExecutionLimitExceeded.
+    """
+
+    def __init__(self, max_chars: int, max_total_chars: int | None = None):
+        self.max_chars = max_chars
+        self.max_total_chars = max_total_chars
+        self._head: list[str] = []
+        self._head_chars = 0
+        self._tail = ""
+        self.total_chars = 0
+
+    def write(self, text: str) -> int:
+        written = len(text)
+        self.total_chars += written
+        head_room = self.max_chars // 2 - self._head_chars
+        if head_room > 0:
+            self._head.append(text[:head_room])
+            self._head_chars += min(len(text), head_room)
+            text = text[head_room:]
+        if text:
+            self._tail = (self._tail + text)[-(self.max_chars - self.max_chars // 2):]
+        if self.max_total_chars is not None and self.total_chars > self.max_total_chars:
+            raise ExecutionLimitExceeded("max_output_chars", self.max_total_chars)
+        return written
+
+    def flush(self) -> None:
+        pass
+
+    def getvalue(self) -> str:
+        head = "".join(self._head)
+        omitted = self.total_chars - len(head) - len(self._tail)
+        if omitted <= 0:
+            return head + self._tail
+        return f"{head}{TRUNCATION_MARKER.format(omitted=omitted)}{self._tail}"
+
+
+def _value_repr(max_chars: int) -> reprlib.Repr:
+    value_repr = reprlib.Repr()
+    value_repr.maxlevel = 3
+    value_repr.maxlist = value_repr.maxtuple = value_repr.maxset = value_repr.maxfrozenset = 10
+    value_repr.maxdeque = value_repr.maxarray = 10
+    value_repr.maxdict = 10
+    value_repr.maxstring = value_repr.maxlong = value_repr.maxother = max_chars
+    return value_repr
+
+
+def summarize_value(value, max_chars: int) -> str:
+    """Describe a value without stringifying it in full.
+
+    Arrays and DataFrames are summarized by shape, dtype and a short preview, containers are
+    abbreviated and anything else is truncated to `max_chars`.
+    """
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        type_name = type(value).__name__
+        dtypes = getattr(value, "dtypes", None)
+        head = getattr(value, "head", None)
+        if dtypes is not None and callable(head):
+            # DataFrame-like
+            columns = ", ".join(f"{name}: {dtype}" for name, dtype in list(dtypes.items())[:20])
+            summary = f"<{type_name} shape={shape} columns=[{columns}]>\n{head(5)}"
+        else:
+            dtype = getattr(value, "dtype", None)
+            ravel = getattr(value, "ravel", None)
+            preview = repr(ravel()[:10].tolist()) if callable(ravel) else ""
+            summary = f"<{type_name} shape={shape} dtype={dtype}> first values: {preview}"
+        return truncate_middle(summary, max_chars)
+
+    summary = _value_repr(max_chars).repr(value)
+    length = len(value) if isinstance(value, (list, tuple, dict, set, frozenset)) else None
+    if length is not None and length > 10:
+        summary = f"<{type(value).__name__} of {length} items> {summary}"
+    return truncate_middle(summary, max_chars)
+
+
+def summarize_namespace(values: dict, limits: OutputLimits) -> str:
+    """Summarize the variables defined by the code, one per line, within the result budget.
+
+    Modules, functions and classes are left out, since the model wrote them and they carry no result.
+    """
+    lines: list[str] = []
+    used_chars = 0
+    names = [
+        name
+        for name, value in values.items()
+        if not isinstance(value, (ModuleType, FunctionType, BuiltinFunctionType, type))
+    ]
+    for index, name in enumerate(names):
+        try:
+            summary = summarize_value(values[name], limits.max_value_chars)
+        except Exception as e:
+            summary = f"<{type(values[name]).__name__} that cannot be displayed: {e}>"
+        line = f"{name} = {summary}"
+        if used_chars + len(line) > limits.max_result_chars:
+            lines.append(f"... [{len(names) - index} more variables]")
+            break
+        lines.append(line)
+        used_chars += len(line) + 1
+    return "\n".join(lines)
@@ -0,0 +1,465 @@
+import ast
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Awaitable, Callable
+from enum import IntEnum
+from typing import Annotated
+from uuid import uuid4
+
+from pydantic import Field, PrivateAttr
+
+from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import SessionsPythonTool
+from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
+from semantic_kernel.functions.kernel_function_decorator import kernel_function
+from semantic_kernel.kernel_pydantic import KernelBaseModel
+from local_python_plugin import EXECUTE_CODE_DESCRIPTION, AsyncLocalPythonPlugin
+from sessions_pool import upload_file_to_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_WINDOW = 100
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RECOVERY_SECONDS = 30.0
+DEFAULT_REMOTE_CAPACITY = 32
+# Snippets estimated at most this cost stay on the preferred backend unless it has a full round of backlog
+DEFAULT_CHEAP_COST = 200.0
+# The cost of the code in a loop or comprehension is multiplied by this, once per level of nesting
+LOOP_COST_FACTOR = 10.0
+HEAVY_IMPORT_COST = 500.0
+DEFAULT_HEAVY_MODULES = frozenset({"numpy", "pandas", "scipy", "sklearn", "torch", "tensorflow", "matplotlib", "seaborn"})
+# Code importing these, or calling the built-ins that import or run code given as strings, or the os functions
+# that start or signal processes, routes to a sandbox. This is a routing hint, not an enforced isolation: os,
+# pathlib or open still reach the files of the host, and getattr or encoded strings evade any syntactic check.
+DEFAULT_SANDBOXED_MODULES = frozenset({
+    "builtins", "ctypes", "http", "importlib", "multiprocessing", "pty", "requests", "shutil", "signal", "socket",
+    "subprocess", "urllib",
+})
+DEFAULT_SANDBOXED_BUILTINS = frozenset({"__import__", "compile", "eval", "exec"})
+DEFAULT_SANDBOXED_OS_FUNCTIONS = frozenset({
+    "execl", "execle", "execlp", "execlpe", "execv", "execve", "execvp", "execvpe", "fork", "forkpty", "kill",
+    "killpg", "popen", "posix_spawn", "posix_spawnp", "spawnl", "spawnle", "spawnlp", "spawnlpe", "spawnv",
+    "spawnve", "spawnvp", "spawnvpe", "system",
+})
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class Isolation(IntEnum):
+    """How isolated from the host the code runs; a higher value is more isolated."""
+
+    HOST = 0
+    PROCESS = 1
+    SANDBOX = 2
+
+
+class CircuitBreaker:
+    """Stops calls to a backend after `failure_threshold` consecutive failures.
+
+    After `recovery_seconds`, a single call is let through to probe the backend: its success closes the
+    circuit again, its failure opens it for another `recovery_seconds`. The probe is only claimed by a call
+    actually sent to the backend, so routing a call elsewhere leaves the backend free to be probed.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, recovery_seconds: float = DEFAULT_RECOVERY_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allows(self) -> bool:
+        """Return whether a call may be sent: the circuit is closed, or may be probed and is not being probed."""
+        if self.state == CIRCUIT_OPEN:
+            return time.monotonic() - self._opened_at >= self.recovery_seconds
+        if self.state == CIRCUIT_HALF_OPEN:
+            return not self._probing
+        return True
+
+    def acquire(self) -> None:
+        """Claim a call about to be sent; once the circuit may be probed, the call is the probe."""
+        if self.state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self.state = CIRCUIT_HALF_OPEN
+        if self.state == CIRCUIT_HALF_OPEN:
+            self._probing = True
+
+    def release(self) -> None:
+        """Give back a claimed call that ended without telling whether the backend works, e.g. a cancelled one."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                self.trips += 1
+            self.state = CIRCUIT_OPEN
+            self._opened_at = time.monotonic()
+
+
+class ExecutionBackend(ABC):
+    """A backend the ExecutionRouterPlugin sends code to, with its load, recent latencies and circuit breaker.
+
+    Subclasses implement `_execute`, `reset_session` and `upload_file`, and may report a load shared with other
+    users of the backend through `in_flight`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        isolation: Isolation,
+        capacity: int,
+        latency_window: int = DEFAULT_LATENCY_WINDOW,
+        circuit_breaker: CircuitBreaker | None = None,
+    ):
+        """Initializes the backend.
+
+        Args:
+            name (str): The name of the backend, in logs and stats.
+            isolation (Isolation): How isolated the code it runs is.
+            capacity (int): The number of executions it runs at once; more wait in its queue.
+            latency_window (int): The number of recent executions the latency percentiles are computed over.
+            circuit_breaker (CircuitBreaker | None): The breaker of the backend, a default one if None.
+        """
+        self.name = name
+        self.isolation = isolation
+        self.capacity = capacity
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.executions = 0
+        self._running = 0
+        self._latencies: deque[float] = deque(maxlen=latency_window)
+
+    @abstractmethod
+    async def _execute(self, code: str) -> str:
+        """Run the code on the backend and return its formatted result."""
+
+    @abstractmethod
+    async def reset_session(self) -> None:
+        """Drop the variables and imports of the current session of the backend."""
+
+    @abstractmethod
+    async def upload_file(self, local_file_path: str, remote_file_path: str | None = None) -> str:
+        """Stage a local file where the code run by the backend can read it, returning its path there."""
+
+    @property
+    def in_flight(self) -> int:
+        """The executions running or queued on the backend."""
+        return self._running
+
+    @property
+    def backlog(self) -> int:
+        """The executions a new one would wait for."""
+        return max(0, self.in_flight - self.capacity + 1)
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """Return the given percentile, in [0, 1], of the recent latencies, or None before any execution."""
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    def expected_seconds(self, percentile: float) -> float | None:
+        """Estimate how long a new execution would take, including its wait for a free slot."""
+        latency = self.latency_percentile(percentile)
+        if latency is None:
+            return None
+        return latency * (1 + self.backlog / self.capacity)
+
+    async def execute(self, code: str) -> str:
+        """Execute the code, recording its latency, and its failure in the circuit breaker."""
+        self.circuit_breaker.acquire()
+        self._running += 1
+        started = time.monotonic()
+        try:
+            result = await self._execute(code)
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.release()
+            raise
+        finally:
+            self._running -= 1
+        self._latencies.append(time.monotonic() - started)
+        self.executions += 1
+        self.circuit_breaker.record_success()
+        return result
+
+
+class LocalBackend(ExecutionBackend):
+    """Runs code with an AsyncLocalPythonPlugin, in its worker pool if it has one.
+
+    The load of a worker pool is shared by every plugin using it, so it is read from the pool.
+    """
+
+    def __init__(self, plugin: AsyncLocalPythonPlugin, name: str = "local", **kwargs):
+        worker_pool = plugin.worker_pool
+        super().__init__(
+            name,
+            Isolation.PROCESS if worker_pool is not None else Isolation.HOST,
+            worker_pool.size if worker_pool is not None else os.cpu_count() or 1,
+            **kwargs,
+        )
+        self.plugin = plugin
+
+    @property
+    def in_flight(self) -> int:
+        worker_pool = self.plugin.worker_pool
+        if worker_pool is None:
+            return self._running
+        return worker_pool.busy_workers + worker_pool.queue_depth
+
+    async def _execute(self, code: str) -> str:
+        return await self.plugin.execute_code(code)
+
+    async def reset_session(self) -> None:
+        self.plugin.reset_session()
+
+    async def upload_file(self, local_file_path: str, remote_file_path: str | None = None) -> str:
+        return await asyncio.to_thread(self.plugin.upload_file, local_file_path, remote_file_path)
+
+
+class SessionsBackend(ExecutionBackend):
+    """Runs code in the remote sessions of a SessionsPythonTool.
+
+    `reset_session` moves the tool to a new session, with `new_session` if given, e.g. one leasing a warm
+    session, or else on a new identifier.
+    """
+
+    def __init__(
+        self,
+        plugin: SessionsPythonTool,
+        name: str = "sessions",
+        capacity: int = DEFAULT_REMOTE_CAPACITY,
+        new_session: Callable[[SessionsPythonTool], Awaitable[None]] | None = None,
+        **kwargs,
+    ):
+        super().__init__(name, Isolation.SANDBOX, capacity, **kwargs)
+        self.plugin = plugin
+        self.new_session = new_session
+
+    async def _execute(self, code: str) -> str:
+        return await self.plugin.execute_code(code)
+
+    async def reset_session(self) -> None:
+        if self.new_session is not None:
+            await self.new_session(self.plugin)
+        else:
+            self.plugin.settings.session_id = str(uuid4())
+
+    async def upload_file(self, local_file_path: str, remote_file_path: str | None = None) -> str:
+        return await upload_file_to_session(self.plugin, local_file_path, remote_file_path)
+
+
+def _imported_modules(tree: ast.AST) -> set[str]:
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module.split(".")[0])
+    return modules
+
+
+def _uses_sandboxed_calls(tree: ast.AST, builtins: frozenset[str], os_functions: frozenset[str]) -> bool:
+    """Return whether the code refers to one of the built-ins, or to one of the functions of os."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in builtins:
+            return True
+        if (
+            isinstance(node, ast.Attribute)
+            and node.attr in os_functions
+            and isinstance(node.value, ast.Name)
+            and node.value.id == "os"
+        ):
+            return True
+        if isinstance(node, ast.ImportFrom) and node.module == "os":
+            if any(alias.name in os_functions for alias in node.names):
+                return True
+    return False
+
+
+def _node_cost(node: ast.AST) -> float:
+    children = sum(_node_cost(child) for child in ast.iter_child_nodes(node))
+    if isinstance(node, (ast.For, ast.AsyncFor, ast.While, ast.comprehension)):
+        children *= LOOP_COST_FACTOR
+    return 1 + children
+
+
+class ExecutionRouterPlugin(KernelBaseModel):
+    """Executes code on the backend best suited to each call, among local execution and remote sessions.
+
+    Each call is routed on live signals, among the `backends` whose circuit is closed:
+    1. The code needs the isolation of a sandbox if it imports one of `sandboxed_modules`, refers to one of
+       `sandboxed_builtins`, or calls one of `sandboxed_os_functions`, or else `min_isolation`; only the
+       backends at least that isolated are considered. This keeps the code that obviously runs processes or
+       code given as strings away from the host, but does not enforce isolation: set `min_isolation` to
+       Isolation.SANDBOX for untrusted code.
+    2. With `session_affinity`, the conversation stays on the backend that ran its first call, so its
+       variables remain available.
+    3. Cheap snippets, whose estimated cost is at most `cheap_cost`, go to the first backend in the order of
+       `backends` unless it has a full round of executions queued.
+    4. Other snippets go to the backend with the lowest expected time: the `latency_percentile` of its recent
+       executions, scaled by its backlog. Until every backend has run code, they go to the first backend that
+       has a free slot, so they burst to the next ones when the local workers are saturated.
+    A backend raising an error counts as a failure in its circuit breaker, and the call fails over to the next
+    candidate. The cost of a snippet is estimated from its syntax tree: one per node, the nodes in loops
+    weighing LOOP_COST_FACTOR more per level of nesting, plus HEAVY_IMPORT_COST per import of `heavy_modules`.
+    """
+
+    backends: list[ExecutionBackend]
+    session_affinity: bool = True
+    min_isolation: Isolation = Isolation.HOST
+    sandboxed_modules: frozenset[str] = DEFAULT_SANDBOXED_MODULES
+    sandboxed_builtins: frozenset[str] = DEFAULT_SANDBOXED_BUILTINS
+    sandboxed_os_functions: frozenset[str] = DEFAULT_SANDBOXED_OS_FUNCTIONS
+    heavy_modules: frozenset[str] = DEFAULT_HEAVY_MODULES
+    cheap_cost: float = DEFAULT_CHEAP_COST
+    latency_percentile: float = 0.9
+    routed: dict[str, int] = Field(default_factory=dict)
+    failovers: int = 0
+
+    _pinned: ExecutionBackend | None = PrivateAttr(default=None)
+
+    # region Helper Methods
+    def _candidates(self, code: str) -> list[ExecutionBackend]:
+        """Return the backends to try for the code, in order."""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            # Any backend reports the error, the first one most cheaply
+            tree = None
+        required = self.required_isolation(tree)
+        eligible = [backend for backend in self.backends if backend.isolation >= required]
+        if not eligible:
+            raise FunctionExecutionException(f"No code execution backend provides {required.name} isolation")
+        available = [backend for backend in eligible if backend.circuit_breaker.allows()]
+        unavailable = [backend for backend in eligible if backend not in available]
+        if not available:
+            # Every circuit is open: trying them beats failing outright
+            return eligible
+
+        if self.session_affinity and self._pinned in available:
+            ranked = [self._pinned] + [backend for backend in available if backend is not self._pinned]
+            return ranked + unavailable
+
+        cost = self.estimate_cost(tree)
+        if cost <= self.cheap_cost:
+            ranked = sorted(available, key=lambda backend: backend.backlog >= backend.capacity)
+        else:
+            expected = [backend.expected_seconds(self.latency_percentile) for backend in available]
+            if None in expected:
+                ranked = sorted(available, key=lambda backend: backend.backlog > 0)
+            else:
+                ranked = [backend for _, _, backend in sorted(zip(expected, range(len(available)), available))]
+        logger.info(
+            f"ExecutionRouterPlugin: Routing a snippet of cost {cost:.0f} needing {required.name} isolation "
+            f"to {ranked[0].name} (backlogs: {', '.join(f'{b.name} {b.backlog}' for b in available)})"
+        )
+        return ranked + unavailable
+
+    # endregion
+
+    def required_isolation(self, tree: ast.AST | None) -> Isolation:
+        """Return the isolation the parsed code needs."""
+        if tree is not None and (
+            _imported_modules(tree) & self.sandboxed_modules
+            or _uses_sandboxed_calls(tree, self.sandboxed_builtins, self.sandboxed_os_functions)
+        ):
+            return Isolation.SANDBOX
+        return self.min_isolation
+
+    def estimate_cost(self, tree: ast.AST | None) -> float:
+        """Estimate the relative cost of running the parsed code; code that does not parse costs nothing."""
+        if tree is None:
+            return 0.0
+        return _node_cost(tree) + HEAVY_IMPORT_COST * len(_imported_modules(tree) & self.heavy_modules)
+
+    async def reset_session(self) -> None:
+        """Start a new session on every backend, and let the next call pick its backend afresh."""
+        self._pinned = None
+        for backend in self.backends:
+            await backend.reset_session()
+
+    async def upload_file(self, local_file_path: str, remote_file_path: str | None = None) -> str:
+        """Stage a local file on the backend of the conversation, or the one a cheap snippet would go to.
+
+        The conversation is pinned to that backend, so its code finds the file.
+
+        Args:
+            local_file_path (str): The path of the file on the local machine.
+            remote_file_path (str | None): The path of the file on the backend; the name of the local file if None.
+
+        Returns:
+            str: The path the code reads the file from.
+        """
+        backend = self._candidates("")[0]
+        remote_file_path = await backend.upload_file(local_file_path, remote_file_path)
+        self._pinned = backend
+        return remote_file_path
+
+    def stats(self) -> dict:
+        """Return the calls routed to each backend, the failovers, and the state of each backend."""
+        return {
+            "routed": dict(self.routed),
+            "failovers": self.failovers,
+            "backends": {
+                backend.name: {
+                    "in_flight": backend.in_flight,
+                    "circuit": backend.circuit_breaker.state,
+                    "trips": backend.circuit_breaker.trips,
+                    f"p{round(self.latency_percentile * 100)}_seconds": backend.latency_percentile(self.latency_percentile),
+                }
+                for backend in self.backends
+            },
+        }
+
+    # region Kernel Functions
+    @kernel_function(
+        description=EXECUTE_CODE_DESCRIPTION,
+        name="execute_code",
+    )
+    async def execute_code(self, code: Annotated[str, "The valid Python code to execute"]) -> str:
+        """Executes the provided Python code on the best suited backend.
+
+        Args:
+            code (str): The valid Python code to execute
+        Returns:
+            str: The result of the Python code execution in the form of Result, Stdout, and Stderr
+        Raises:
+            FunctionExecutionException: If the provided code is empty, no backend is isolated enough for it,
+                or every backend failed.
+        """
+        if not code:
+            raise FunctionExecutionException("The provided code is empty")
+
+        errors = []
+        candidates = self._candidates(code)
+        for index, backend in enumerate(candidates):
+            try:
+                result = await backend.execute(code)
+            except Exception as e:
+                logger.warning(f"ExecutionRouterPlugin: Backend {backend.name} failed: {e}")
+                errors.append(f"{backend.name}: {e}")
+                if index + 1 < len(candidates):
+                    self.failovers += 1
+                continue
+            self.routed[backend.name] = self.routed.get(backend.name, 0) + 1
+            previous, self._pinned = self._pinned, backend
+            if self.session_affinity and previous is not None and previous is not backend:
+                return f"{result}\nNote: The session moved to another backend; variables defined earlier are lost."
+            return result
+        raise FunctionExecutionException(f"Every code execution backend failed: {'; '.join(errors)}")
+
+    # endregion
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from typing import Any
+
+from pydantic import Field, PrivateAttr
+
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.connectors.ai.completion_usage import CompletionUsage
+from semantic_kernel.connectors.ai.function_calling_utils import update_settings_from_function_call_configuration
+from semantic_kernel.connectors.ai.open_ai.prompt_execution_settings.open_ai_prompt_execution_settings import (
+    OpenAIChatPromptExecutionSettings,
+)
+from semantic_kernel.connectors.ai.prompt_execution_settings import PromptExecutionSettings
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.streaming_chat_message_content import StreamingChatMessageContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+from semantic_kernel.filters.functions.function_invocation_context import FunctionInvocationContext
+from semantic_kernel.kernel_pydantic import KernelBaseModel
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+DEFAULT_LATENCY_SECONDS = 0.5
+DEFAULT_TOKENS_PER_SECOND = 50.0
+# The script of the services without a script of their own
+DEFAULT_SCRIPT_KEY = "*"
+# Replaced in a scripted reply by the result of the latest tool call
+TOOL_RESULT_PLACEHOLDER = "{tool_result}"
+MAX_TRACKED_CONVERSATIONS = 1024
+
+
+class PipelineProfile(KernelBaseModel):
+    """Splits the time of an agent pipeline between model calls, kernel function calls and the rest.
+
+    The FakeChatCompletion records the model calls. Add `function_invocation_filter` to the kernels whose
+    functions, such as execute_code, should be timed.
+    """
+
+    model_calls: int = 0
+    model_seconds: float = 0.0
+    completion_tokens: int = 0
+    function_calls: int = 0
+    function_seconds: float = 0.0
+
+    async def function_invocation_filter(
+        self, context: FunctionInvocationContext, next: Callable[[FunctionInvocationContext], Awaitable[None]]
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            await next(context)
+        finally:
+            self.function_calls += 1
+            self.function_seconds += time.perf_counter() - started
+
+    def reset(self) -> None:
+        self.model_calls = self.completion_tokens = self.function_calls = 0
+        self.model_seconds = self.function_seconds = 0.0
+
+    def summary(self, total_seconds: float) -> str:
+        """Describe where the total time went; the orchestration is what neither the model nor the functions took."""
+        orchestration_seconds = total_seconds - self.model_seconds - self.function_seconds
+        return (
+            f"{total_seconds:.3f}s in total: model {self.model_seconds:.3f}s ({self.model_calls} calls, "
+            f"{self.completion_tokens} tokens), functions {self.function_seconds:.3f}s ({self.function_calls} calls), "
+            f"orchestration {orchestration_seconds:.3f}s"
+        )
+
+
+class ScriptedReply(KernelBaseModel):
+    """A reply of the FakeChatCompletion: a text, or tool calls.
+
+    Attributes:
+        content (str | None): The text of the reply. TOOL_RESULT_PLACEHOLDER is replaced by the result of
+            the latest tool call of the history.
+        tool_calls (list[dict]): The tool calls, each with the fully qualified function "name", e.g.
+            "LocalCodeExecutionTool-execute_code", and its "arguments".
+    """
+
+    content: str | None = None
+    tool_calls: list[dict[str, Any]] = Field(default_factory=list)
+
+
+def load_script(path: str) -> dict[str, list[ScriptedReply]]:
+    """Load the replies of each service ID from a JSON file, e.g. one recorded from real conversations.
+
+    The file maps service IDs, or DEFAULT_SCRIPT_KEY, to lists of {"content": ...} or {"tool_calls": [...]}.
+    """
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    return {service_id: [ScriptedReply(**reply) for reply in replies] for service_id, replies in data.items()}
+
+
+class FakeChatCompletion(ChatCompletionClientBase):
+    """A chat completion service that replays scripted replies, to run the agents offline.
+
+    Each reply is delayed by `latency_seconds`, then generated at `tokens_per_second`, so the timings of a
+    pipeline resemble those of a real deployment. Each conversation, told apart by its first user message,
+    plays the replies in order and then from the start again, so concurrent conversations replay the same
+    script. Tool calls are invoked by the kernel as with a real service.
+    """
+
+    SUPPORTS_FUNCTION_CALLING = True
+
+    replies: list[ScriptedReply]
+    latency_seconds: float = DEFAULT_LATENCY_SECONDS
+    tokens_per_second: float = DEFAULT_TOKENS_PER_SECOND
+    profile: PipelineProfile | None = None
+
+    _next_replies: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+
+    # region Helper Methods
+    def _take_reply(self, chat_history: ChatHistory) -> tuple[ChatMessageContent, int]:
+        """Return the next scripted reply as a message, and its number of tokens."""
+        first_user_message = next((m for m in chat_history.messages if m.role == AuthorRole.USER), None)
+        # Keyed by identity, and forgotten once the message is collected, before its id can be reused
+        key = id(first_user_message)
+        if key not in self._next_replies and first_user_message is not None:
+            weakref.finalize(first_user_message, self._next_replies.pop, key, None)
+        next_reply = self._next_replies.pop(key, 0)
+        self._next_replies[key] = next_reply + 1
+        if len(self._next_replies) > MAX_TRACKED_CONVERSATIONS:
+            self._next_replies.popitem(last=False)
+        reply = self.replies[next_reply % len(self.replies)]
+
+        items = []
+        for tool_call in reply.tool_calls:
+            arguments = tool_call.get("arguments", {})
+            items.append(
+                FunctionCallContent(
+                    id=f"call_{uuid.uuid4().hex[:24]}",
+                    name=tool_call["name"],
+                    arguments=arguments if isinstance(arguments, str) else json.dumps(arguments),
+                )
+            )
+        content = reply.content
+        if content and TOOL_RESULT_PLACEHOLDER in content:
+            content = content.replace(TOOL_RESULT_PLACEHOLDER, self._latest_tool_result(chat_history))
+        message = ChatMessageContent(
+            role=AuthorRole.ASSISTANT, content=content, items=items or None, ai_model_id=self.ai_model_id
+        )
+        chars = len(content or "") + sum(len(str(item.arguments)) for item in items)
+        return message, max(chars // CHARS_PER_TOKEN, 1)
+
+    @staticmethod
+    def _latest_tool_result(chat_history: ChatHistory) -> str:
+        for message in reversed(chat_history.messages):
+            for item in message.items:
+                if isinstance(item, FunctionResultContent):
+                    return str(item.result)
+        return ""
+
+    def _record(self, started: float, tokens: int) -> None:
+        if self.profile is not None:
+            self.profile.model_calls += 1
+            self.profile.model_seconds += time.perf_counter() - started
+            self.profile.completion_tokens += tokens
+
+    # endregion
+
+    def get_prompt_execution_settings_class(self) -> type[PromptExecutionSettings]:
+        return OpenAIChatPromptExecutionSettings
+
+    def _update_function_choice_settings_callback(self):
+        return update_settings_from_function_call_configuration
+
+    async def _inner_get_chat_message_contents(
+        self, chat_history: ChatHistory, settings: PromptExecutionSettings
+    ) -> list[ChatMessageContent]:
+        started = time.perf_counter()
+        message, tokens = self._take_reply(chat_history)
+        await asyncio.sleep(self.latency_seconds + tokens / self.tokens_per_second)
+        message.metadata["usage"] = CompletionUsage(completion_tokens=tokens)
+        self._record(started, tokens)
+        return [message]
+
+    async def _inner_get_streaming_chat_message_contents(
+        self, chat_history: ChatHistory, settings: PromptExecutionSettings, function_invoke_attempt: int = 0
+    ) -> AsyncGenerator[list[StreamingChatMessageContent], Any]:
+        started = time.perf_counter()
+        message, tokens = self._take_reply(chat_history)
+        await asyncio.sleep(self.latency_seconds)
+        if message.content:
+            # One chunk per token, as the real service streams them
+            text = message.content
+            for start in range(0, len(text), CHARS_PER_TOKEN):
+                await asyncio.sleep(1 / self.tokens_per_second)
+                yield [
+                    StreamingChatMessageContent(
+                        role=AuthorRole.ASSISTANT,
+                        choice_index=0,
+                        content=text[start : start + CHARS_PER_TOKEN],
+                        ai_model_id=self.ai_model_id,
+                        function_invoke_attempt=function_invoke_attempt,
+                    )
+                ]
+        tool_calls = [item for item in message.items if isinstance(item, FunctionCallContent)]
+        if tool_calls:
+            await asyncio.sleep(tokens / self.tokens_per_second)
+            yield [
+                StreamingChatMessageContent(
+                    role=AuthorRole.ASSISTANT,
+                    choice_index=0,
+                    items=tool_calls,
+                    ai_model_id=self.ai_model_id,
+                    function_invoke_attempt=function_invoke_attempt,
+                )
+            ]
+        self._record(started, tokens)
+
+
+def create_fake_chat_completion_factory(
+    script: dict[str, list[ScriptedReply]],
+    latency_seconds: float = DEFAULT_LATENCY_SECONDS,
+    tokens_per_second: float = DEFAULT_TOKENS_PER_SECOND,
+    profile: PipelineProfile | None = None,
+) -> Callable[[str], FakeChatCompletion]:
+    """Return a function creating the FakeChatCompletion of a service ID, to pass to a KernelFactory.
+
+    Each service plays the replies of its service ID in the script, or else those of DEFAULT_SCRIPT_KEY.
+    """
+
+    def create_chat_completion(service_id: str) -> FakeChatCompletion:
+        replies = script.get(service_id) or script.get(DEFAULT_SCRIPT_KEY)
+        if not replies:
+            raise ValueError(f"The script has no replies for the service {service_id}")
+        return FakeChatCompletion(
+            service_id=service_id,
+            ai_model_id="fake",
+            replies=replies,
+            latency_seconds=latency_seconds,
+            tokens_per_second=tokens_per_second,
+            profile=profile,
+        )
+
+    return create_chat_completion
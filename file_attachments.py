@@ -0,0 +1,192 @@
+import asyncio
+import csv
+import io
+import logging
+import mmap
+import os
+from dataclasses import dataclass
+
+from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import SessionsPythonTool
+from execution_router import ExecutionRouterPlugin
+from local_python_plugin import LocalPythonPlugin
+from sessions_pool import upload_file_to_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREVIEW_ROWS = 5
+# The rows the column types are inferred from
+TYPE_SAMPLE_ROWS = 200
+# The start of the file read to build the preview; only the line count scans the whole file
+HEAD_BYTES = 64 * 1024
+LINE_COUNT_CHUNK_BYTES = 4 * 1024 * 1024
+MAX_PREVIEW_LINE_CHARS = 200
+MAX_COLUMNS_LISTED = 50
+DELIMITERS = {".csv": ",", ".tsv": "\t", ".tab": "\t"}
+TEXT_FORMATS = {".json": "JSON", ".jsonl": "JSON Lines", ".txt": "Text", ".md": "Markdown", ".log": "Log", ".py": "Python"}
+
+
+@dataclass
+class FileAttachment:
+    """A local file staged where the executed code can read it, and the summary sent to the agents instead of it."""
+
+    name: str
+    local_path: str
+    staged_path: str
+    size_bytes: int
+    summary: str
+
+    def to_message(self, prompt: str | None = None) -> str:
+        """Return the chat message announcing the file, followed by the prompt of the user, if any."""
+        message = (
+            f"Attached file {self.name} ({_format_size(self.size_bytes)}), available to the code at "
+            f"{self.staged_path}. Read it from there rather than asking for its contents.\n{self.summary}"
+        )
+        return f"{message}\n\n{prompt}" if prompt else message
+
+
+def _format_size(size_bytes: int) -> str:
+    size = float(size_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _count_lines(file_path: str) -> int:
+    """Count the lines of a file through a memory map, without reading it into memory."""
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            lines = sum(
+                mapped[start : start + LINE_COUNT_CHUNK_BYTES].count(b"\n")
+                for start in range(0, len(mapped), LINE_COUNT_CHUNK_BYTES)
+            )
+            return lines if mapped[-1:] == b"\n" else lines + 1
+
+
+def _read_head(file_path: str) -> tuple[bytes, bool]:
+    """Return the start of the file, and whether it is the whole file."""
+    with open(file_path, "rb") as file:
+        head = file.read(HEAD_BYTES + 1)
+    return head[:HEAD_BYTES], len(head) <= HEAD_BYTES
+
+
+def _head_lines(head: bytes, complete: bool) -> list[str]:
+    lines = head.decode("utf-8", errors="replace").splitlines()
+    # The last line may have been cut by the end of the head
+    return lines if complete else lines[:-1]
+
+
+def _infer_type(values: list[str]) -> str:
+    values = [value.strip() for value in values if value.strip()]
+    if not values:
+        return "empty"
+    for type_name, parse in (("int", int), ("float", float)):
+        try:
+            for value in values:
+                parse(value)
+            return type_name
+        except ValueError:
+            continue
+    if all(value.lower() in ("true", "false") for value in values):
+        return "bool"
+    return "str"
+
+
+def _truncate(line: str) -> str:
+    return line if len(line) <= MAX_PREVIEW_LINE_CHARS else f"{line[:MAX_PREVIEW_LINE_CHARS]}..."
+
+
+def _describe_table(file_path: str, delimiter: str, preview_rows: int) -> str:
+    head, complete = _read_head(file_path)
+    lines = _head_lines(head, complete)
+    rows = list(csv.reader(io.StringIO("\n".join(lines[: TYPE_SAMPLE_ROWS + 1])), delimiter=delimiter))
+    if not rows:
+        return "Format: empty table"
+    header, sample = rows[0], rows[1:]
+    columns = [
+        f"{name} ({_infer_type([row[index] for row in sample if index < len(row)])})"
+        for index, name in enumerate(header[:MAX_COLUMNS_LISTED])
+    ]
+    if len(header) > MAX_COLUMNS_LISTED:
+        columns.append(f"... {len(header) - MAX_COLUMNS_LISTED} more")
+    # Counts lines: quoted values spanning several lines are counted as several rows
+    row_count = max(_count_lines(file_path) - 1, 0)
+    preview = "\n".join(_truncate(line) for line in lines[: preview_rows + 1])
+    format_name = "TSV" if delimiter == "\t" else "CSV"
+    return (
+        f"Format: {format_name}, {row_count:,} rows x {len(header)} columns, "
+        f"with a header row\nColumns: {', '.join(columns)}\nPreview:\n{preview}"
+    )
+
+
+def _describe_text(file_path: str, format_name: str, preview_rows: int) -> str:
+    head, complete = _read_head(file_path)
+    if b"\0" in head:
+        return f"Format: binary{f' ({format_name})' if format_name else ''}"
+    lines = _head_lines(head, complete)
+    preview = "\n".join(_truncate(line) for line in lines[:preview_rows])
+    return f"Format: {format_name or 'Text'}, {_count_lines(file_path):,} lines\nPreview:\n{preview}"
+
+
+def describe_file(file_path: str, preview_rows: int = DEFAULT_PREVIEW_ROWS) -> str:
+    """Summarize a file for the agents: its format, size in rows, schema and first rows.
+
+    Only the start of the file is read; the rows are counted through a memory map, so a large file is never
+    loaded into memory. Delimited files get their header, the types of their columns inferred from the first
+    rows, and their row count. Other text files get their line count and first lines, binary files only
+    their format.
+
+    Args:
+        file_path (str): The path of the file.
+        preview_rows (int): The number of rows, or lines, previewed.
+
+    Returns:
+        str: The summary of the file.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in DELIMITERS:
+        return _describe_table(file_path, DELIMITERS[extension], preview_rows)
+    return _describe_text(file_path, TEXT_FORMATS.get(extension, extension.lstrip(".").upper()), preview_rows)
+
+
+async def attach_file(
+    plugin: LocalPythonPlugin | SessionsPythonTool | ExecutionRouterPlugin,
+    file_path: str,
+    preview_rows: int = DEFAULT_PREVIEW_ROWS,
+) -> FileAttachment:
+    """Stage a local file where the code executed by the plugin can read it, and summarize it.
+
+    LocalPythonPlugin copies the file into /tmp, SessionsPythonTool streams it to /mnt/data of its session, and
+    ExecutionRouterPlugin stages it on the backend of the conversation.
+
+    Args:
+        plugin (LocalPythonPlugin | SessionsPythonTool | ExecutionRouterPlugin): The code execution plugin.
+        file_path (str): The path of the local file.
+        preview_rows (int): The number of rows, or lines, previewed in the summary.
+
+    Returns:
+        FileAttachment: The staged file, with the summary to send to the agents instead of its contents.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"The file {file_path} does not exist")
+    if isinstance(plugin, SessionsPythonTool):
+        staged_path = await upload_file_to_session(plugin, file_path)
+    elif isinstance(plugin, ExecutionRouterPlugin):
+        staged_path = await plugin.upload_file(file_path)
+    else:
+        staged_path = await asyncio.to_thread(plugin.upload_file, file_path)
+    summary = await asyncio.to_thread(describe_file, file_path, preview_rows)
+    attachment = FileAttachment(
+        name=os.path.basename(file_path),
+        local_path=file_path,
+        staged_path=staged_path,
+        size_bytes=os.path.getsize(file_path),
+        summary=summary,
+    )
+    logger.info(f"Attached {file_path} ({_format_size(attachment.size_bytes)}) at {staged_path}")
+    return attachment
@@ -0,0 +1,259 @@
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterable, Awaitable, Callable
+
+from pydantic import Field, PrivateAttr
+
+from semantic_kernel import Kernel
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.streaming_chat_message_content import StreamingChatMessageContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+from semantic_kernel.functions.kernel_arguments import KernelArguments
+from semantic_kernel.functions.kernel_function_from_prompt import KernelFunctionFromPrompt
+from semantic_kernel.kernel_pydantic import KernelBaseModel
+from execution_result import truncate_middle
+from streaming_agent import ToolReplyChatCompletionAgent
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+DEFAULT_MAX_TOOL_RESULT_CHARS = 1000
+DEFAULT_SUMMARY_CACHE_SIZE = 32
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARIZATION_PROMPT = """
+    Update the summary of a conversation between a user and AI agents with its NEW MESSAGES.
+    Keep the user's requests, the decisions made, the code that worked and the results obtained.
+    Leave out code that failed and repeated content. Answer with the updated summary only, in at most 200 words.
+
+    SUMMARY:
+    {{$summary}}
+
+    NEW MESSAGES:
+    {{$messages}}
+    """
+
+# Takes the previous summary, if any, and the messages to fold into it, and returns the new summary
+Summarizer = Callable[[str | None, list[ChatMessageContent]], Awaitable[str]]
+
+
+def estimate_tokens(message: ChatMessageContent) -> int:
+    """Roughly estimate the number of tokens of a message, including its tool calls and results."""
+    chars = len(message.content or "")
+    for item in message.items:
+        if isinstance(item, FunctionResultContent):
+            chars += len(str(item.result))
+        elif isinstance(item, FunctionCallContent):
+            chars += len(item.name or "") + len(str(item.arguments or ""))
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def _format_messages(messages: list[ChatMessageContent]) -> str:
+    lines = []
+    for message in messages:
+        author = message.name or message.role.value
+        results = [str(item.result) for item in message.items if isinstance(item, FunctionResultContent)]
+        lines.append(f"{author}: {message.content or ' '.join(results)}")
+    return "\n".join(lines)
+
+
+def create_prompt_summarizer(kernel: Kernel, max_message_chars: int = DEFAULT_MAX_TOOL_RESULT_CHARS) -> Summarizer:
+    """Return a summarizer that asks the kernel's chat completion service to update the summary."""
+    function = KernelFunctionFromPrompt(function_name="summarization", prompt=SUMMARIZATION_PROMPT)
+
+    async def summarize(summary: str | None, messages: list[ChatMessageContent]) -> str:
+        text = truncate_middle(_format_messages(messages), max_message_chars * len(messages))
+        result = await function.invoke(kernel, KernelArguments(summary=summary or "", messages=text))
+        return str(result.value[0]) if result is not None and result.value else summary or ""
+
+    return summarize
+
+
+class _SummaryEntry:
+    def __init__(self, first_message: ChatMessageContent):
+        self.first_message = first_message
+        self.summarized_count = 0
+        self.summary: str | None = None
+
+
+class HistoryReducer(KernelBaseModel):
+    """Reduces a chat history to what fits a token budget before it is sent to a model.
+
+    Older tool results are truncated to `max_tool_result_chars`, or dropped along with their tool calls.
+    Then only the last `max_messages` messages are kept, and fewer if they exceed `max_tokens`. When a
+    `summarizer` is set, the messages left out are folded into a rolling summary sent in their place. The
+    summary is cached per history and only updated with the messages newly left out, so each message is
+    summarized once over a conversation.
+
+    The reduced history is a copy; the original history is not modified.
+    """
+
+    max_messages: int | None = None
+    max_tokens: int | None = None
+    tool_results: str = Field(default="truncate", pattern="^(keep|truncate|drop)$")
+    max_tool_result_chars: int = DEFAULT_MAX_TOOL_RESULT_CHARS
+    summarizer: Summarizer | None = None
+    summary_cache_size: int = DEFAULT_SUMMARY_CACHE_SIZE
+
+    _summaries: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    # region Helper Methods
+    def _compact_tool_results(self, messages: list[ChatMessageContent]) -> list[ChatMessageContent | None]:
+        """Truncate or drop the tool calls and results of every turn but the latest one.
+
+        Returns a list aligned with the messages, holding None for each dropped message.
+        """
+        if self.tool_results == "keep":
+            return list(messages)
+        # The latest turn starts after the last user message or the reply before the latest one
+        replies = [
+            index
+            for index, message in enumerate(messages)
+            if message.role == AuthorRole.USER or (message.role == AuthorRole.ASSISTANT and message.content)
+        ]
+        keep_from = replies[-2] + 1 if len(replies) > 1 else 0
+        compacted: list[ChatMessageContent | None] = []
+        for index, message in enumerate(messages):
+            has_tool_items = any(isinstance(item, (FunctionCallContent, FunctionResultContent)) for item in message.items)
+            if index >= keep_from or not has_tool_items:
+                compacted.append(message)
+            elif self.tool_results == "drop":
+                items = [
+                    item for item in message.items if not isinstance(item, (FunctionCallContent, FunctionResultContent))
+                ]
+                compacted.append(message.model_copy(update={"items": items}) if message.content else None)
+            else:
+                items = [
+                    FunctionResultContent(
+                        id=item.id,
+                        name=item.name,
+                        function_name=item.function_name,
+                        plugin_name=item.plugin_name,
+                        result=truncate_middle(str(item.result), self.max_tool_result_chars),
+                    )
+                    if isinstance(item, FunctionResultContent)
+                    else item
+                    for item in message.items
+                ]
+                compacted.append(message.model_copy(update={"items": items}))
+        return compacted
+
+    def _cut_index(self, messages: list[ChatMessageContent | None]) -> int:
+        """Return the index of the first message to keep."""
+        cut = 0
+        if self.max_messages is not None:
+            kept = 0
+            cut = len(messages)
+            while cut > 0 and kept < self.max_messages:
+                cut -= 1
+                kept += messages[cut] is not None
+        if self.max_tokens is not None:
+            tokens = sum(estimate_tokens(message) for message in messages[cut:] if message is not None)
+            # Always keep the last message
+            while tokens > self.max_tokens and cut < len(messages) - 1:
+                if messages[cut] is not None:
+                    tokens -= estimate_tokens(messages[cut])
+                cut += 1
+        # Never start with a tool result whose call was cut off
+        while cut < len(messages) - 1 and (messages[cut] is None or messages[cut].role == AuthorRole.TOOL):
+            cut += 1
+        return cut
+
+    async def _summary(self, history: list[ChatMessageContent], cut: int) -> str | None:
+        """Return the rolling summary of history[:cut], folding in only the messages not summarized yet."""
+        with self._lock:
+            key = id(history[0])
+            entry = self._summaries.get(key)
+            if entry is None or entry.first_message is not history[0] or entry.summarized_count > cut:
+                entry = self._summaries[key] = _SummaryEntry(history[0])
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+            summarized_count, summary = entry.summarized_count, entry.summary
+
+        if summarized_count < cut:
+            logger.info(f"HistoryReducer: Summarizing {cut - summarized_count} messages")
+            summary = await self.summarizer(summary, history[summarized_count:cut])
+            with self._lock:
+                entry.summarized_count, entry.summary = cut, summary
+        return summary
+
+    # endregion
+
+    async def reduce(self, history: list[ChatMessageContent]) -> list[ChatMessageContent]:
+        """Return the reduced copy of the history.
+
+        Args:
+            history (list[ChatMessageContent]): The messages of the conversation, oldest first.
+        Returns:
+            list[ChatMessageContent]: The messages to send to the model.
+        """
+        if not history:
+            return []
+        compacted = self._compact_tool_results(history)
+        cut = self._cut_index(compacted)
+        reduced = [message for message in compacted[cut:] if message is not None]
+        if cut > 0 and self.summarizer is not None:
+            summary = await self._summary(history, cut)
+            if summary:
+                reduced.insert(0, ChatMessageContent(role=AuthorRole.SYSTEM, content=f"{SUMMARY_PREFIX}{summary}"))
+        if cut > 0 or len(reduced) != len(history):
+            logger.info(f"HistoryReducer: Reduced the history from {len(history)} to {len(reduced)} messages")
+        return reduced
+
+
+class ReducingChatCompletionAgent(ToolReplyChatCompletionAgent):
+    """A ChatCompletionAgent that sends the model the history reduced by its `history_reducer`.
+
+    Messages the agent adds while invoked, such as tool calls and their results, are still added to the
+    full history, and so is the reply streamed to tool results.
+    """
+
+    history_reducer: HistoryReducer | None = None
+
+    def __init__(self, history_reducer: HistoryReducer | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.history_reducer = history_reducer
+
+    async def _reduce(self, history: ChatHistory) -> ChatHistory:
+        if self.history_reducer is None:
+            return history
+        return ChatHistory(messages=await self.history_reducer.reduce(history.messages))
+
+    async def invoke(self, history: ChatHistory) -> AsyncIterable[ChatMessageContent]:
+        reduced = await self._reduce(history)
+        if reduced is history:
+            async for message in super().invoke(history):
+                yield message
+            return
+
+        added = len(reduced.messages)
+        async for message in super().invoke(reduced):
+            for new_message in reduced.messages[added:]:
+                history.add_message(new_message)
+            added = len(reduced.messages)
+            yield message
+        for new_message in reduced.messages[added:]:
+            history.add_message(new_message)
+
+    async def invoke_stream(self, history: ChatHistory) -> AsyncIterable[StreamingChatMessageContent]:
+        reduced = await self._reduce(history)
+        if reduced is history:
+            async for message in super().invoke_stream(history):
+                yield message
+            return
+
+        added = len(reduced.messages)
+        async for message in super().invoke_stream(reduced):
+            for new_message in reduced.messages[added:]:
+                history.add_message(new_message)
+            added = len(reduced.messages)
+            yield message
+        # The streamed reply is only added once the stream ends
+        for new_message in reduced.messages[added:]:
+            history.add_message(new_message)
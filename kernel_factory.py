@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import threading
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+
+import httpx
+from openai import DEFAULT_MAX_RETRIES, AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+from semantic_kernel import Kernel
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.connectors.ai.open_ai.const import DEFAULT_AZURE_API_VERSION
+from semantic_kernel.connectors.ai.open_ai.services.azure_chat_completion import AzureChatCompletion
+from semantic_kernel.utils.telemetry.user_agent import APP_INFO, prepend_semantic_kernel_to_user_agent
+from rate_limiter import RateLimitedTransport, RateLimitScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY_SECONDS = 30.0
+
+
+@dataclass(frozen=True)
+class ConnectionSettings:
+    """The connection pool of a shared Azure OpenAI client.
+
+    Attributes:
+        max_connections (int): The maximum number of concurrent connections to the endpoint.
+        max_keepalive_connections (int): The maximum number of idle connections kept open for reuse.
+        keepalive_expiry_seconds (float): How long an idle connection is kept open.
+    """
+
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry_seconds: float = DEFAULT_KEEPALIVE_EXPIRY_SECONDS
+
+
+_clients: dict[tuple, AsyncAzureOpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def get_shared_async_client(
+    endpoint: str,
+    deployment_name: str,
+    api_version: str | None = None,
+    api_key: str | None = None,
+    ad_token_provider: Callable | None = None,
+    connection_settings: ConnectionSettings | None = None,
+    rate_limit_scheduler: RateLimitScheduler | None = None,
+) -> AsyncAzureOpenAI:
+    """Return the Azure OpenAI client of the endpoint and deployment, creating it on first use.
+
+    Every service of the process using the same endpoint, deployment and credentials shares the client
+    and its pool of kept-alive connections, so only the first request pays the TCP and TLS handshakes.
+    With a `rate_limit_scheduler`, the requests of the client are admitted and retried by the scheduler
+    instead of the OpenAI client.
+    """
+    connection_settings = connection_settings or ConnectionSettings()
+    # The key is hashed so the cache does not hold the API key in clear
+    credential = hashlib.sha256(api_key.encode()).hexdigest() if api_key else id(ad_token_provider)
+    key = (endpoint.rstrip("/"), deployment_name, api_version, credential, connection_settings, id(rate_limit_scheduler))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.info(f"Creating the shared Azure OpenAI client for deployment {deployment_name}")
+            limits = httpx.Limits(
+                max_connections=connection_settings.max_connections,
+                max_keepalive_connections=connection_settings.max_keepalive_connections,
+                keepalive_expiry=connection_settings.keepalive_expiry_seconds,
+            )
+            if rate_limit_scheduler is None:
+                http_client = DefaultAsyncHttpxClient(limits=limits)
+            else:
+                transport = RateLimitedTransport(rate_limit_scheduler, httpx.AsyncHTTPTransport(limits=limits))
+                http_client = DefaultAsyncHttpxClient(transport=transport)
+            client = _clients[key] = AsyncAzureOpenAI(
+                base_url=f"{endpoint.rstrip('/')}/openai/deployments/{deployment_name}",
+                api_version=api_version or DEFAULT_AZURE_API_VERSION,
+                api_key=api_key,
+                azure_ad_token_provider=ad_token_provider,
+                default_headers=prepend_semantic_kernel_to_user_agent(dict(APP_INFO or {})),
+                http_client=http_client,
+                # The scheduler retries throttled requests itself
+                max_retries=DEFAULT_MAX_RETRIES if rate_limit_scheduler is None else 0,
+            )
+        return client
+
+
+async def close_shared_clients() -> None:
+    """Close the shared clients and their connections, e.g. when the application shuts down."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        await client.close()
+
+
+class KernelFactory:
+    """Creates kernels whose AzureChatCompletion services share one pooled client per endpoint and deployment.
+
+    Plugins are passed as factories, so a plugin is only constructed for the kernels that use it. A
+    `chat_completion_factory`, e.g. one of fake_chat_completion, replaces the AzureChatCompletion services.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        deployment_name: str,
+        api_key: str | None = None,
+        api_version: str | None = None,
+        ad_token_provider: Callable | None = None,
+        connection_settings: ConnectionSettings | None = None,
+        rate_limit_scheduler: RateLimitScheduler | None = None,
+        chat_completion_factory: Callable[[str], ChatCompletionClientBase] | None = None,
+    ):
+        """Initializes the factory.
+
+        Args:
+            endpoint (str): The Azure OpenAI endpoint.
+            deployment_name (str): The chat completion deployment.
+            api_key (str | None): The API key, if not using Azure AD.
+            api_version (str | None): The API version.
+            ad_token_provider (Callable | None): Provides Azure AD tokens, if not using an API key.
+            connection_settings (ConnectionSettings | None): The connection pool of the shared client.
+            rate_limit_scheduler (RateLimitScheduler | None): Admits the requests of every service within the
+                quotas of the deployment.
+            chat_completion_factory (Callable[[str], ChatCompletionClientBase] | None): Creates the chat
+                completion service of a service ID instead of an AzureChatCompletion, e.g. to run offline.
+        """
+        self.endpoint = endpoint
+        self.deployment_name = deployment_name
+        self.api_key = api_key
+        self.api_version = api_version
+        self.ad_token_provider = ad_token_provider
+        self.connection_settings = connection_settings or ConnectionSettings()
+        self.rate_limit_scheduler = rate_limit_scheduler
+        self.chat_completion_factory = chat_completion_factory
+
+    def create_chat_completion(self, service_id: str) -> ChatCompletionClientBase:
+        """Create a chat completion service on the shared client."""
+        if self.chat_completion_factory is not None:
+            return self.chat_completion_factory(service_id)
+        client = get_shared_async_client(
+            self.endpoint,
+            self.deployment_name,
+            self.api_version,
+            self.api_key,
+            self.ad_token_provider,
+            self.connection_settings,
+            self.rate_limit_scheduler,
+        )
+        return AzureChatCompletion(
+            service_id=service_id,
+            endpoint=self.endpoint,
+            deployment_name=self.deployment_name,
+            api_key=self.api_key,
+            api_version=self.api_version,
+            ad_token_provider=self.ad_token_provider,
+            async_client=client,
+        )
+
+    def create_kernel(self, service_id: str, plugins: Mapping[str, Callable[[], object]] | None = None) -> Kernel:
+        """Create a kernel with a chat completion service and the given plugins.
+
+        Args:
+            service_id (str): The identifier of the chat completion service.
+            plugins (Mapping[str, Callable[[], object]] | None): Factories of the plugins to add, by plugin name.
+        Returns:
+            Kernel: The kernel.
+        """
+        kernel = Kernel()
+        kernel.add_service(self.create_chat_completion(service_id))
+        for plugin_name, create_plugin in (plugins or {}).items():
+            kernel.add_plugin(plugin_name=plugin_name, plugin=create_plugin())
+        return kernel
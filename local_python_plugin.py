@@ -1,22 +1,131 @@
+import ast
+import asyncio
+import concurrent.futures
+import contextlib
+import ctypes
+import dataclasses
+import inspect
 import logging
 import os
 import re
+import shutil
 import tempfile
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
 from io import BytesIO
 from typing import Annotated
+from uuid import uuid4
+
+from pydantic import Field, PrivateAttr
 
 from semantic_kernel.kernel_pydantic import KernelBaseModel
 from semantic_kernel.functions.kernel_function_decorator import kernel_function
 from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
+from artifact_store import ArtifactStore
+from audit_log import CodeAuditLog
+from code_runner import code_cache, run_code
+from execution_result import ArtifactLimits, ExecutionEvent, ExecutionLimits, ExecutionResult, OutputLimits
+from preflight import check_code
+from result_cache import ExecutionResultCache
+from session_store import SessionNamespaceStore, shared_session_store
+from worker_pool import CANCEL_POLL_INTERVAL_SECONDS, WorkerPool
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_STREAM_BUFFER_SIZE = 64
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 1.0
+# The ioctl cloning a file on copy-on-write file systems, such as Btrfs or XFS, from linux/fs.h
+FICLONE = 0x40049409
+
+EXECUTE_MANY_DESCRIPTION = """Executes several independent Python code snippets in parallel, each in a fresh namespace.
+                     Use it to compare candidate solutions or run a parameter sweep.
+                     Each snippet follows the same format as the code of execute_code.
+                     Returns the result of every snippet, in order.
+                     WARNING: This plugin allows unrestricted access to built-in functions and should be used with caution.
+                     """
+
+EXECUTE_CODE_DESCRIPTION = """Executes the provided Python code.
+                     Start and end the code snippet with double quotes to define it as a string.
+                     Insert \\n within the string wherever a new line should appear.
+                     Add spaces directly after \\n sequences to replicate indentation.
+                     Use \" to include double quotes within the code without ending the string.
+                     Keep everything in a single line; the \\n sequences will represent line breaks
+                     when the string is processed or displayed.
+                     WARNING: This plugin allows unrestricted access to built-in functions and should be used with caution.
+                     """
+
+# Added to the instructions of agents whose LocalPythonPlugin captures artifacts, so the files they write are kept
+ARTIFACT_DIRECTORY_HINT = (
+    "If the ARTIFACT_DIRECTORY variable is defined, save the files and figures meant for the user in that "
+    "directory, e.g. os.path.join(ARTIFACT_DIRECTORY, 'plot.png'), rather than in /tmp."
+)
+
+
+class ExecutionCancelledError(BaseException):
+    """Raised inside the thread running a snippet when its agent turn has been cancelled.
+
+    Derives from BaseException so that `except Exception` blocks in the executed code do not swallow it.
+    """
+
+
 class LocalPythonPlugin(KernelBaseModel):
     """
     A plugin that executes Python code locally with unrestricted access to built-in functions.
     WARNING: This plugin allows unrestricted access to built-in functions and should be used with caution.
+
+    If a WorkerPool is provided, the code is executed in its warm worker processes instead of the host interpreter.
+
+    Code runs in the persistent namespace of `session_id`, so variables and imports survive across calls
+    within a conversation. Set `session_id` to None to run every call in a fresh namespace.
+
+    The code is compiled in memory, with compiled code objects cached by content hash. Provide a CodeAuditLog
+    to keep a record of the generated code.
+
+    Provide an ExecutionResultCache to return the results of repeated deterministic snippets without running them.
+    The cache is only used when `session_id` is None, since a cache hit does not define the snippet's variables.
+
+    Results report the captured stdout and stderr and a summary of the defined variables, each within the
+    budgets of `output_limits`.
+
+    `execution_limits` bounds the wall-clock time, CPU time, memory and output of each execution. Only the
+    output limit applies in the host interpreter; the other limits are enforced by the WorkerPool, which kills
+    workers that exceed them.
+
+    Before running, the code is parsed once and checked for syntax errors, imports that cannot be resolved
+    or are in `forbidden_modules`, and loops that never terminate; failing code is rejected without running it.
+    The parsed code is reused to compile it and compute its cache key. Set `preflight_checks` to False to skip
+    the checks.
+
+    `run_many` and `execute_many` run a batch of independent snippets in parallel across the worker pool, or
+    across a pool started for the batch when there is none, at most `max_batch_concurrency` at a time.
+
+    Provide an ArtifactStore to capture the matplotlib figures the code opened and left open, and the files it
+    wrote in the artifact directory of its session. That directory is created in the directory of
+    `artifact_limits`, /tmp by default, and the code finds its path in the ARTIFACT_DIRECTORY variable; it is
+    also the working directory and TMPDIR of the code run in the worker pool. In the host interpreter, whose
+    working directory and TMPDIR are shared, only the files written under ARTIFACT_DIRECTORY are captured, and
+    files written elsewhere in /tmp never are: give the agent ARTIFACT_DIRECTORY_HINT. Sessionless executions
+    get a directory of their own for each run. Artifacts are kept in the store, and results carry references
+    to them instead of their content. Results with artifacts are not cached.
     """
 
+    worker_pool: WorkerPool | None = None
+    session_id: str | None = Field(default_factory=lambda: str(uuid4()))
+    session_store: SessionNamespaceStore = Field(default_factory=lambda: shared_session_store)
+    audit_log: CodeAuditLog | None = None
+    result_cache: ExecutionResultCache | None = None
+    output_limits: OutputLimits = Field(default_factory=OutputLimits)
+    execution_limits: ExecutionLimits | None = None
+    max_batch_concurrency: int | None = None
+    preflight_checks: bool = True
+    forbidden_modules: frozenset[str] = frozenset()
+    artifact_store: ArtifactStore | None = None
+    artifact_limits: ArtifactLimits = Field(default_factory=ArtifactLimits)
+
+    # The session the artifact directory belongs to, and its path
+    _artifact_directory: tuple[str, str] | None = PrivateAttr(default=None)
+
     # region Helper Methods
     def _sanitize_input(self, code: str) -> str:
         """Sanitize input to the python REPL.
@@ -46,19 +155,257 @@ class LocalPythonPlugin(KernelBaseModel):
             remote_file_path = f"/tmp/{remote_file_path}"
         return remote_file_path
 
+    @staticmethod
+    def _clone_file(source_path: str, destination_path: str) -> None:
+        """Copy the file as a reflink, which shares its blocks until either copy is written, or else in full."""
+        try:
+            import fcntl
+
+            with open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+                fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+            return
+        except (ImportError, OSError):
+            # Not Linux, or a file system without copy-on-write
+            pass
+        shutil.copyfile(source_path, destination_path)
+
+    def _session_artifact_directory(self) -> str:
+        """Return the artifact directory of the current session, creating it on first use."""
+        if self._artifact_directory is None or self._artifact_directory[0] != self.session_id:
+            self._remove_artifact_directory()
+            directory = tempfile.mkdtemp(prefix="artifacts-", dir=self.artifact_limits.directory)
+            self._artifact_directory = (self.session_id, directory)
+        return self._artifact_directory[1]
+
+    def _remove_artifact_directory(self) -> None:
+        if self._artifact_directory is not None:
+            shutil.rmtree(self._artifact_directory[1], ignore_errors=True)
+            self._artifact_directory = None
+
+    def _run_code(
+        self,
+        code: str,
+        cancel_event: threading.Event | None = None,
+        on_output: Callable[[str, str], None] | None = None,
+    ) -> ExecutionResult:
+        """Run the sanitized code in the worker pool, if any, or in the host interpreter.
+
+        Args:
+            code (str): The sanitized code to execute
+            cancel_event (threading.Event | None): Cancels the execution in the worker pool when set.
+            on_output (Callable[[str, str], None] | None): Called with each chunk of output as it is produced.
+        Returns:
+            ExecutionResult: The result of the code execution.
+        """
+        try:
+            # Log the generated code
+            logger.info(f"Generated code:\n{code}")
+            print(f"Generated code:\n{code}")
+
+            if self.audit_log is not None:
+                self.audit_log.record(code, self.session_id)
+
+            tree = None
+            if self.preflight_checks:
+                preflight = check_code(code, self.forbidden_modules)
+                if not preflight.passed:
+                    logger.error(f"LocalPythonPlugin: Pre-flight check failed: {preflight}")
+                    return ExecutionResult.failure(f"Pre-flight check failed: {preflight}", preflight_failed=True)
+                tree = preflight.tree
+
+            cache_key = None
+            if self.result_cache is not None and self.session_id is None:
+                cache_key = self.result_cache.key_for(code, tree or ast.parse(code))
+                cached_result = self.result_cache.get(cache_key) if cache_key is not None else None
+                if cached_result is not None:
+                    logger.info("LocalPythonPlugin: Returning cached result")
+                    return cached_result
+
+            result = self._execute(code, cancel_event, on_output, tree)
+            captured = result.metadata.pop("captured_artifacts", None)
+            if captured:
+                references = [self.artifact_store.put(artifact) for artifact in captured]
+                result.artifacts = [reference for reference in references if reference is not None]
+            # A cached result could outlive the artifacts it refers to in the store
+            if cache_key is not None and result.succeeded and not result.artifacts:
+                self.result_cache.set(cache_key, result)
+        except Exception as e:
+            logger.error(f"LocalPythonPlugin: Error executing code: {e}")
+            return ExecutionResult.failure(str(e))
+
+        if not result.succeeded:
+            logger.error(f"LocalPythonPlugin: {result.result}")
+        return result
+
+    def _execute(
+        self,
+        code: str,
+        cancel_event: threading.Event | None = None,
+        on_output: Callable[[str, str], None] | None = None,
+        tree: ast.Module | None = None,
+    ) -> ExecutionResult:
+        """Execute the code in the worker pool or the host interpreter, within the session namespace if any.
+
+        Workers receive the source and compile it themselves, since code objects cannot be sent to them;
+        the host interpreter compiles the already parsed `tree`, if given.
+        """
+        if self.artifact_store is None:
+            return self._execute_in(code, cancel_event, on_output, tree, None)
+        if self.session_id is not None:
+            artifact_limits = dataclasses.replace(self.artifact_limits, directory=self._session_artifact_directory())
+            return self._execute_in(code, cancel_event, on_output, tree, artifact_limits)
+        # Sessionless executions may run concurrently, e.g. in a batch, so each one gets a directory of its own
+        directory = tempfile.mkdtemp(prefix="artifacts-", dir=self.artifact_limits.directory)
+        try:
+            artifact_limits = dataclasses.replace(self.artifact_limits, directory=directory)
+            return self._execute_in(code, cancel_event, on_output, tree, artifact_limits)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _execute_in(
+        self,
+        code: str,
+        cancel_event: threading.Event | None,
+        on_output: Callable[[str, str], None] | None,
+        tree: ast.Module | None,
+        artifact_limits: ArtifactLimits | None,
+    ) -> ExecutionResult:
+        """Execute the code as `_execute` does, capturing artifacts with the given limits, if any."""
+        if self.worker_pool is not None:
+            return self.worker_pool.run(
+                code,
+                session_id=self.session_id,
+                cancel_event=cancel_event,
+                limits=self.output_limits,
+                on_output=on_output,
+                execution_limits=self.execution_limits,
+                # The files the code writes by relative path are captured as well
+                working_directory=artifact_limits.directory if artifact_limits is not None else None,
+                artifact_limits=artifact_limits,
+            )
+        code_object = code_cache.compile(code, tree) if tree is not None else code
+        if self.session_id is None:
+            return run_code(
+                code_object,
+                limits=self.output_limits,
+                on_output=on_output,
+                execution_limits=self.execution_limits,
+                artifact_limits=artifact_limits,
+            )
+        try:
+            return run_code(
+                code_object,
+                self.session_store.get(self.session_id),
+                self.output_limits,
+                on_output,
+                self.execution_limits,
+                artifact_limits,
+            )
+        finally:
+            self.session_store.update_usage(self.session_id)
+
+    def _run_batch_item(self, code: str, cancel_event: threading.Event | None) -> ExecutionResult:
+        """Run one snippet of a batch, recording how long it took."""
+        started = time.monotonic()
+        if not code:
+            result = ExecutionResult.failure("The provided code is empty")
+        elif cancel_event is not None and cancel_event.is_set():
+            result = ExecutionResult.failure("The execution was cancelled")
+        else:
+            result = self._run_code(self._sanitize_input(code), cancel_event)
+        # Copied, since cached results are shared
+        return dataclasses.replace(
+            result, metadata={**result.metadata, "elapsed_seconds": round(time.monotonic() - started, 6)}
+        )
+
+    def _format_batch(self, results: list[ExecutionResult]) -> str:
+        return "\n\n".join(
+            f"Snippet {index} ({result.metadata['elapsed_seconds']:.3f}s):\n{result}"
+            for index, result in enumerate(results, start=1)
+        )
+
     # endregion
 
+    def run_many(self, codes: list[str], cancel_event: threading.Event | None = None) -> list[ExecutionResult]:
+        """Executes independent Python code snippets in parallel, each in a fresh namespace.
+
+        A failing snippet does not affect the others. Without a worker pool, a pool with one worker per
+        concurrent snippet is started for the batch.
+
+        Args:
+            codes (list[str]): The Python code snippets to execute
+            cancel_event (threading.Event | None): When set, running snippets are stopped and pending ones skipped.
+        Returns:
+            list[ExecutionResult]: The result of each snippet, in order, with its duration in
+                `metadata["elapsed_seconds"]`.
+        """
+        if not codes:
+            return []
+        worker_pool = self.worker_pool
+        max_concurrency = self.max_batch_concurrency or (worker_pool.size if worker_pool else os.cpu_count() or 1)
+        max_concurrency = min(max_concurrency, len(codes))
+        if worker_pool is None:
+            worker_pool = WorkerPool(size=max_concurrency)
+        # Shares the pool, caches and limits, but runs every snippet in a fresh namespace
+        batch_plugin = self.model_copy(update={"session_id": None, "worker_pool": worker_pool})
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                return list(executor.map(lambda code: batch_plugin._run_batch_item(code, cancel_event), codes))
+        finally:
+            if worker_pool is not self.worker_pool:
+                worker_pool.shutdown()
+
+    def upload_file(self, local_file_path: str, remote_file_path: str | None = None, link: bool = False) -> str:
+        """Stage a copy of a local file in /tmp, where the executed code can read it.
+
+        The copy is a reflink where the file system supports it, so staging is instant whatever the size of
+        the file, and otherwise a full copy. Either way, code writing to the staged file leaves the original
+        intact. With `link`, the staged file is a hard link instead, also instant on any file system, but
+        code writing to it in place changes the original; it is copied where a link is not possible, e.g.
+        across file systems.
+
+        Args:
+            local_file_path (str): The path of the file on the local machine.
+            remote_file_path (str | None): The path of the file in /tmp; the name of the local file if None.
+            link (bool): Stage a hard link to the file rather than a copy.
+
+        Returns:
+            str: The path the code reads the file from.
+        """
+        remote_file_path = self._construct_remote_file_path(remote_file_path or os.path.basename(local_file_path))
+        os.makedirs(os.path.dirname(remote_file_path), exist_ok=True)
+        if os.path.exists(remote_file_path) and os.path.samefile(local_file_path, remote_file_path):
+            return remote_file_path
+        # Staged under a temporary name, so a file of the same name is replaced atomically
+        staging_path = f"{remote_file_path}.{uuid4().hex}.tmp"
+        try:
+            if link:
+                try:
+                    os.link(local_file_path, staging_path)
+                except OSError:
+                    shutil.copyfile(local_file_path, staging_path)
+            else:
+                self._clone_file(local_file_path, staging_path)
+            os.replace(staging_path, remote_file_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(staging_path)
+            raise
+        return remote_file_path
+
+    def reset_session(self) -> None:
+        """Drop the variables and imports of the current session, and the files in its artifact directory."""
+        self._remove_artifact_directory()
+        if self.session_id is None:
+            return
+        if self.worker_pool is not None:
+            self.worker_pool.reset_session(self.session_id)
+        else:
+            self.session_store.reset(self.session_id)
+
     # region Kernel Functions
     @kernel_function(
-        description="""Executes the provided Python code.
-                     Start and end the code snippet with double quotes to define it as a string.
-                     Insert \\n within the string wherever a new line should appear.
-                     Add spaces directly after \\n sequences to replicate indentation.
-                     Use \" to include double quotes within the code without ending the string.
-                     Keep everything in a single line; the \\n sequences will represent line breaks
-                     when the string is processed or displayed.
-                     WARNING: This plugin allows unrestricted access to built-in functions and should be used with caution.
-                     """,
+        description=EXECUTE_CODE_DESCRIPTION,
         name="execute_code",
     )
     def execute_code(self, code: Annotated[str, "The valid Python code to execute"]) -> str:
@@ -78,39 +425,225 @@ class LocalPythonPlugin(KernelBaseModel):
 
         logger.info(f"Executing Python code: {code}")
 
-        try:
-            # Save the code to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".py") as temp_file:
-                temp_file.write(code.encode())
-                temp_file_path = temp_file.name
+        return str(self._run_code(code))
 
-            # Log the generated code
-            logger.info(f"Generated code:\n{code}")
+    @kernel_function(
+        description=EXECUTE_MANY_DESCRIPTION,
+        name="execute_many",
+    )
+    def execute_many(self, codes: Annotated[list[str], "The independent Python code snippets to execute"]) -> str:
+        """Executes independent Python code snippets in parallel.
 
-            # Save the generated code to a file
-            with open("generated_code.py", "w") as file:
-                file.write(code)
-                
-            print(f"Generated code:\n{code}")
+        Args:
+            codes (list[str]): The Python code snippets to execute
+        Returns:
+            str: The duration and the Result, Stdout, and Stderr of each snippet, in order
+        Raises:
+            FunctionExecutionException: If no code is provided.
+        """
+        if not codes:
+            raise FunctionExecutionException("The provided code snippets are empty")
+
+        logger.info(f"Executing {len(codes)} Python code snippets")
+
+        return self._format_batch(self.run_many(codes))
+
+    # endregion
+
+
+class AsyncLocalPythonPlugin(LocalPythonPlugin):
+    """
+    An asynchronous LocalPythonPlugin that runs the code off the event loop thread.
+
+    While the code runs, the event loop keeps serving other coroutines (streaming tokens, auth refreshes,
+    concurrent chats). Cancelling the awaiting task stops the running code: the worker process is terminated
+    when a WorkerPool is used, otherwise an ExecutionCancelledError is raised inside the executing thread.
+
+    `execute_code_stream` yields the output of the code as it is produced. When an `event_listener` is set,
+    `execute_code` forwards the same events to it, so callers can show the output of tool calls made by an agent.
+    WARNING: This plugin allows unrestricted access to built-in functions and should be used with caution.
+    """
+
+    event_listener: Callable[[ExecutionEvent], Awaitable[None] | None] | None = None
+    stream_buffer_size: int = DEFAULT_STREAM_BUFFER_SIZE
+    progress_interval_seconds: float = DEFAULT_PROGRESS_INTERVAL_SECONDS
+
+    # region Helper Methods
+    def _run_code_in_thread(
+        self,
+        code: str,
+        cancel_event: threading.Event,
+        state: dict,
+        on_output: Callable[[str, str], None] | None = None,
+    ) -> ExecutionResult:
+        """Run the code in the current executor thread, registering the thread so it can be cancelled."""
+        try:
+            with state["lock"]:
+                state["thread_id"] = threading.get_ident()
+            try:
+                return self._run_code(code, cancel_event, on_output)
+            finally:
+                # Acquiring the lock guarantees a pending cancellation is raised here rather than after returning
+                with state["lock"]:
+                    state["thread_id"] = None
+        except ExecutionCancelledError:
+            logger.info("AsyncLocalPythonPlugin: Execution cancelled")
+            return ExecutionResult.failure("The execution was cancelled")
 
-            # Unrestricted execution: Allow all built-in functions
-            safe_globals = {"__builtins__": __builtins__}  # Allow all built-ins
-            safe_locals = {}  # Create a local execution scope
-
-            # Read the code from the temporary file and execute it safely
-            with open(temp_file_path, "r") as file:
-                exec(file.read(), safe_globals, safe_locals)
-
-            # Return only defined variables (not execution metadata)
-            return str(
-                {
-                    key: safe_locals[key]
-                    for key in safe_locals
-                    if not key.startswith("__")
-                }
+    def _cancel_thread(self, state: dict) -> None:
+        """Raise an ExecutionCancelledError in the thread running the code, if it is still running."""
+        with state["lock"]:
+            thread_id = state["thread_id"]
+            if thread_id is None:
+                return
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(thread_id), ctypes.py_object(ExecutionCancelledError)
             )
-        except Exception as e:
-            logger.error(f"LocalPythonPlugin: Error executing code: {e}")
-            return f"Error executing code: {e}"
+
+    def _cancel(self, cancel_event: threading.Event, state: dict) -> None:
+        cancel_event.set()
+        if self.worker_pool is None:
+            self._cancel_thread(state)
+
+    async def _stream(self, code: str) -> AsyncIterator[ExecutionEvent]:
+        """Run the sanitized code in a thread, yielding its output, progress heartbeats and finally its result."""
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue[ExecutionEvent] = asyncio.Queue(maxsize=self.stream_buffer_size)
+        cancel_event = threading.Event()
+        state = {"lock": threading.Lock(), "thread_id": None}
+        started = time.monotonic()
+
+        def on_output(stream: str, text: str) -> None:
+            event = ExecutionEvent(kind=stream, text=text, elapsed_seconds=time.monotonic() - started)
+            future = asyncio.run_coroutine_threadsafe(events.put(event), loop)
+            # Blocks the running code while the consumer is behind, which applies the backpressure
+            while not cancel_event.is_set():
+                try:
+                    future.result(timeout=CANCEL_POLL_INTERVAL_SECONDS)
+                    return
+                except concurrent.futures.TimeoutError:
+                    continue
+            future.cancel()
+
+        execution = asyncio.ensure_future(
+            asyncio.to_thread(self._run_code_in_thread, code, cancel_event, state, on_output)
+        )
+        try:
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait(
+                    {next_event, execution},
+                    timeout=self.progress_interval_seconds,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if next_event in done:
+                    yield next_event.result()
+                    continue
+                next_event.cancel()
+                elapsed_seconds = time.monotonic() - started
+                if execution in done:
+                    while not events.empty():
+                        yield events.get_nowait()
+                    yield ExecutionEvent(kind="result", elapsed_seconds=elapsed_seconds, result=execution.result())
+                    return
+                yield ExecutionEvent(kind="progress", elapsed_seconds=elapsed_seconds)
+        finally:
+            if not execution.done():
+                self._cancel(cancel_event, state)
+
+    # endregion
+
+    async def execute_code_stream(self, code: str) -> AsyncIterator[ExecutionEvent]:
+        """Executes the provided Python code, yielding its output as it is produced.
+
+        Yields "stdout" and "stderr" events for each chunk of output, "progress" heartbeats while the code runs
+        without output, and a final "result" event. Output is buffered up to `stream_buffer_size` chunks, beyond
+        which the running code waits for the consumer. Closing the generator early stops the running code.
+
+        Args:
+            code (str): The valid Python code to execute
+        Raises:
+            FunctionExecutionException: If the provided code is empty.
+        """
+        if not code:
+            raise FunctionExecutionException("The provided code is empty")
+
+        code = self._sanitize_input(code)
+
+        logger.info(f"Executing Python code: {code}")
+
+        async with contextlib.aclosing(self._stream(code)) as events:
+            async for event in events:
+                yield event
+
+    # region Kernel Functions
+    @kernel_function(
+        description=EXECUTE_CODE_DESCRIPTION,
+        name="execute_code",
+    )
+    async def execute_code(self, code: Annotated[str, "The valid Python code to execute"]) -> str:
+        """Executes the provided Python code without blocking the event loop.
+
+        Args:
+            code (str): The valid Python code to execute
+        Returns:
+            str: The result of the Python code execution in the form of Result, Stdout, and Stderr
+        Raises:
+            FunctionExecutionException: If the provided code is empty.
+            asyncio.CancelledError: If the awaiting task is cancelled; the running code is stopped as well.
+        """
+        if not code:
+            raise FunctionExecutionException("The provided code is empty")
+
+        code = self._sanitize_input(code)
+
+        logger.info(f"Executing Python code: {code}")
+
+        if self.event_listener is not None:
+            async with contextlib.aclosing(self._stream(code)) as events:
+                async for event in events:
+                    notified = self.event_listener(event)
+                    if inspect.isawaitable(notified):
+                        await notified
+                    if event.result is not None:
+                        return str(event.result)
+
+        cancel_event = threading.Event()
+        state = {"lock": threading.Lock(), "thread_id": None}
+        try:
+            return str(await asyncio.to_thread(self._run_code_in_thread, code, cancel_event, state))
+        except asyncio.CancelledError:
+            self._cancel(cancel_event, state)
+            raise
+
+    @kernel_function(
+        description=EXECUTE_MANY_DESCRIPTION,
+        name="execute_many",
+    )
+    async def execute_many(
+        self, codes: Annotated[list[str], "The independent Python code snippets to execute"]
+    ) -> str:
+        """Executes independent Python code snippets in parallel without blocking the event loop.
+
+        Args:
+            codes (list[str]): The Python code snippets to execute
+        Returns:
+            str: The duration and the Result, Stdout, and Stderr of each snippet, in order
+        Raises:
+            FunctionExecutionException: If no code is provided.
+            asyncio.CancelledError: If the awaiting task is cancelled; the running snippets are stopped as well.
+        """
+        if not codes:
+            raise FunctionExecutionException("The provided code snippets are empty")
+
+        logger.info(f"Executing {len(codes)} Python code snippets")
+
+        cancel_event = threading.Event()
+        try:
+            return self._format_batch(await asyncio.to_thread(self.run_many, codes, cancel_event))
+        except asyncio.CancelledError:
+            # Batches always run in worker processes, so setting the event stops them
+            cancel_event.set()
+            raise
 
     # endregion
@@ -0,0 +1,181 @@
+import ast
+import importlib.util
+import re
+import sys
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+# Calls that stop a loop from the inside, like a break
+LOOP_EXIT_CALLS = frozenset({"exit", "quit", "_exit"})
+PIP_PATTERN = re.compile(r"\bpip3?\b")
+
+_found_modules: set[str] = set()
+_found_modules_lock = threading.Lock()
+
+
+@dataclass
+class PreflightResult:
+    """The outcome of checking code before executing it.
+
+    Attributes:
+        tree (ast.Module | None): The parsed code, for the later stages to reuse. None if it has a syntax error.
+        diagnostics (list[str]): One line per problem found. Empty if the code passed.
+    """
+
+    tree: ast.Module | None = None
+    diagnostics: list[str] = field(default_factory=list)
+
+    @property
+    def passed(self) -> bool:
+        return not self.diagnostics
+
+    def __str__(self) -> str:
+        return "; ".join(self.diagnostics)
+
+
+def _module_exists(name: str) -> bool:
+    """Return whether the top-level module can be imported.
+
+    Only found modules are cached, so a module installed later in the session is picked up.
+    """
+    if name in _found_modules or name in sys.modules:
+        return True
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    if found:
+        with _found_modules_lock:
+            _found_modules.add(name)
+    return found
+
+
+def _installs_packages(tree: ast.AST) -> bool:
+    """Return whether the code looks like it installs packages, so its imports cannot be checked upfront."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and PIP_PATTERN.search(node.value):
+            return True
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            if any(name.split(".")[0] == "pip" for name in names):
+                return True
+    return False
+
+
+def _guarded_nodes(tree: ast.AST) -> set[int]:
+    """Return the ids of the nodes inside a try block, whose imports may fail on purpose."""
+    guarded: set[int] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Try):
+            for statement in node.body:
+                guarded.update(id(child) for child in ast.walk(statement))
+    return guarded
+
+
+def _function_body_nodes(tree: ast.AST) -> set[int]:
+    """Return the ids of the nodes inside a function body, which only run if the function is called."""
+    nested: set[int] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            for child in ast.iter_child_nodes(node):
+                nested.update(id(descendant) for descendant in ast.walk(child))
+    return nested
+
+
+def _exits_loop(body: list[ast.stmt]) -> bool:
+    """Return whether the loop body contains a break, return, raise, yield or exit call of its own."""
+    pending: list[ast.AST] = list(body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.Break, ast.Return, ast.Raise, ast.Yield, ast.YieldFrom, ast.Await)):
+            return True
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+            if name in LOOP_EXIT_CALLS:
+                return True
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            # A break in a nested loop only exits that loop, but a return or raise still exits this one
+            pending.extend(child for child in ast.walk(node) if isinstance(child, (ast.Return, ast.Raise)))
+            continue
+        pending.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def _is_unbounded_iterable(node: ast.expr) -> bool:
+    """Return whether the iterable is an infinite iterator, e.g. itertools.count() or cycle(...)."""
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+    return name in ("count", "cycle") or (name == "repeat" and len(node.args) < 2 and not node.keywords)
+
+
+def _unbounded_loop(node: ast.AST) -> str | None:
+    """Return a diagnostic if the node is a loop that can never terminate."""
+    if isinstance(node, ast.While):
+        test = node.test
+        if isinstance(test, ast.Constant) and test.value and not _exits_loop(node.body):
+            return f"Line {node.lineno}: the while loop never terminates, it has no break, return or raise"
+    elif isinstance(node, (ast.For, ast.AsyncFor)):
+        if _is_unbounded_iterable(node.iter) and not _exits_loop(node.body):
+            return f"Line {node.lineno}: the for loop over an infinite iterator has no break, return or raise"
+    return None
+
+
+def check_code(code: str, forbidden_modules: Iterable[str] = ()) -> PreflightResult:
+    """Parse the code once and check it for problems that would make its execution fail or never end.
+
+    Reports syntax errors, imports of modules that are forbidden or, at module level, not installed, and
+    module-level loops that obviously never terminate. Imports of missing modules and loops inside
+    functions are left alone, since the function may run in a daemon thread, or never be called.
+
+    Args:
+        code (str): The sanitized code.
+        forbidden_modules (Iterable[str]): Top-level modules the code may not import.
+    Returns:
+        PreflightResult: The parsed code and the problems found.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        location = f" (line {e.lineno}: {line})" if line else f" (line {e.lineno})"
+        return PreflightResult(diagnostics=[f"{type(e).__name__}: {e.msg}{location}"])
+
+    diagnostics: list[str] = []
+    forbidden_modules = frozenset(forbidden_modules)
+    missing_imports: list[tuple[str, ast.stmt]] = []
+    unbounded_loops: list[tuple[str, ast.stmt]] = []
+    # A single walk over the tree, since each walk costs about as much as parsing
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names = [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            module_names = [node.module.split(".")[0]]
+        else:
+            loop_diagnostic = _unbounded_loop(node)
+            if loop_diagnostic is not None:
+                unbounded_loops.append((loop_diagnostic, node))
+            continue
+        for module_name in module_names:
+            if module_name in forbidden_modules:
+                diagnostics.append(f"Line {node.lineno}: importing {module_name} is not allowed")
+            elif not _module_exists(module_name):
+                missing_imports.append((module_name, node))
+
+    in_functions = _function_body_nodes(tree) if unbounded_loops or missing_imports else set()
+    diagnostics.extend(diagnostic for diagnostic, node in unbounded_loops if id(node) not in in_functions)
+
+    # Rare, so the extra walks are only paid when an import cannot be resolved
+    if missing_imports and not _installs_packages(tree):
+        guarded = _guarded_nodes(tree)
+        diagnostics.extend(
+            f"Line {node.lineno}: ModuleNotFoundError: No module named '{module_name}'"
+            for module_name, node in missing_imports
+            if id(node) not in guarded and id(node) not in in_functions
+        )
+    return PreflightResult(tree=tree, diagnostics=diagnostics)
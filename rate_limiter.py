@@ -0,0 +1,238 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+# Assumed for requests that do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_BACKOFF_SECONDS = 1.0
+DEFAULT_MAX_BACKOFF_SECONDS = 60.0
+RETRY_STATUS_CODES = frozenset({429, 503})
+
+
+class Priority(IntEnum):
+    """The lanes of the scheduler; a lower value is admitted first."""
+
+    IN_FLIGHT = 0
+    NEW_CONVERSATION = 1
+
+
+# The lane of the requests made in the current context
+_priority: ContextVar[Priority] = ContextVar("rate_limiter_priority", default=Priority.IN_FLIGHT)
+
+
+@contextlib.contextmanager
+def new_conversation():
+    """Mark the requests made in the block as belonging to a new conversation.
+
+    The first request of the block waits in the NEW_CONVERSATION lane. Once it is admitted, the
+    conversation is in flight, and its next requests, like tool call rounds, the turns of other agents
+    and strategy prompts, wait in the IN_FLIGHT lane and are admitted first.
+    """
+    token = _priority.set(Priority.NEW_CONVERSATION)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Holds up to `capacity` units, refilled continuously at `capacity` per minute."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self._refilled_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._refilled_at) * self.capacity / 60)
+        self._refilled_at = now
+
+    def delay(self, amount: float) -> float:
+        """Return the seconds until `amount` units are available."""
+        self._refill()
+        # A request larger than the bucket waits for a full bucket rather than forever
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) * 60 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def clamp(self, remaining: float) -> None:
+        """Align the bucket with the remaining quota reported by the service."""
+        self._refill()
+        self.level = min(self.level, remaining)
+
+
+class RateLimitScheduler:
+    """Admits the chat completion requests of a deployment within its request and token quotas.
+
+    Requests wait, in priority order, until a requests-per-minute and a tokens-per-minute bucket both have
+    room. Tokens are estimated from the request body: about one per CHARS_PER_TOKEN characters of the
+    prompt, plus max_tokens. When the service still answers 429, every request is held back for its
+    Retry-After, and the throttled request is retried after a random jitter on top of it.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_backoff_seconds: float = DEFAULT_BASE_BACKOFF_SECONDS,
+        max_backoff_seconds: float = DEFAULT_MAX_BACKOFF_SECONDS,
+    ):
+        """Initializes the scheduler.
+
+        Args:
+            requests_per_minute (float | None): The RPM quota of the deployment, unlimited if None.
+            tokens_per_minute (float | None): The TPM quota of the deployment, unlimited if None.
+            max_retries (int): How many times a throttled request is retried.
+            base_backoff_seconds (float): The first backoff when the service gives no Retry-After.
+            max_backoff_seconds (float): The longest backoff.
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.throttled_count = 0
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition: asyncio.Condition | None = None
+
+    # region Helper Methods
+    def _delay(self, tokens: int) -> float:
+        delays = [self._paused_until - time.monotonic()]
+        if self.requests is not None:
+            delays.append(self.requests.delay(1))
+        if self.tokens is not None:
+            delays.append(self.tokens.delay(tokens))
+        return max(delays)
+
+    # endregion
+
+    async def acquire(self, tokens: int, priority: Priority = Priority.IN_FLIGHT) -> None:
+        """Wait until the request may be sent, behind the requests of the same or a higher priority."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        waiter = (int(priority), next(self._sequence))
+        async with self._condition:
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == waiter:
+                        delay = self._delay(tokens)
+                        if delay <= 0:
+                            break
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(tokens)
+
+    def backoff_seconds(self, attempt: int, retry_after: float | None) -> float:
+        """Return how long to wait before retrying a throttled request, with a random jitter."""
+        backoff = retry_after if retry_after is not None else self.base_backoff_seconds * 2**attempt
+        backoff = min(backoff, self.max_backoff_seconds)
+        return backoff + random.uniform(0, backoff / 2)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every request back for the given seconds, e.g. after a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update_remaining(self, headers: httpx.Headers) -> None:
+        """Align the token bucket with the x-ratelimit-remaining-tokens header of a response."""
+        value = headers.get("x-ratelimit-remaining-tokens")
+        if self.tokens is not None and value is not None:
+            try:
+                self.tokens.clamp(float(value))
+            except ValueError:
+                pass
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """Estimate the tokens a chat completion request counts against the quota: its prompt and max_tokens."""
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return DEFAULT_COMPLETION_TOKENS
+    if not isinstance(body, dict):
+        return DEFAULT_COMPLETION_TOKENS
+    prompt_chars = len(json.dumps(body.get("messages", ""), ensure_ascii=False))
+    completion_tokens = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt_chars // CHARS_PER_TOKEN + int(completion_tokens)
+
+
+def _retry_after_seconds(headers: httpx.Headers) -> float | None:
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """An httpx transport that sends requests through a RateLimitScheduler and retries throttled ones.
+
+    Retries re-enter the scheduler in the IN_FLIGHT lane, ahead of new conversations.
+    """
+
+    def __init__(self, scheduler: RateLimitScheduler, transport: httpx.AsyncBaseTransport):
+        self.scheduler = scheduler
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tokens = estimate_request_tokens(request)
+        priority = _priority.get()
+        # The next requests of the conversation are in flight
+        _priority.set(Priority.IN_FLIGHT)
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(tokens, priority)
+            response = await self.transport.handle_async_request(request)
+            self.scheduler.update_remaining(response.headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.scheduler.max_retries:
+                return response
+            retry_after = _retry_after_seconds(response.headers)
+            await response.aclose()
+            backoff = self.scheduler.backoff_seconds(attempt, retry_after)
+            self.scheduler.throttled_count += 1
+            logger.warning(
+                f"RateLimitedTransport: Throttled with status {response.status_code}, "
+                f"retrying in {backoff:.1f}s (attempt {attempt + 1} of {self.scheduler.max_retries})"
+            )
+            if retry_after is not None:
+                # The quota is shared, so the other requests would be throttled too
+                self.scheduler.pause(retry_after)
+            await asyncio.sleep(backoff)
+            priority = Priority.IN_FLIGHT
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,256 @@
+import ast
+import copy
+import dataclasses
+import hashlib
+import json
+import logging
+import platform
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from importlib import metadata
+
+from execution_result import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_CACHE_SIZE = 1024
+DEFAULT_RESULT_CACHE_TTL_SECONDS = 60 * 60
+
+# Modules whose use makes the output depend on randomness, the clock, the environment or I/O. Dotted names
+# match the submodule and everything below it, e.g. numpy.random.rand but not numpy.linalg
+NONDETERMINISTIC_MODULES = frozenset({
+    "asyncio", "datetime", "glob", "http", "io", "multiprocessing", "numpy.random", "os", "pathlib", "random",
+    "requests", "secrets", "shutil", "socket", "sqlite3", "subprocess", "sys", "tempfile", "threading", "time",
+    "torch.random", "urllib", "uuid", "zoneinfo",
+})
+# Built-ins that read input, touch files, depend on the process, or can hide any of these
+NONDETERMINISTIC_BUILTINS = frozenset({
+    "__import__", "breakpoint", "compile", "eval", "exec", "hash", "id", "input", "open",
+})
+# Attributes that are nondeterministic whatever module they are reached from, e.g. np.random or pd.Timestamp.now
+NONDETERMINISTIC_ATTRIBUTES = frozenset({"now", "random", "today", "urandom", "utcnow"})
+# Attributes that read files or the network, e.g. Image.open, np.load or urllib.request.urlopen
+IO_ATTRIBUTES = frozenset({
+    "fromfile", "genfromtxt", "imread", "load", "loadtxt", "memmap", "open", "read", "read_bytes", "read_text",
+    "urlopen",
+})
+# Attributes starting with this read files, e.g. pd.read_csv or pd.read_parquet
+IO_ATTRIBUTE_PREFIX = "read_"
+# String literals that look like a path or a URL: their content can change while the code does not
+PATH_LIKE_PATTERN = re.compile(
+    r"^(?:/|~|\.{1,2}[/\\]|[A-Za-z]:[/\\])|://|^[\w.-]+\.(?:csv|tsv|json|jsonl|txt|parquet|xlsx?|npy|npz|pkl|pickle|"
+    r"h5|hdf5|feather|png|jpe?g|gif|bmp|db|sqlite)$",
+    re.IGNORECASE,
+)
+
+
+def _is_nondeterministic_module(name: str) -> bool:
+    """Return whether the dotted name is, or is inside, one of the nondeterministic modules."""
+    parts = name.split(".")
+    return any(".".join(parts[:i]) in NONDETERMINISTIC_MODULES for i in range(1, len(parts) + 1))
+
+
+def _imported_names(tree: ast.AST) -> dict[str, str]:
+    """Return the full dotted name each name bound by an import of the code stands for."""
+    names: dict[str, str] = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname is not None:
+                    names[alias.asname] = alias.name
+                else:
+                    top_level = alias.name.split(".")[0]
+                    names[top_level] = top_level
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            for alias in node.names:
+                names[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+    return names
+
+
+def _dotted_name(node: ast.Attribute, imported_names: dict[str, str]) -> str | None:
+    """Return the full dotted name of an attribute chain such as npr.rand, with import aliases resolved."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(imported_names.get(node.id, node.id))
+    return ".".join(reversed(parts))
+
+
+def is_deterministic(tree: ast.AST) -> bool:
+    """Return whether the parsed code looks free of randomness, clock reads and I/O.
+
+    This is a conservative syntactic check: any import of, or reference to, a known nondeterministic
+    module, built-in or attribute, any call to a file or network reading attribute, and any string that
+    looks like a path or a URL makes the code uncacheable. Imports are matched by their full dotted
+    name, and references through an import alias by the name the alias stands for.
+    """
+    imported_names = _imported_names(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(_is_nondeterministic_module(alias.name) for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            if _is_nondeterministic_module(module):
+                return False
+            if any(_is_nondeterministic_module(f"{module}.{alias.name}") for alias in node.names):
+                return False
+            if any(alias.name in NONDETERMINISTIC_ATTRIBUTES for alias in node.names):
+                return False
+        elif isinstance(node, ast.Name):
+            if node.id in NONDETERMINISTIC_BUILTINS:
+                return False
+        elif isinstance(node, ast.Attribute):
+            if node.attr in NONDETERMINISTIC_ATTRIBUTES or node.attr in IO_ATTRIBUTES:
+                return False
+            if node.attr.startswith(IO_ATTRIBUTE_PREFIX):
+                return False
+            dotted_name = _dotted_name(node, imported_names)
+            if dotted_name is not None and _is_nondeterministic_module(dotted_name):
+                return False
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            if PATH_LIKE_PATTERN.search(node.value):
+                return False
+    return True
+
+
+def environment_fingerprint() -> str:
+    """Return a hash of the interpreter and the installed package versions."""
+    packages = sorted(f"{dist.metadata['Name']}=={dist.version}" for dist in metadata.distributions())
+    fingerprint = "\n".join([sys.version, platform.platform(), sys.executable, *packages])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+class ExecutionResultCache:
+    """A content-addressed cache of the results of deterministic code snippets.
+
+    Results are keyed by the hash of the sanitized code and the environment fingerprint, and expire
+    after `ttl_seconds`. The in-memory LRU holds up to `maxsize` results; when `path` is given, results
+    are also persisted in an SQLite database so they survive restarts and are shared between processes.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_RESULT_CACHE_SIZE,
+        ttl_seconds: float | None = DEFAULT_RESULT_CACHE_TTL_SECONDS,
+        path: str | None = None,
+    ):
+        """Initializes the cache.
+
+        Args:
+            maxsize (int): The maximum number of results kept in memory and on disk.
+            ttl_seconds (float | None): How long a result stays valid. None keeps results until evicted.
+            path (str | None): The path of the SQLite database backing the cache, if any.
+        """
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._fingerprint: str | None = None
+        self._entries: OrderedDict[str, tuple[ExecutionResult, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, result TEXT, expires_at REAL, last_used REAL)"
+                )
+
+    # region Helper Methods
+    def _expires_at(self) -> float | None:
+        return time.time() + self.ttl_seconds if self.ttl_seconds is not None else None
+
+    @staticmethod
+    def _copy(result: ExecutionResult) -> ExecutionResult:
+        """Return a copy of the result that callers can change without changing the cached one."""
+        return dataclasses.replace(
+            result, metadata=copy.deepcopy(result.metadata), artifacts=copy.deepcopy(result.artifacts)
+        )
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _get_from_disk(self, key: str) -> tuple[ExecutionResult, float | None] | None:
+        row = self._connection.execute("SELECT result, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return ExecutionResult(**json.loads(row[0])), row[1]
+
+    def _set_on_disk(self, key: str, result: ExecutionResult, expires_at: float | None) -> None:
+        now = time.time()
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, json.dumps(dataclasses.asdict(result)), expires_at, now),
+            )
+            self._connection.execute("DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+            self._connection.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+
+    # endregion
+
+    def key_for(self, code: str, tree: ast.AST) -> str | None:
+        """Return the cache key of the sanitized code, or None if its result must not be cached.
+
+        Args:
+            code (str): The sanitized code.
+            tree (ast.AST): The parsed code, used to detect nondeterminism.
+        """
+        if not is_deterministic(tree):
+            return None
+        if self._fingerprint is None:
+            self._fingerprint = environment_fingerprint()
+        return hashlib.sha256(f"{self._fingerprint}\n{code}".encode()).hexdigest()
+
+    def get(self, key: str) -> ExecutionResult | None:
+        """Return a copy of the cached result for the key, or None on a miss or if the result expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._connection is not None:
+                entry = self._get_from_disk(key)
+                if entry is not None:
+                    self._entries[key] = entry
+            if entry is None:
+                return None
+
+            result, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                if self._connection is not None:
+                    with self._connection:
+                        self._connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self._entries.move_to_end(key)
+            self._trim()
+            return self._copy(result)
+
+    def set(self, key: str, result: ExecutionResult) -> None:
+        """Store the result for the key, evicting the least recently used results beyond `maxsize`."""
+        expires_at = self._expires_at()
+        with self._lock:
+            self._entries[key] = (self._copy(result), expires_at)
+            self._entries.move_to_end(key)
+            self._trim()
+            if self._connection is not None:
+                self._set_on_disk(key, result, expires_at)
+
+    def clear(self) -> None:
+        """Remove every cached result."""
+        with self._lock:
+            self._entries.clear()
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute("DELETE FROM results")
@@ -0,0 +1,137 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from types import ModuleType
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = 32
+DEFAULT_MEMORY_BUDGET_BYTES = 512 * 1024 * 1024
+DEFAULT_IDLE_TIMEOUT_SECONDS = 60 * 60
+
+
+def estimate_size(value) -> int:
+    """Roughly estimate the memory held by a namespace value in bytes.
+
+    Arrays and DataFrames report their buffers, containers are counted one level deep and
+    modules are ignored since they are shared with the rest of the interpreter.
+    """
+    if isinstance(value, ModuleType):
+        return 0
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    memory_usage = getattr(value, "memory_usage", None)
+    if callable(memory_usage):
+        try:
+            return int(memory_usage(deep=True).sum())
+        except Exception:
+            pass
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k, 0) + sys.getsizeof(v, 0) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item, 0) for item in value)
+    return size
+
+
+class _Session:
+    def __init__(self):
+        self.namespace = {"__builtins__": __builtins__}  # Allow all built-ins
+        self.size_bytes = 0
+        self.last_used = time.monotonic()
+
+
+class SessionNamespaceStore:
+    """Persistent execution namespaces keyed by session identifier, like an IPython kernel per conversation.
+
+    Variables and imports survive across executions within a session. Sessions idle for longer than
+    `idle_timeout_seconds` are dropped, and the least recently used sessions are evicted once there are more
+    than `max_sessions` or their estimated size exceeds `memory_budget_bytes`.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES,
+        idle_timeout_seconds: float | None = DEFAULT_IDLE_TIMEOUT_SECONDS,
+    ):
+        self.max_sessions = max_sessions
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    # region Helper Methods
+    def _evict_idle(self) -> None:
+        if self.idle_timeout_seconds is None:
+            return
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_timeout_seconds:
+                break
+            logger.info(f"SessionNamespaceStore: Evicting idle session {session_id}")
+            del self._sessions[session_id]
+
+    def _evict_over_budget(self, keep: str | None = None) -> None:
+        """Evict least recently used sessions, other than `keep`, until the limits are met."""
+        total_bytes = sum(session.size_bytes for session in self._sessions.values())
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and total_bytes <= self.memory_budget_bytes:
+                return
+            if session_id == keep:
+                continue
+            logger.info(f"SessionNamespaceStore: Evicting least recently used session {session_id}")
+            total_bytes -= self._sessions.pop(session_id).size_bytes
+
+        if keep in self._sessions and total_bytes > self.memory_budget_bytes:
+            logger.warning(f"SessionNamespaceStore: Session {keep} alone exceeds the memory budget, dropping it")
+            del self._sessions[keep]
+
+    # endregion
+
+    def get(self, session_id: str) -> dict:
+        """Return the namespace of the session, creating it if needed, and mark the session as used."""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+                self._evict_over_budget(keep=session_id)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session.namespace
+
+    def update_usage(self, session_id: str) -> None:
+        """Re-estimate the memory held by the session after an execution and enforce the budget."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session.size_bytes = sum(
+                estimate_size(value) for key, value in session.namespace.items() if not key.startswith("__")
+            )
+            session.last_used = time.monotonic()
+            self._evict_over_budget(keep=session_id)
+
+    def reset(self, session_id: str | None = None) -> None:
+        """Drop the namespace of the given session, or of every session if no identifier is given."""
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# The store shared by every LocalPythonPlugin in the process that is not given its own, so the memory budget is global
+shared_session_store = SessionNamespaceStore()
@@ -0,0 +1,347 @@
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import httpx
+
+from semantic_kernel.core_plugins.sessions_python_tool.sessions_python_plugin import SessionsPythonTool
+from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
+
+from kernel_factory import ConnectionSettings
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARM_SESSIONS = 4
+DEFAULT_MAX_LEASE_WAIT_SECONDS = 5.0
+DEFAULT_MAX_USES_PER_SESSION = 20
+DEFAULT_HTTP_TIMEOUT_SECONDS = 120.0
+DEFAULT_UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Allocates the session without doing any work; e.g. "import numpy, pandas" also warms the imports
+DEFAULT_WARMUP_CODE = "pass"
+# Clears what a conversation left in a session: its variables, including those starting with "_", its outputs,
+# and its files in /mnt/data. The imported modules stay loaded. Only the dunder names and those the code
+# interpreter defines itself are kept.
+RESET_CODE = """
+def __reset_session__():
+    import os, shutil
+    namespace = globals()
+    kept = {"In", "Out", "get_ipython", "exit", "quit", "_ih", "_oh", "_dh"}
+    for name in [n for n in namespace if n not in kept and not (n.startswith("__") and n.endswith("__"))]:
+        del namespace[name]
+    if isinstance(namespace.get("Out"), dict):
+        namespace["Out"].clear()
+    for entry in os.scandir("/mnt/data"):
+        if entry.is_dir():
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+__reset_session__()
+del __reset_session__
+"""
+# The API version of SessionsPythonTool
+SESSIONS_API_VERSION = "2024-02-02-preview"
+RECYCLE_RESET = "reset"
+RECYCLE_DISCARD = "discard"
+
+
+class WarmSessionPool:
+    """Leases pre-warmed session identifiers of a dynamic sessions pool to conversations.
+
+    A session is allocated by the service on the first execution of its identifier, which makes the
+    first execution of a conversation slow. The pool keeps `warm_sessions` identifiers whose session has
+    already been allocated, by executing `warmup_code` in them. A conversation leases one, waiting up to
+    `max_lease_wait_seconds` for a warm-up in progress, or else starts cold on a new identifier. Released
+    sessions are cleared with RESET_CODE and leased again, up to `max_uses_per_session` times, or
+    discarded when `recycle` is RECYCLE_DISCARD or `warm_sessions` are already available. Every SessionsPythonTool of the pool shares its HTTP
+    client and its pool of kept-alive connections.
+    """
+
+    def __init__(
+        self,
+        pool_management_endpoint: str,
+        auth_callback: Callable[[], Any | Awaitable[Any]],
+        warm_sessions: int = DEFAULT_WARM_SESSIONS,
+        max_lease_wait_seconds: float = DEFAULT_MAX_LEASE_WAIT_SECONDS,
+        recycle: str = RECYCLE_RESET,
+        max_uses_per_session: int = DEFAULT_MAX_USES_PER_SESSION,
+        warmup_code: str = DEFAULT_WARMUP_CODE,
+        connection_settings: ConnectionSettings | None = None,
+        http_client: httpx.AsyncClient | None = None,
+    ):
+        """Initializes the pool; the sessions are warmed from the first lease, or `start`.
+
+        Args:
+            pool_management_endpoint (str): The pool management endpoint of the sessions pool.
+            auth_callback (Callable[[], Any | Awaitable[Any]]): Returns the token of the sessions pool, as the
+                auth_callback of a SessionsPythonTool.
+            warm_sessions (int): The number of warm sessions kept ready, or being warmed.
+            max_lease_wait_seconds (float): How long a lease waits for a session being warmed before it
+                starts cold on a new identifier.
+            recycle (str): RECYCLE_RESET to clear released sessions and lease them again, or RECYCLE_DISCARD
+                to drop them.
+            max_uses_per_session (int): How many conversations a session serves before it is discarded.
+            warmup_code (str): The code executed to allocate a session.
+            connection_settings (ConnectionSettings | None): The connection pool of the shared HTTP client.
+            http_client (httpx.AsyncClient | None): The shared HTTP client, e.g. the one of sessions_pool_server
+                for a local pool. One is created with `connection_settings` if None.
+        """
+        if recycle not in (RECYCLE_RESET, RECYCLE_DISCARD):
+            raise ValueError(f"recycle must be {RECYCLE_RESET!r} or {RECYCLE_DISCARD!r}, not {recycle!r}")
+        self.pool_management_endpoint = pool_management_endpoint.rstrip("/") + "/"
+        self.auth_callback = auth_callback
+        self.warm_sessions = warm_sessions
+        self.max_lease_wait_seconds = max_lease_wait_seconds
+        self.recycle = recycle
+        self.max_uses_per_session = max_uses_per_session
+        self.warmup_code = warmup_code
+        if http_client is None:
+            connection_settings = connection_settings or ConnectionSettings()
+            limits = httpx.Limits(
+                max_connections=connection_settings.max_connections,
+                max_keepalive_connections=connection_settings.max_keepalive_connections,
+                keepalive_expiry=connection_settings.keepalive_expiry_seconds,
+            )
+            http_client = httpx.AsyncClient(limits=limits, timeout=DEFAULT_HTTP_TIMEOUT_SECONDS)
+        self.http_client = http_client
+        self.leased = 0
+        self.warming = 0
+        self.resetting = 0
+        self.warm_leases = 0
+        self.cold_starts = 0
+        self.recycled = 0
+        self.discarded = 0
+        self.warmup_failures = 0
+        self.lease_wait = LatencyHistogram("sessions_pool_lease_wait_seconds", (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0))
+        self._uses: dict[str, int] = {}
+        self._ready: asyncio.Queue[str] | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    # region Helper Methods
+    async def _execute(self, session_id: str, code: str) -> None:
+        """Execute code in a session as SessionsPythonTool does, raising if the service fails."""
+        token = self.auth_callback()
+        if inspect.isawaitable(token):
+            token = await token
+        response = await self.http_client.post(
+            f"{self.pool_management_endpoint}code/execute",
+            params={"identifier": session_id, "api-version": SESSIONS_API_VERSION},
+            headers={"Authorization": f"Bearer {token}"},
+            json={"properties": {"codeInputType": "inline", "executionType": "synchronous", "code": code}},
+        )
+        response.raise_for_status()
+        properties = response.json()["properties"]
+        if properties.get("status") != "Success":
+            raise RuntimeError(f"{properties.get('result')} {properties.get('stderr')}".strip())
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _refill(self) -> None:
+        """Start warming sessions until `warm_sessions` are ready, being warmed or being reset."""
+        for _ in range(self.warm_sessions - self._ready.qsize() - self.warming - self.resetting):
+            self.warming += 1
+            self._spawn(self._warm())
+
+    async def _warm(self) -> None:
+        session_id = str(uuid.uuid4())
+        try:
+            await self._execute(session_id, self.warmup_code)
+        except Exception as e:
+            self.warmup_failures += 1
+            logger.warning(f"WarmSessionPool: Warming session {session_id} failed: {e}")
+            return
+        finally:
+            self.warming -= 1
+        self._uses[session_id] = 0
+        self._ready.put_nowait(session_id)
+
+    async def _recycle(self, session_id: str) -> None:
+        # The session stops counting as resetting before it is discarded or queued, so a refill sees it gone
+        try:
+            await self._execute(session_id, RESET_CODE)
+        except Exception as e:
+            self.resetting -= 1
+            logger.warning(f"WarmSessionPool: Resetting session {session_id} failed, discarding it: {e}")
+            self._discard(session_id)
+            return
+        except BaseException:
+            self.resetting -= 1
+            raise
+        self.resetting -= 1
+        self.recycled += 1
+        self._ready.put_nowait(session_id)
+
+    def _discard(self, session_id: str) -> None:
+        # The service deletes the session once it has been idle for the cooldown period of the pool
+        self._uses.pop(session_id, None)
+        self.discarded += 1
+        self._refill()
+
+    # endregion
+
+    def start(self) -> None:
+        """Start warming the sessions, e.g. when the application starts, before the first lease."""
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._refill()
+
+    async def lease(self) -> str:
+        """Return the identifier of a session for a conversation, warm if possible."""
+        self.start()
+        started = time.perf_counter()
+        session_id = None
+        if not self._ready.empty() or self.warming:
+            try:
+                session_id = await asyncio.wait_for(self._ready.get(), self.max_lease_wait_seconds)
+            except asyncio.TimeoutError:
+                pass
+        self.lease_wait.observe(time.perf_counter() - started)
+        if session_id is None:
+            session_id = str(uuid.uuid4())
+            self._uses[session_id] = 0
+            self.cold_starts += 1
+            logger.info(f"WarmSessionPool: No warm session ready, starting cold on session {session_id}")
+        else:
+            self.warm_leases += 1
+        self._uses[session_id] += 1
+        self.leased += 1
+        self._refill()
+        return session_id
+
+    def release(self, session_id: str) -> None:
+        """Give back a leased session; it is reset in the background, or discarded."""
+        if session_id not in self._uses:
+            return
+        self.leased -= 1
+        # Cold-started sessions would grow the pool past `warm_sessions`
+        surplus = self._ready.qsize() + self.warming + self.resetting >= self.warm_sessions
+        if self.recycle == RECYCLE_RESET and self._uses[session_id] < self.max_uses_per_session and not surplus:
+            self.resetting += 1
+            self._spawn(self._recycle(session_id))
+        else:
+            self._discard(session_id)
+
+    def metrics(self) -> dict[str, float]:
+        """Return the size of the pool, its lease wait time and its counts of warm and cold starts."""
+        return {
+            "ready": self._ready.qsize() if self._ready is not None else 0,
+            "warming": self.warming,
+            "leased": self.leased,
+            "warm_leases": self.warm_leases,
+            "cold_starts": self.cold_starts,
+            "recycled": self.recycled,
+            "discarded": self.discarded,
+            "warmup_failures": self.warmup_failures,
+            "mean_lease_wait_seconds": round(self.lease_wait.mean or 0.0, 3),
+        }
+
+    def render(self) -> list[str]:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in ("ready", "warming", "leased"):
+            lines += [f"# TYPE sessions_pool_{name} gauge", f"sessions_pool_{name} {self.metrics()[name]}"]
+        for name in ("warm_leases", "cold_starts", "recycled", "discarded", "warmup_failures"):
+            lines += [f"# TYPE sessions_pool_{name}_total counter", f"sessions_pool_{name}_total {getattr(self, name)}"]
+        return lines + self.lease_wait.render()
+
+    async def close(self) -> None:
+        """Stop the warm-ups and resets in progress, and close the connections."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.http_client.aclose()
+
+
+_pools: list[WarmSessionPool] = []
+_pools_lock = threading.Lock()
+
+
+def register_session_pool(pool: WarmSessionPool) -> WarmSessionPool:
+    """Track the pool, so its metrics are served and it is closed with the other shared resources."""
+    with _pools_lock:
+        _pools.append(pool)
+    return pool
+
+
+def render_session_pools() -> list[str]:
+    """Return the metrics of the registered pools in the Prometheus text exposition format."""
+    with _pools_lock:
+        pools = list(_pools)
+    return [line for pool in pools for line in pool.render()]
+
+
+async def close_session_pools() -> None:
+    """Close the registered pools, e.g. when the application shuts down."""
+    with _pools_lock:
+        pools = list(_pools)
+        _pools.clear()
+    for pool in pools:
+        logger.info(f"WarmSessionPool: {pool.metrics()}")
+        await pool.close()
+
+
+async def upload_file_to_session(
+    plugin: SessionsPythonTool,
+    local_file_path: str,
+    remote_file_path: str | None = None,
+    chunk_size: int = DEFAULT_UPLOAD_CHUNK_BYTES,
+) -> str:
+    """Upload a file to the current session of the plugin, streaming it from disk in chunks.
+
+    Unlike SessionsPythonTool.upload_file, the file is never held in memory, and the multipart body is sent
+    with its own boundary rather than the JSON content type the plugin leaves on its HTTP client.
+
+    Args:
+        plugin (SessionsPythonTool): The plugin whose session, HTTP client and credentials are used.
+        local_file_path (str): The path of the file on the local machine.
+        remote_file_path (str | None): The name of the file in /mnt/data; the name of the local file if None.
+        chunk_size (int): The number of bytes read from disk at a time.
+
+    Returns:
+        str: The path of the file in the session.
+
+    Raises:
+        FunctionExecutionException: If the service rejects the upload.
+    """
+    remote_file_path = plugin._construct_remote_file_path(remote_file_path or os.path.basename(local_file_path))
+    boundary = uuid.uuid4().hex
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{remote_file_path}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body():
+        yield head
+        with open(local_file_path, "rb") as file:
+            while chunk := await asyncio.to_thread(file.read, chunk_size):
+                yield chunk
+        yield tail
+
+    token = plugin.auth_callback()
+    if inspect.isawaitable(token):
+        token = await token
+    response = await plugin.http_client.post(
+        f"{str(plugin.pool_management_endpoint).rstrip('/')}/files/upload",
+        params={"identifier": plugin.settings.session_id, "api-version": SESSIONS_API_VERSION},
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + os.path.getsize(local_file_path) + len(tail)),
+        },
+        content=body(),
+    )
+    if response.is_error:
+        raise FunctionExecutionException(
+            f"Upload failed with status code {response.status_code} and error: {response.text or response.reason_phrase}"
+        )
+    return remote_file_path
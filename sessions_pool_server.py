@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from email.parser import BytesParser
+
+import httpx
+from aiohttp import web
+
+from execution_result import FAILURE_RESULT_PREFIX, ExecutionLimits
+from worker_pool import WorkerExecutionError, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8090
+# The endpoint to give SessionsPythonTool, which only accepts https URLs; see create_local_sessions_http_client
+DEFAULT_POOL_MANAGEMENT_ENDPOINT = f"https://{DEFAULT_HOST}:{DEFAULT_PORT}/"
+DEFAULT_WORKERS = 4
+# As the cooldown period of a dynamic sessions pool
+DEFAULT_SESSION_IDLE_TIMEOUT_SECONDS = 300.0
+DEFAULT_EXECUTION_LIMITS = ExecutionLimits(
+    wall_clock_seconds=100, cpu_seconds=100, memory_bytes=2 * 1024 * 1024 * 1024, max_output_chars=1_000_000
+)
+# The directory of the session's files in a dynamic session
+REMOTE_DATA_DIRECTORY = "/mnt/data"
+# A leading alphanumeric character keeps "." and ".." out, which would name the data directory or its parent
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+@dataclass
+class LocalSession:
+    """A session of the local pool: its files, and when it was last used.
+
+    The variables and imports of the session live in the namespace the WorkerPool keeps for its identifier.
+    """
+
+    identifier: str
+    directory: str
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+def _file_properties(path: str, filename: str) -> dict:
+    stat = os.stat(path)
+    return {
+        "properties": {
+            "filename": filename,
+            "size": stat.st_size,
+            "lastModifiedTime": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+        }
+    }
+
+
+def _parse_multipart_files(body: bytes) -> list[tuple[str, bytes]]:
+    """Return the name and content of the "file" parts of a multipart body, its boundary being its first line."""
+    boundary = body.split(b"\r\n", 1)[0][2:].decode("latin-1")
+    message = BytesParser().parsebytes(
+        f"Content-Type: multipart/form-data; boundary={boundary}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        return []
+    return [
+        (part.get_filename(), part.get_payload(decode=True))
+        for part in message.get_payload()
+        if part.get_param("name", header="content-disposition") == "file" and part.get_filename()
+    ]
+
+
+class LocalSessionsPool:
+    """Emulates the pool management API of an Azure Container Apps dynamic sessions pool on this machine.
+
+    Serves the endpoints SessionsPythonTool calls: code/execute, files/upload, files and files/content.
+    Code runs in the worker processes of a WorkerPool, under its resource limits. Each session identifier
+    keeps its variables and imports across executions, and its files in a directory of its own, which
+    stands in for /mnt/data: it is the working directory of the code, and /mnt/data in the code is
+    rewritten to it. Sessions idle for `session_idle_timeout_seconds` are dropped with their files.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        session_idle_timeout_seconds: float = DEFAULT_SESSION_IDLE_TIMEOUT_SECONDS,
+        execution_limits: ExecutionLimits = DEFAULT_EXECUTION_LIMITS,
+        data_directory: str | None = None,
+        preload_modules: tuple[str, ...] = ("math",),
+    ):
+        """Initializes the pool; the worker processes are started when the application starts.
+
+        Args:
+            workers (int): The number of worker processes, and so of executions run at once.
+            session_idle_timeout_seconds (float): How long an unused session is kept.
+            execution_limits (ExecutionLimits): The resource limits of each execution. The wall-clock limit is
+                lowered to the timeoutInSeconds of the request, if shorter.
+            data_directory (str | None): Where the files of the sessions are kept, a temporary directory if None.
+            preload_modules (tuple[str, ...]): The modules imported by the workers before any execution.
+        """
+        self.workers = workers
+        self.session_idle_timeout_seconds = session_idle_timeout_seconds
+        self.execution_limits = execution_limits
+        self.data_directory = data_directory
+        self.preload_modules = preload_modules
+        self.executions = 0
+        self.sessions_created = 0
+        self._sessions: dict[str, LocalSession] = {}
+        self._worker_pool: WorkerPool | None = None
+        self._owns_data_directory = data_directory is None
+        self._expiry_task: asyncio.Task | None = None
+
+    # region Helper Methods
+    async def _start(self, app: web.Application) -> None:
+        if self.data_directory is None:
+            self.data_directory = tempfile.mkdtemp(prefix="sessions_pool_")
+        self._worker_pool = WorkerPool(size=self.workers, preload_modules=self.preload_modules)
+        self._expiry_task = asyncio.create_task(self._expire_sessions())
+        logger.info(f"LocalSessionsPool: {self.workers} workers ready, session files in {self.data_directory}")
+
+    async def _stop(self, app: web.Application) -> None:
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+        if self._worker_pool is not None:
+            await asyncio.to_thread(self._worker_pool.shutdown)
+        if self._owns_data_directory and self.data_directory is not None:
+            shutil.rmtree(self.data_directory, ignore_errors=True)
+
+    async def _expire_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.session_idle_timeout_seconds, 60.0))
+            deadline = time.monotonic() - self.session_idle_timeout_seconds
+            for session in [s for s in self._sessions.values() if s.last_used < deadline and not s.lock.locked()]:
+                self._drop_session(session)
+
+    def _drop_session(self, session: LocalSession) -> None:
+        logger.info(f"LocalSessionsPool: Dropping idle session {session.identifier}")
+        del self._sessions[session.identifier]
+        self._worker_pool.reset_session(session.identifier)
+        if self._is_session_directory(session.directory):
+            shutil.rmtree(session.directory, ignore_errors=True)
+
+    def _is_session_directory(self, directory: str) -> bool:
+        """Return whether the directory is a direct child of the data directory, once links are resolved."""
+        parent = os.path.dirname(os.path.realpath(directory))
+        return parent == os.path.realpath(self.data_directory)
+
+    def _get_session(self, request: web.Request) -> LocalSession:
+        """Return the session of the request's identifier, allocating it on first use as the service does."""
+        identifier = request.query.get("identifier", "")
+        if not SESSION_ID_PATTERN.match(identifier):
+            raise web.HTTPBadRequest(text="The identifier query parameter is missing or invalid")
+        session = self._sessions.get(identifier)
+        if session is None:
+            directory = os.path.join(self.data_directory, identifier)
+            if not self._is_session_directory(directory):
+                raise web.HTTPBadRequest(text="The identifier query parameter is missing or invalid")
+            os.makedirs(directory, exist_ok=True)
+            session = self._sessions[identifier] = LocalSession(identifier, directory)
+            self.sessions_created += 1
+        session.last_used = time.monotonic()
+        return session
+
+    @staticmethod
+    def _session_path(session: LocalSession, filename: str) -> tuple[str, str]:
+        """Return the local path of a file of the session, and its name relative to /mnt/data."""
+        # aiohttp strips the leading slash of multipart filenames
+        filename = "/" + filename.lstrip("/")
+        if filename.startswith(REMOTE_DATA_DIRECTORY + "/"):
+            filename = filename[len(REMOTE_DATA_DIRECTORY) + 1 :]
+        filename = filename.lstrip("/")
+        path = os.path.realpath(os.path.join(session.directory, filename))
+        if not path.startswith(os.path.realpath(session.directory) + os.sep):
+            raise web.HTTPBadRequest(text=f"The file {filename} is outside of {REMOTE_DATA_DIRECTORY}")
+        return path, os.path.relpath(path, os.path.realpath(session.directory))
+
+    # endregion
+
+    async def handle_execute(self, request: web.Request) -> web.Response:
+        """POST /code/execute with {"properties": {"code": "...", "timeoutInSeconds": ...}}.
+
+        As in the service, the result is the value of the trailing expression of the code, and a failure
+        reports the error in the result and its traceback in stderr.
+        """
+        session = self._get_session(request)
+        try:
+            properties = (await request.json())["properties"]
+            code = properties["code"]
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({"error": 'Expected a JSON body with "properties" holding the "code"'}, status=400)
+        limits = self.execution_limits
+        timeout = properties.get("timeoutInSeconds")
+        if timeout and (limits.wall_clock_seconds is None or timeout < limits.wall_clock_seconds):
+            limits = replace(limits, wall_clock_seconds=timeout)
+        code = code.replace(REMOTE_DATA_DIRECTORY, session.directory)
+
+        # A session runs one execution at a time, as in the service
+        async with session.lock:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(
+                    self._worker_pool.run,
+                    code,
+                    session_id=session.identifier,
+                    execution_limits=limits,
+                    working_directory=session.directory,
+                    # The service reports the value of the trailing expression, as a REPL displays it
+                    evaluate_trailing_expression=True,
+                )
+            except WorkerExecutionError as e:
+                return web.json_response({"error": str(e)}, status=500)
+            elapsed_ms = round((time.perf_counter() - started) * 1000)
+            session.last_used = time.monotonic()
+        self.executions += 1
+        # The service reports the error itself, with its traceback in stderr
+        result_text = result.result if result.succeeded else result.result.removeprefix(FAILURE_RESULT_PREFIX)
+        return web.json_response(
+            {
+                "properties": {
+                    "status": result.status,
+                    "result": result_text,
+                    "stdout": result.stdout,
+                    "stderr": result.stderr,
+                    "executionTimeInMilliseconds": elapsed_ms,
+                }
+            }
+        )
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        """POST /files/upload with a multipart "file" named after its path under /mnt/data."""
+        session = self._get_session(request)
+        uploaded = []
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                if part.name != "file" or not part.filename:
+                    continue
+                path, filename = self._session_path(session, part.filename)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as file:
+                    while chunk := await part.read_chunk():
+                        file.write(chunk)
+                uploaded.append(_file_properties(path, filename))
+        else:
+            # SessionsPythonTool leaves the JSON Content-Type of execute_code on its client, so its uploads
+            # arrive without the multipart boundary, which is found at the start of the body instead
+            for filename, content in _parse_multipart_files(await request.read()):
+                path, filename = self._session_path(session, filename)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as file:
+                    file.write(content)
+                uploaded.append(_file_properties(path, filename))
+        if not uploaded:
+            return web.json_response({"error": 'Expected a multipart "file"'}, status=400)
+        return web.json_response({"value": uploaded})
+
+    async def handle_list_files(self, request: web.Request) -> web.Response:
+        """GET /files: the files of the session."""
+        session = self._get_session(request)
+        files = []
+        for root, _, names in os.walk(session.directory):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                files.append(_file_properties(path, os.path.relpath(path, session.directory)))
+        return web.json_response({"value": files})
+
+    async def handle_download(self, request: web.Request) -> web.StreamResponse:
+        """GET /files/content/{filename}: the content of a file of the session."""
+        session = self._get_session(request)
+        path, _ = self._session_path(session, request.match_info["filename"])
+        if not os.path.isfile(path):
+            return web.json_response({"error": f"The file {request.match_info['filename']} does not exist"}, status=404)
+        return web.FileResponse(path, headers={"Content-Type": "application/octet-stream"})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """GET /healthz: the sessions held and the executions run."""
+        return web.json_response(
+            {
+                "status": "ok" if self._worker_pool is not None else "starting",
+                "sessions": len(self._sessions),
+                "sessions_created": self.sessions_created,
+                "executions": self.executions,
+            }
+        )
+
+    def create_app(self) -> web.Application:
+        """Create the aiohttp application serving the endpoints."""
+        # Uploads are bounded by the disk, not by the default request size limit of 1 MiB
+        app = web.Application(client_max_size=0)
+        app.router.add_post("/code/execute", self.handle_execute)
+        app.router.add_post("/files/upload", self.handle_upload)
+        app.router.add_get("/files", self.handle_list_files)
+        app.router.add_get("/files/content/{filename:.+}", self.handle_download)
+        app.router.add_get("/healthz", self.handle_health)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+
+class _PlainHttpTransport(httpx.AsyncBaseTransport):
+    """Sends https requests as plain http, for a local pool served without TLS."""
+
+    def __init__(self, limits: httpx.Limits | None = None):
+        self.transport = httpx.AsyncHTTPTransport(limits=limits) if limits else httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme="http")
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def create_local_sessions_http_client(
+    timeout_seconds: float = 120.0, limits: httpx.Limits | None = None
+) -> httpx.AsyncClient:
+    """Return the http_client of a SessionsPythonTool whose pool_management_endpoint is a local pool.
+
+    SessionsPythonTool only accepts https endpoints, so the tool is given DEFAULT_POOL_MANAGEMENT_ENDPOINT,
+    and this client sends its requests to the local pool over plain http.
+    """
+    return httpx.AsyncClient(transport=_PlainHttpTransport(limits), timeout=timeout_seconds)
+
+
+def local_sessions_auth_callback() -> str:
+    """The auth_callback of a SessionsPythonTool using a local pool, which does not check tokens."""
+    return "local"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Emulate a dynamic sessions pool management endpoint locally.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="The executions run at once")
+    parser.add_argument(
+        "--idle-timeout", type=float, default=DEFAULT_SESSION_IDLE_TIMEOUT_SECONDS, help="The seconds an unused session is kept"
+    )
+    parser.add_argument("--data-directory", default=None, help="Where the files of the sessions are kept")
+    args = parser.parse_args()
+
+    pool = LocalSessionsPool(args.workers, args.idle_timeout, data_directory=args.data_directory)
+    web.run_app(pool.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import logging
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TextIO
+
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+
+logger = logging.getLogger(__name__)
+
+REPLY_COLOR = "\033[94m"  # Blue
+END_COLOR = "\033[0m"
+
+
+@dataclass
+class StreamStats:
+    """The timings of a streamed reply.
+
+    Attributes:
+        name (str | None): The agent that wrote the reply.
+        time_to_first_token (float | None): Seconds from the start of the turn to the first token. In a group
+            chat, a turn starts when the previous reply ends.
+        duration (float): Seconds from the start of the turn to the last token.
+        tokens (int): The completion tokens reported by the service, or else the number of chunks received.
+    """
+
+    name: str | None = None
+    time_to_first_token: float | None = None
+    duration: float = 0.0
+    tokens: int = 0
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        """The generation rate, from the first token to the last one."""
+        if self.time_to_first_token is None:
+            return None
+        generation_time = self.duration - self.time_to_first_token
+        return self.tokens / generation_time if generation_time > 0 else None
+
+    def __str__(self) -> str:
+        if self.time_to_first_token is None:
+            return f"{self.name}: no tokens after {self.duration:.2f}s"
+        rate = f"{self.tokens_per_second:.1f} tokens/s" if self.tokens_per_second is not None else "n/a tokens/s"
+        return (
+            f"{self.name}: first token after {self.time_to_first_token:.2f}s, "
+            f"{self.tokens} tokens in {self.duration:.2f}s ({rate})"
+        )
+
+
+class StreamRenderer:
+    """Writes streamed reply chunks to the terminal as they arrive, and records the timing of each reply.
+
+    A reply ends when a chunk from another agent arrives or the renderer is closed. The text of each reply
+    is accumulated in a list and joined once, so accumulating it costs linear time in its length.
+    """
+
+    def __init__(
+        self,
+        on_reply_start: Callable[[str | None], None] | None = None,
+        output: TextIO | None = None,
+    ):
+        """Initializes the renderer and starts timing the first reply.
+
+        Args:
+            on_reply_start (Callable[[str | None], None] | None): Called with the agent name before the first
+                chunk of each reply is written, e.g. to print a header.
+            output (TextIO | None): Where to write the chunks, sys.stdout by default.
+        """
+        self.on_reply_start = on_reply_start
+        self.output = output or sys.stdout
+        self.stats: list[StreamStats] = []
+        self._chunks: list[str] = []
+        self._current: StreamStats | None = None
+        self._started_at = time.perf_counter()
+        self._usage_tokens: int | None = None
+        self._last_chunk_at: float | None = None
+
+    # region Helper Methods
+    def _start_reply(self, name: str | None) -> None:
+        self._current = StreamStats(name=name)
+        self._chunks = []
+        self._usage_tokens = None
+        if self.on_reply_start is not None:
+            self.on_reply_start(name)
+        self.output.write(REPLY_COLOR)
+
+    def _end_reply(self) -> str:
+        """Finish the current reply, log its timings and return its text."""
+        stats, self._current = self._current, None
+        text = "".join(self._chunks)
+        # A reply of a group chat only ends when the next one starts, so it is timed up to its last chunk
+        ended_at = self._last_chunk_at or time.perf_counter()
+        if stats is not None:
+            stats.duration = ended_at - self._started_at
+            if self._usage_tokens is not None:
+                stats.tokens = self._usage_tokens
+            self.stats.append(stats)
+            self.output.write(f"{END_COLOR}\n\n")
+            self.output.flush()
+            logger.info(f"StreamRenderer: {stats}")
+        # The next reply, e.g. of the next agent of a group chat, is timed from here
+        self._started_at = ended_at
+        self._last_chunk_at = None
+        return text
+
+    # endregion
+
+    def write(self, chunk: ChatMessageContent) -> None:
+        """Render a streamed chunk."""
+        if self._current is None or chunk.name != self._current.name:
+            if self._current is not None:
+                self._end_reply()
+            self._start_reply(chunk.name)
+
+        usage = chunk.metadata.get("usage")
+        if usage is not None and usage.completion_tokens is not None:
+            self._usage_tokens = usage.completion_tokens
+        text = chunk.content
+        if not text:
+            return
+        self._last_chunk_at = time.perf_counter()
+        if self._current.time_to_first_token is None:
+            self._current.time_to_first_token = self._last_chunk_at - self._started_at
+        self._current.tokens += 1
+        self._chunks.append(text)
+        self.output.write(text)
+        self.output.flush()
+
+    def close(self) -> str:
+        """Finish the current reply.
+
+        Returns:
+            str: The text of the last reply.
+        """
+        return self._end_reply()
@@ -0,0 +1,50 @@
+import copy
+import logging
+from collections.abc import AsyncIterable
+
+from semantic_kernel.agents.chat_completion.chat_completion_agent import ChatCompletionAgent
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.contents.chat_history import ChatHistory
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.streaming_chat_message_content import StreamingChatMessageContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+
+logger = logging.getLogger(__name__)
+
+
+class ToolReplyChatCompletionAgent(ChatCompletionAgent):
+    """A ChatCompletionAgent whose streamed turns end with a reply, even when they end with a tool call.
+
+    With FunctionChoiceBehavior.Required, a non-streaming invocation makes a final model call without tools
+    once the tool was called, but the streaming one stops at the tool result: the turn has no reply, and in a
+    group chat nothing is rendered or added to the history. This agent makes that final call itself.
+    """
+
+    async def invoke_stream(self, history: ChatHistory) -> AsyncIterable[StreamingChatMessageContent]:
+        """Invoke the agent in streaming mode, then stream a reply to the tool results the turn ended with."""
+        async for message in super().invoke_stream(history):
+            yield message
+
+        if not history.messages or history.messages[-1].role != AuthorRole.TOOL:
+            return
+
+        chat_completion_service = self.kernel.get_service(service_id=self.service_id, type=ChatCompletionClientBase)
+        settings = copy.deepcopy(
+            self.execution_settings or self.kernel.get_prompt_execution_settings_from_service_id(self.service_id)
+        )
+        # No tools, as in the final call of a non-streaming invocation
+        settings.function_choice_behavior = None
+        logger.debug(f"[{type(self).__name__}] Streaming the reply to the tool results of {self.name}.")
+
+        message_builder: list[str] = []
+        async for message_list in chat_completion_service.get_streaming_chat_message_contents(
+            chat_history=self._setup_agent_chat_history(history), settings=settings, kernel=self.kernel
+        ):
+            for message in message_list:
+                message.name = self.name
+                message_builder.append(message.content or "")
+                yield message
+
+        history.add_message(
+            ChatMessageContent(role=AuthorRole.ASSISTANT, content="".join(message_builder), name=self.name)
+        )
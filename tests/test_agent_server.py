@@ -0,0 +1,34 @@
+import asyncio
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import code_execution_example
+from agent_server import AgentService
+from fake_chat_completion import create_fake_chat_completion_factory, load_script
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_chat_script.json")
+
+
+def _parse_events(body: str) -> list[str]:
+    return [line.removeprefix("event: ") for line in body.splitlines() if line.startswith("event: ")]
+
+
+def test_streamed_request_yields_token_events(monkeypatch):
+    # The coder agent calls the code execution tool, then replies to its result
+    monkeypatch.setattr(
+        code_execution_example.kernel_factory,
+        "chat_completion_factory",
+        create_fake_chat_completion_factory(load_script(SCRIPT_PATH), latency_seconds=0.0, tokens_per_second=10000.0),
+    )
+
+    async def stream() -> list[str]:
+        service = AgentService(mode="agent", concurrency=1)
+        async with TestClient(TestServer(service.create_app())) as client:
+            response = await client.post("/v1/execute", json={"prompt": "Sum the square roots", "stream": True})
+            assert response.status == 200
+            return _parse_events(await response.text())
+
+    events = asyncio.run(stream())
+    assert "token" in events
+    assert events[-1] == "done"
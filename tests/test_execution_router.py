@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from execution_router import CIRCUIT_CLOSED, CIRCUIT_OPEN, CircuitBreaker, ExecutionBackend, ExecutionRouterPlugin, Isolation
+
+RECOVERY_SECONDS = 0.05
+
+
+class _ScriptedBackend(ExecutionBackend):
+    """A backend that fails while `failing` is set, and otherwise returns its name."""
+
+    def __init__(self, name: str):
+        super().__init__(name, Isolation.HOST, capacity=1, circuit_breaker=CircuitBreaker(2, RECOVERY_SECONDS))
+        self.failing = False
+
+    async def _execute(self, code: str) -> str:
+        if self.failing:
+            raise RuntimeError(f"{self.name} is down")
+        return self.name
+
+    async def reset_session(self) -> None:
+        pass
+
+    async def upload_file(self, local_file_path: str, remote_file_path: str | None = None) -> str:
+        return remote_file_path or local_file_path
+
+
+def test_recovered_backend_is_routed_to_again():
+    primary, fallback = _ScriptedBackend("primary"), _ScriptedBackend("fallback")
+    router = ExecutionRouterPlugin(backends=[primary, fallback])
+
+    async def route(code: str = "x = 1") -> str:
+        return await router.execute_code(code)
+
+    async def scenario() -> None:
+        # Trip: each failure fails over to the fallback, which the conversation then sticks to
+        primary.failing = True
+        assert await route() == "fallback"
+        await router.reset_session()
+        assert await route() == "fallback"
+        assert primary.circuit_breaker.state == CIRCUIT_OPEN
+
+        # Recover: the call routed while the primary may be probed is still served by the pinned fallback
+        primary.failing = False
+        time.sleep(RECOVERY_SECONDS)
+        assert await route() == "fallback"
+
+        # Route again: a new conversation probes the primary, which closes its circuit
+        await router.reset_session()
+        assert await route() == "primary"
+        assert primary.circuit_breaker.state == CIRCUIT_CLOSED
+
+    asyncio.run(scenario())
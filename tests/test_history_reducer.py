@@ -0,0 +1,94 @@
+import asyncio
+
+from semantic_kernel.contents.chat_message_content import ChatMessageContent
+from semantic_kernel.contents.function_call_content import FunctionCallContent
+from semantic_kernel.contents.function_result_content import FunctionResultContent
+from semantic_kernel.contents.utils.author_role import AuthorRole
+
+from history_reducer import SUMMARY_PREFIX, HistoryReducer
+
+LONG_RESULT = "x" * 5000
+
+
+def _tool_turn(prompt: str, call_id: str, result: str, reply: str) -> list[ChatMessageContent]:
+    """A user prompt, the tool call it led to, the tool result and the reply to it."""
+    return [
+        ChatMessageContent(role=AuthorRole.USER, content=prompt),
+        ChatMessageContent(
+            role=AuthorRole.ASSISTANT,
+            items=[FunctionCallContent(id=call_id, name="Tool-execute_code", arguments='{"code": "x = 1"}')],
+        ),
+        ChatMessageContent(
+            role=AuthorRole.TOOL,
+            items=[FunctionResultContent(id=call_id, name="Tool-execute_code", result=result)],
+        ),
+        ChatMessageContent(role=AuthorRole.ASSISTANT, content=reply),
+    ]
+
+
+def _history() -> list[ChatMessageContent]:
+    return _tool_turn("first", "call_1", LONG_RESULT, "done") + _tool_turn("second", "call_2", LONG_RESULT, "done")
+
+
+def _results(messages: list[ChatMessageContent]) -> list[str]:
+    return [
+        str(item.result) for message in messages for item in message.items if isinstance(item, FunctionResultContent)
+    ]
+
+
+def test_keep_leaves_tool_results_alone():
+    history = _history()
+    reduced = asyncio.run(HistoryReducer(tool_results="keep").reduce(history))
+
+    assert _results(reduced) == [LONG_RESULT, LONG_RESULT]
+
+
+def test_truncate_shortens_earlier_tool_results_only():
+    history = _history()
+    reduced = asyncio.run(HistoryReducer(tool_results="truncate", max_tool_result_chars=100).reduce(history))
+
+    earlier, latest = _results(reduced)
+    assert len(reduced) == len(history)
+    assert len(earlier) < 200 and "truncated" in earlier
+    assert latest == LONG_RESULT
+    # The original history is not modified
+    assert _results(history) == [LONG_RESULT, LONG_RESULT]
+
+
+def test_drop_removes_earlier_tool_calls_and_results():
+    history = _history()
+    reduced = asyncio.run(HistoryReducer(tool_results="drop").reduce(history))
+
+    assert [message.content for message in reduced[:2]] == ["first", "done"]
+    assert _results(reduced) == [LONG_RESULT]
+    assert not any(isinstance(item, FunctionCallContent) for item in reduced[0].items + reduced[1].items)
+
+
+def test_cut_never_starts_with_a_tool_result():
+    history = _history()
+    reduced = asyncio.run(HistoryReducer(tool_results="keep", max_messages=2).reduce(history))
+
+    assert [message.role for message in reduced] == [AuthorRole.ASSISTANT]
+    assert reduced[0].content == "done"
+
+
+def test_summary_folds_in_only_the_messages_newly_left_out():
+    folded: list[int] = []
+
+    async def summarizer(summary, messages):
+        folded.append(len(messages))
+        return f"{summary or ''}+{len(messages)}"
+
+    reducer = HistoryReducer(tool_results="keep", max_messages=4, summarizer=summarizer)
+    history = _history()
+
+    async def reduce_twice() -> list[ChatMessageContent]:
+        await reducer.reduce(history[:6])
+        return await reducer.reduce(history)
+
+    reduced = asyncio.run(reduce_twice())
+
+    # The first cut moves past the tool result whose call it left out
+    assert folded == [3, 1]
+    assert reduced[0].role == AuthorRole.SYSTEM
+    assert reduced[0].content == f"{SUMMARY_PREFIX}+3+1"
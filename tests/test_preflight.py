@@ -0,0 +1,69 @@
+import pytest
+
+from preflight import check_code
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "while True:\n    x = 1",
+        "import itertools\nfor i in itertools.count():\n    x = i",
+        "from itertools import cycle\nfor c in cycle('ab'):\n    x = c",
+        "while 1:\n    for i in range(3):\n        break",
+    ],
+)
+def test_module_level_infinite_loop_is_rejected(code):
+    result = check_code(code)
+
+    assert not result.passed
+    assert "never terminates" in str(result) or "infinite iterator" in str(result)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "while True:\n    if input():\n        break",
+        "while True:\n    raise SystemExit",
+        "import sys\nwhile True:\n    sys.exit()",
+        "while True:\n    for i in range(3):\n        raise StopIteration",
+        "def serve():\n    while True:\n        pass",
+        "import threading\nthreading.Thread(target=lambda: [None for _ in iter(int, 1)], daemon=True)",
+        "from itertools import repeat\nfor x in repeat(1, 3):\n    y = x",
+    ],
+)
+def test_terminating_or_nested_loop_is_accepted(code):
+    assert check_code(code).passed
+
+
+def test_missing_module_is_reported_at_module_level():
+    result = check_code("import surely_not_installed_module")
+
+    assert str(result) == "Line 1: ModuleNotFoundError: No module named 'surely_not_installed_module'"
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "def load():\n    import surely_not_installed_module",
+        "async def load():\n    from surely_not_installed_module import thing",
+        "try:\n    import surely_not_installed_module\nexcept ImportError:\n    pass",
+        "import subprocess\nsubprocess.run(['pip', 'install', 'surely_not_installed_module'])\n"
+        "import surely_not_installed_module",
+        "from . import sibling",
+    ],
+)
+def test_import_that_may_not_run_is_not_reported(code):
+    assert check_code(code).passed
+
+
+def test_forbidden_module_is_rejected_wherever_it_is_imported():
+    result = check_code("def run():\n    import subprocess", forbidden_modules=["subprocess"])
+
+    assert str(result) == "Line 2: importing subprocess is not allowed"
+
+
+def test_syntax_error_is_reported_without_a_tree():
+    result = check_code("x = (1,")
+
+    assert result.tree is None
+    assert str(result).startswith("SyntaxError")
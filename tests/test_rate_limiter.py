@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from rate_limiter import RateLimitedTransport, RateLimitScheduler, TokenBucket, estimate_request_tokens
+
+
+def _scripted_transport(responses: list[httpx.Response]) -> httpx.MockTransport:
+    """A transport answering each request with the next response, and the last one once they run out."""
+    pending = list(responses)
+    return httpx.MockTransport(lambda request: pending.pop(0) if len(pending) > 1 else pending[0])
+
+
+def _send(transport: RateLimitedTransport) -> httpx.Response:
+    async def send() -> httpx.Response:
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post("https://example.test/chat/completions", json={"messages": [], "max_tokens": 10})
+
+    return asyncio.run(send())
+
+
+def test_bucket_delays_until_refilled():
+    bucket = TokenBucket(capacity=60)
+    bucket.consume(60)
+
+    # 60 per minute refills one unit a second
+    assert bucket.delay(1) == pytest.approx(1.0, abs=0.05)
+    assert bucket.delay(30) == pytest.approx(30.0, abs=0.05)
+
+
+def test_oversized_request_waits_for_a_full_bucket_only():
+    bucket = TokenBucket(capacity=60)
+
+    assert bucket.delay(1000) == 0.0
+    bucket.consume(1000)
+    assert bucket.level == pytest.approx(0.0, abs=0.01)
+
+
+def test_bucket_is_clamped_to_the_remaining_quota():
+    bucket = TokenBucket(capacity=1000)
+    bucket.clamp(100)
+
+    assert bucket.level == pytest.approx(100, abs=1)
+    assert bucket.delay(200) > 0
+
+
+def test_backoff_follows_retry_after_with_jitter():
+    scheduler = RateLimitScheduler(base_backoff_seconds=1.0, max_backoff_seconds=10.0)
+
+    for _ in range(20):
+        assert 2.0 <= scheduler.backoff_seconds(attempt=3, retry_after=2.0) <= 3.0
+        assert 8.0 <= scheduler.backoff_seconds(attempt=3, retry_after=None) <= 12.0
+        assert 10.0 <= scheduler.backoff_seconds(attempt=0, retry_after=30.0) <= 15.0
+
+
+def test_throttled_request_is_retried_after_retry_after():
+    scheduler = RateLimitScheduler()
+    throttled = httpx.Response(429, headers={"retry-after-ms": "100"})
+    transport = RateLimitedTransport(scheduler, _scripted_transport([throttled, httpx.Response(200, json={})]))
+
+    started = time.monotonic()
+    response = _send(transport)
+
+    assert response.status_code == 200
+    assert scheduler.throttled_count == 1
+    assert time.monotonic() - started >= 0.1
+    # Every request is held back for the Retry-After, since the quota is shared
+    assert scheduler._paused_until >= started + 0.1
+
+
+def test_throttled_request_is_returned_once_retries_are_exhausted():
+    scheduler = RateLimitScheduler(max_retries=2, base_backoff_seconds=0.01)
+    transport = RateLimitedTransport(scheduler, _scripted_transport([httpx.Response(503)]))
+
+    response = _send(transport)
+
+    assert response.status_code == 503
+    assert scheduler.throttled_count == 2
+
+
+def test_remaining_tokens_header_clamps_the_token_bucket():
+    scheduler = RateLimitScheduler(tokens_per_minute=100_000)
+    remaining = httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "500"}, json={})
+    transport = RateLimitedTransport(scheduler, _scripted_transport([remaining]))
+
+    _send(transport)
+
+    assert scheduler.tokens.level <= 500
+
+
+def test_request_tokens_count_the_prompt_and_max_tokens():
+    body = {"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 50}
+    request = httpx.Request("POST", "https://example.test", content=json.dumps(body))
+
+    assert estimate_request_tokens(request) == len(json.dumps(body["messages"])) // 4 + 50
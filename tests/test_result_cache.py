@@ -0,0 +1,80 @@
+import ast
+import time
+
+import pytest
+
+from execution_result import ExecutionResult
+from result_cache import ExecutionResultCache, is_deterministic
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "from numpy.random import rand\nx = rand(3)",
+        "import numpy.random as npr\nx = npr.rand()",
+        "import numpy as np\nx = np.random.rand()",
+        "from numpy import random as r\nx = r.rand()",
+        "import random\nx = random.random()",
+        "import secrets as s\nx = s.token_hex()",
+        "from datetime import datetime\nx = datetime.now()",
+        "from uuid import uuid4\nx = uuid4()",
+        "import pandas as pd\ndf = pd.read_csv('data.csv')",
+        "x = open('notes.txt').read()",
+    ],
+)
+def test_nondeterministic_code_is_not_cached(code):
+    assert not is_deterministic(ast.parse(code))
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "x = sum(range(10))",
+        "import math\nx = math.sqrt(2)",
+        "import numpy as np\nx = np.linalg.inv(np.eye(2))",
+        "from numpy import linalg\nx = linalg.norm([3, 4])",
+    ],
+)
+def test_deterministic_code_is_cached(code):
+    assert is_deterministic(ast.parse(code))
+
+
+def test_expired_results_are_dropped_from_disk(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = ExecutionResultCache(ttl_seconds=0.01, path=path)
+    cache.set("key", ExecutionResult(result="x = 1"))
+    time.sleep(0.02)
+
+    assert cache.get("key") is None
+    assert ExecutionResultCache(ttl_seconds=None, path=path).get("key") is None
+
+
+def test_disk_hits_are_kept_within_maxsize(tmp_path):
+    path = str(tmp_path / "results.db")
+    writer = ExecutionResultCache(maxsize=10, path=path)
+    for index in range(3):
+        writer.set(f"key{index}", ExecutionResult(result=f"x = {index}"))
+
+    reader = ExecutionResultCache(maxsize=2, path=path)
+    for index in range(3):
+        assert reader.get(f"key{index}").result == f"x = {index}"
+    assert list(reader._entries) == ["key1", "key2"]
+
+
+def test_least_recently_used_result_is_evicted():
+    cache = ExecutionResultCache(maxsize=2)
+    cache.set("a", ExecutionResult(result="a"))
+    cache.set("b", ExecutionResult(result="b"))
+    cache.get("a")
+    cache.set("c", ExecutionResult(result="c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a").result == "a"
+
+
+def test_returned_results_are_copies():
+    cache = ExecutionResultCache()
+    cache.set("key", ExecutionResult(result="x = 1", metadata={"timings": {"run": 0.1}}))
+    cache.get("key").metadata["timings"]["run"] = 9.9
+
+    assert cache.get("key").metadata == {"timings": {"run": 0.1}}
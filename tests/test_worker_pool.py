@@ -0,0 +1,49 @@
+import pytest
+
+from execution_result import ExecutionLimits
+from worker_pool import WorkerPool
+
+
+@pytest.fixture(scope="module")
+def worker_pool():
+    pool = WorkerPool(size=1)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize(
+    "code, execution_limits, limit_exceeded",
+    [
+        ("while True:\n    pass", ExecutionLimits(wall_clock_seconds=0.3), "wall_clock_seconds"),
+        ("import time\ntime.sleep(5)", ExecutionLimits(wall_clock_seconds=0.3), "wall_clock_seconds"),
+        ("while True:\n    pass", ExecutionLimits(cpu_seconds=0.3), "cpu_seconds"),
+        ("data = bytearray(512 * 1024 * 1024)", ExecutionLimits(memory_bytes=64 * 1024 * 1024), "memory_bytes"),
+        ("print('a' * 10_000)", ExecutionLimits(max_output_chars=100), "max_output_chars"),
+    ],
+)
+def test_run_is_stopped_at_its_limit(worker_pool, code, execution_limits, limit_exceeded):
+    result = worker_pool.run(code, execution_limits=execution_limits)
+
+    assert not result.succeeded
+    assert result.limit_exceeded == limit_exceeded
+    # The pool keeps serving runs afterwards
+    assert worker_pool.run("x = 1").result == "x = 1"
+
+
+def test_session_outlives_a_run_stopped_at_its_limit(worker_pool):
+    worker_pool.run("total = 42", session_id="limits")
+    worker_pool.run("while True:\n    pass", session_id="limits", execution_limits=ExecutionLimits(cpu_seconds=0.3))
+
+    assert worker_pool.run("total += 1", session_id="limits").result == "total = 43"
+
+
+def test_preload_time_is_not_counted_against_the_run(tmp_path, monkeypatch):
+    (tmp_path / "slow_preload.py").write_text("import time\ntime.sleep(1)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    pool = WorkerPool(size=1, preload_modules=("slow_preload",))
+    try:
+        result = pool.run("x = 1", execution_limits=ExecutionLimits(wall_clock_seconds=0.5))
+    finally:
+        pool.shutdown()
+
+    assert result.succeeded
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import ClientAuthenticationError
+from azure.identity.aio import DefaultAzureCredential
+
+from semantic_kernel.exceptions.function_exceptions import FunctionExecutionException
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_SCOPE = "https://dynamicsessions.io/.default"
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+DEFAULT_REFRESH_MARGIN_SECONDS = 300.0
+DEFAULT_REFRESH_JITTER_SECONDS = 60.0
+
+
+class AsyncTokenProvider:
+    """Provides Azure AD access tokens of a scope, refreshing them in the background ahead of expiry.
+
+    A refresh is scheduled `refresh_margin_seconds` before the token expires, minus a random jitter of up
+    to `refresh_jitter_seconds` so that processes started together do not refresh together. Until then,
+    callers get the cached token without awaiting anything. Callers arriving while a refresh is in flight
+    share it; only a caller without a valid token waits for it.
+
+    The instance is an async callable returning the token, so it can be used as the `auth_callback` of the
+    SessionsPythonTool and as the `ad_token_provider` of the AzureChatCompletion.
+    """
+
+    def __init__(
+        self,
+        credential: DefaultAzureCredential,
+        scope: str,
+        refresh_margin_seconds: float = DEFAULT_REFRESH_MARGIN_SECONDS,
+        refresh_jitter_seconds: float = DEFAULT_REFRESH_JITTER_SECONDS,
+    ):
+        """Initializes the token provider.
+
+        Args:
+            credential (DefaultAzureCredential): The async credential to get the tokens from.
+            scope (str): The scope of the tokens.
+            refresh_margin_seconds (float): How long before its expiry a token is refreshed.
+            refresh_jitter_seconds (float): The maximum random delay added to the margin.
+        """
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.refresh_jitter_seconds = refresh_jitter_seconds
+        self._token: AccessToken | None = None
+        self._refresh_at = 0.0
+        self._refresh_task: asyncio.Task | None = None
+        self._refresh_timer: asyncio.TimerHandle | None = None
+
+    # region Helper Methods
+    def _refresh_delay(self, token: AccessToken) -> float:
+        """Return the number of seconds until the token should be refreshed."""
+        lifetime = token.expires_on - time.time()
+        # Short-lived tokens are refreshed after half their lifetime at the latest
+        margin = min(self.refresh_margin_seconds, lifetime / 2)
+        jitter = random.uniform(0, min(self.refresh_jitter_seconds, margin / 2))
+        return max(lifetime - margin - jitter, 0.0)
+
+    async def _refresh(self) -> AccessToken:
+        try:
+            token = await self.credential.get_token(self.scope)
+        except ClientAuthenticationError as cae:
+            err_messages = getattr(cae, "messages", [])
+            raise FunctionExecutionException(
+                f"Failed to retrieve the client auth token with messages: {' '.join(err_messages)}"
+            ) from cae
+
+        delay = self._refresh_delay(token)
+        self._token = token
+        self._refresh_at = time.time() + delay
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        self._refresh_timer = asyncio.get_running_loop().call_later(delay, self._start_refresh)
+        logger.info(f"AsyncTokenProvider: Refreshed the token of {self.scope}, next refresh in {delay:.0f}s")
+        return token
+
+    def _start_refresh(self) -> asyncio.Task:
+        """Start a refresh, or return the one in flight so concurrent callers share it."""
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refresh_task = asyncio.ensure_future(self._refresh())
+            task.add_done_callback(self._on_refresh_done)
+        return task
+
+    def _on_refresh_done(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._token is not None and self._token.expires_on > time.time():
+            # The current token is still valid; the next call retries the refresh
+            logger.warning(f"AsyncTokenProvider: Failed to refresh the token of {self.scope}: {task.exception()}")
+            self._refresh_at = time.time()
+
+    # endregion
+
+    async def get_token(self) -> str:
+        """Return a valid access token, waiting for a refresh only if there is none.
+
+        Raises:
+            FunctionExecutionException: If the token could not be retrieved.
+        """
+        token = self._token
+        now = time.time()
+        if token is None or token.expires_on <= now:
+            # shield() lets one caller give up without cancelling the refresh the others are waiting for
+            token = await asyncio.shield(self._start_refresh())
+        elif now >= self._refresh_at:
+            self._start_refresh()
+        return token.token
+
+    async def __call__(self) -> str:
+        return await self.get_token()
+
+    def close(self) -> None:
+        """Stop the background refreshes."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+
+_credential: DefaultAzureCredential | None = None
+_providers: dict[str, AsyncTokenProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(scope: str) -> AsyncTokenProvider:
+    """Return the token provider of the scope, shared by the whole process.
+
+    Every provider uses the same DefaultAzureCredential, so its credential chain is resolved once.
+    """
+    global _credential
+    with _providers_lock:
+        provider = _providers.get(scope)
+        if provider is None:
+            if _credential is None:
+                _credential = DefaultAzureCredential()
+            provider = _providers[scope] = AsyncTokenProvider(_credential, scope)
+        return provider
+
+
+async def close_token_providers() -> None:
+    """Stop the background refreshes and close the shared credential, e.g. when the application shuts down."""
+    global _credential
+    with _providers_lock:
+        providers = list(_providers.values())
+        _providers.clear()
+        credential, _credential = _credential, None
+    for provider in providers:
+        provider.close()
+    if credential is not None:
+        await credential.close()
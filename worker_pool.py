@@ -0,0 +1,597 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections.abc import Callable, Iterable
+
+from code_runner import run_code
+from execution_result import ArtifactLimits, ExecutionLimitExceeded, ExecutionLimits, ExecutionResult, OutputLimits
+from session_store import DEFAULT_MAX_SESSIONS, DEFAULT_MEMORY_BUDGET_BYTES, SessionNamespaceStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRELOAD_MODULES = ("math",)
+CANCEL_POLL_INTERVAL_SECONDS = 0.05
+# How long past a limit the parent waits for the worker to stop the code itself before killing it
+LIMIT_KILL_GRACE_SECONDS = 1.0
+
+
+class WorkerExecutionError(Exception):
+    """Raised when a worker process fails to execute a code snippet."""
+
+
+def _current_rss_bytes() -> int:
+    """Return the resident set size of the current process in bytes, or 0 if unknown."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss is the peak RSS, in bytes on macOS and in kilobytes elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _process_rss_bytes(pid: int) -> int | None:
+    """Return the resident set size of another process in bytes, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _process_cpu_seconds(pid: int) -> float | None:
+    """Return the CPU time used by another process in seconds, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # The command name may contain spaces, the fields after it do not
+            fields = file.read().rsplit(")", 1)[1].split()
+        # utime and stime are the 14th and 15th fields of the whole line
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class _ResourceLimits:
+    """Applies the CPU, memory and wall-clock limits of each run inside a worker process.
+
+    The CPU and wall-clock limits raise an ExecutionLimitExceeded in the running code through the SIGPROF
+    and SIGALRM interval timers, and the memory limit makes allocations beyond it fail with a MemoryError,
+    so the worker reports the output produced so far. Code stuck in a C extension does not see these, so
+    the parent process enforces the same limits from the outside as well.
+    """
+
+    def __init__(self):
+        try:
+            import resource
+        except ImportError:
+            resource = None
+        self._resource = resource
+        self._limits: ExecutionLimits | None = None
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGALRM, self._on_signal)
+            signal.signal(signal.SIGPROF, self._on_signal)
+
+    def _on_signal(self, signum, frame) -> None:
+        limits = self._limits
+        if limits is None:
+            # The run already finished
+            return
+        if signum == signal.SIGALRM:
+            raise ExecutionLimitExceeded("wall_clock_seconds", limits.wall_clock_seconds)
+        raise ExecutionLimitExceeded("cpu_seconds", limits.cpu_seconds)
+
+    def _set_soft_limit(self, kind: int, soft: int) -> int | None:
+        """Lower the soft limit of the resource, returning the previous one to restore."""
+        infinity = self._resource.RLIM_INFINITY
+        previous, hard = self._resource.getrlimit(kind)
+        if hard != infinity and (soft == infinity or soft > hard):
+            soft = hard
+        try:
+            self._resource.setrlimit(kind, (soft, hard))
+        except (ValueError, OSError) as e:
+            logger.warning(f"WorkerPool: Unable to set resource limit {kind}: {e}")
+            return None
+        return previous
+
+    def apply(self, limits: ExecutionLimits | None) -> Callable[[], None]:
+        """Arm the limits for the next run and return a function that disarms them."""
+        if limits is None:
+            return lambda: None
+
+        self._limits = limits
+        restores: list[Callable[[], None]] = []
+        if limits.cpu_seconds is not None and hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_PROF, limits.cpu_seconds)
+            restores.append(lambda: signal.setitimer(signal.ITIMER_PROF, 0))
+        if limits.memory_bytes is not None and self._resource is not None and hasattr(self._resource, "RLIMIT_AS"):
+            try:
+                with open("/proc/self/statm") as file:
+                    address_space = int(file.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+            except (OSError, ValueError, AttributeError):
+                address_space = None
+            if address_space is not None:
+                previous = self._set_soft_limit(self._resource.RLIMIT_AS, address_space + limits.memory_bytes)
+                if previous is not None:
+                    restores.append(
+                        lambda previous=previous: self._set_soft_limit(self._resource.RLIMIT_AS, previous)
+                    )
+        if limits.wall_clock_seconds is not None and hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, limits.wall_clock_seconds)
+            restores.append(lambda: signal.setitimer(signal.ITIMER_REAL, 0))
+
+        def restore() -> None:
+            self._limits = None
+            for restore_limit in reversed(restores):
+                restore_limit()
+
+        return restore
+
+
+def _preload_modules(module_names: Iterable[str]) -> None:
+    """Import the given modules so snippets using them do not pay the import cost."""
+    for module_name in module_names:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            logger.warning(f"WorkerPool: Unable to preload module {module_name}: {e}")
+
+
+def _set_temporary_directory(directory: str | None) -> Callable[[], None]:
+    """Point TMPDIR and the tempfile module at the directory, if any, and return the function restoring them."""
+    if directory is None:
+        return lambda: None
+    previous_environ, previous_tempdir = os.environ.get("TMPDIR"), tempfile.tempdir
+    os.environ["TMPDIR"] = tempfile.tempdir = directory
+
+    def restore() -> None:
+        if previous_environ is None:
+            os.environ.pop("TMPDIR", None)
+        else:
+            os.environ["TMPDIR"] = previous_environ
+        tempfile.tempdir = previous_tempdir
+
+    return restore
+
+
+def _worker_main(conn, preload_modules: tuple[str, ...], max_sessions: int, memory_budget_bytes: int) -> None:
+    """Entry point of a worker process.
+
+    Sends ("ready",) once the preload modules are imported, then receives run requests over the pipe
+    until it gets None or the pipe is closed, and replies with a (status, payload, rss_bytes) tuple for
+    each of them, preceded by ("output", stream, text) messages when the output is streamed. The
+    namespaces of the sessions pinned to this worker are kept between runs.
+    """
+    _preload_modules(preload_modules)
+    conn.send(("ready",))
+    session_store = SessionNamespaceStore(max_sessions=max_sessions, memory_budget_bytes=memory_budget_bytes)
+    resource_limits = _ResourceLimits()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        for session_id in request["reset_sessions"]:
+            session_store.reset(session_id)
+        session_id = request["session_id"]
+        execution_limits = request["execution_limits"]
+        try:
+            namespace = session_store.get(session_id) if session_id else None
+            on_output = None
+            if request["stream_output"]:
+                def on_output(stream: str, text: str) -> None:
+                    conn.send(("output", stream, text))
+            restore_limits = resource_limits.apply(execution_limits)
+            # The temporary files of the code are captured along with the other files it writes
+            artifact_limits = request["artifact_limits"]
+            restore_temporary_directory = _set_temporary_directory(
+                artifact_limits.directory if artifact_limits is not None else None
+            )
+            previous_directory = os.getcwd() if request["working_directory"] else None
+            try:
+                if previous_directory is not None:
+                    os.chdir(request["working_directory"])
+                result = run_code(
+                    request["code"],
+                    namespace,
+                    request["limits"],
+                    on_output,
+                    execution_limits,
+                    artifact_limits,
+                    request["evaluate_trailing_expression"],
+                )
+            finally:
+                if previous_directory is not None:
+                    os.chdir(previous_directory)
+                restore_temporary_directory()
+                restore_limits()
+            if (
+                execution_limits is not None
+                and execution_limits.memory_bytes is not None
+                and result.metadata.get("exception_type") == "MemoryError"
+            ):
+                result = ExecutionResult.from_limit_exceeded(
+                    ExecutionLimitExceeded("memory_bytes", execution_limits.memory_bytes),
+                    stdout=result.stdout,
+                    stderr=result.stderr,
+                )
+            reply = ("ok", result)
+        except ExecutionLimitExceeded as e:
+            # The limit tripped outside the executed code, e.g. while compiling it
+            reply = ("ok", ExecutionResult.from_limit_exceeded(e))
+        except Exception as e:
+            reply = ("error", str(e))
+        finally:
+            if session_id:
+                session_store.update_usage(session_id)
+        conn.send((*reply, _current_rss_bytes()))
+    conn.close()
+
+
+_main_module_lock = threading.Lock()
+
+
+def _start_without_main_module(process) -> None:
+    """Start the process without it importing the caller's script.
+
+    Processes that are not forked import the script of `__main__` to find their target, which runs its
+    module-level code in every worker and breaks the pool when the script has no `__main__` guard. The
+    workers run `_worker_main`, which does not need it, so a bare module stands in for `__main__` while
+    the process is started.
+    """
+    with _main_module_lock:
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            process.start()
+        finally:
+            sys.modules["__main__"] = main_module
+
+
+class _Worker:
+    """A worker process together with the parent end of its pipe."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.tasks_run = 0
+        # Whether the worker reported that it finished importing the preload modules
+        self.ready = False
+        # Sessions whose namespace the worker drops before its next run
+        self.pending_resets: set[str] = set()
+
+    def stop(self, timeout: float = 1.0, terminate: bool = False) -> None:
+        if not terminate:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout)
+        if self.process.is_alive():
+            # SIGKILL, so code that is stuck in a C extension or handles SIGTERM is stopped at once
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """A pool of warm, pre-forked worker processes that execute Python code snippets.
+
+    Workers are forked from a forkserver that has already imported the preload modules, so
+    snippets do not pay the interpreter startup and import costs on every call. Each snippet is
+    sent to an idle worker, and workers are recycled after `max_tasks_per_worker` runs or once
+    their RSS exceeds `max_rss_bytes`.
+
+    Runs with a session identifier are pinned to the worker holding that session's namespace, so
+    variables and imports survive across calls. Recycling a worker drops the sessions it holds.
+
+    Runs may be given ExecutionLimits. A worker that does not stop the code once it exceeds its wall-clock,
+    CPU or memory limit is killed and replaced, and the result reports which limit tripped.
+    """
+
+    def __init__(
+        self,
+        size: int | None = None,
+        preload_modules: Iterable[str] = DEFAULT_PRELOAD_MODULES,
+        max_tasks_per_worker: int | None = 100,
+        max_rss_bytes: int | None = None,
+        start_method: str | None = None,
+        max_sessions_per_worker: int = DEFAULT_MAX_SESSIONS,
+        session_memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES,
+    ):
+        """Initializes the pool and starts its worker processes.
+
+        Args:
+            size (int | None): The number of worker processes. Defaults to the number of CPUs.
+            preload_modules (Iterable[str]): The modules to import before running any snippet,
+                e.g. ("math", "numpy", "pandas").
+            max_tasks_per_worker (int | None): Recycle a worker after this many snippets. None disables it.
+            max_rss_bytes (int | None): Recycle a worker once its RSS exceeds this many bytes. None disables it.
+            start_method (str | None): The multiprocessing start method. Defaults to forkserver where
+                available and spawn otherwise.
+            max_sessions_per_worker (int): The number of session namespaces each worker keeps before
+                evicting the least recently used one.
+            session_memory_budget_bytes (int): The estimated memory each worker may hold in session namespaces.
+        """
+        self.size = size or os.cpu_count() or 1
+        self.preload_modules = tuple(preload_modules)
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_bytes = max_rss_bytes
+        self.max_sessions_per_worker = max_sessions_per_worker
+        self.session_memory_budget_bytes = session_memory_budget_bytes
+
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            # Only the execution core: preloading "__main__" would run the module-level code of the caller's
+            # script, e.g. its clients and credentials, in the forkserver
+            self._context.set_forkserver_preload(
+                ["code_runner", "execution_result", "session_store", *self.preload_modules]
+            )
+
+        self._lock = threading.Lock()
+        self._idle_changed = threading.Condition(self._lock)
+        self._idle: list[_Worker] = []
+        self._workers: list[_Worker] = []
+        self._session_workers: dict[str, _Worker] = {}
+        self._waiting = 0
+        self._closed = False
+        for _ in range(self.size):
+            self._put_idle(self._start_worker())
+
+    # region Helper Methods
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.preload_modules, self.max_sessions_per_worker, self.session_memory_budget_bytes),
+            daemon=True,
+        )
+        _start_without_main_module(process)
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _put_idle(self, worker: _Worker) -> None:
+        with self._idle_changed:
+            self._idle.append(worker)
+            self._idle_changed.notify_all()
+
+    def _acquire_worker(self, session_id: str | None) -> _Worker:
+        """Wait for an idle worker, preferring the one holding the session, and pin the session to it."""
+        with self._idle_changed:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise WorkerExecutionError("The worker pool has been shut down")
+                    worker = self._session_workers.get(session_id) if session_id else None
+                    if worker is not None:
+                        if worker in self._idle:
+                            self._idle.remove(worker)
+                            return worker
+                    elif self._idle:
+                        worker = self._idle.pop()
+                        if session_id:
+                            self._session_workers[session_id] = worker
+                        return worker
+                    self._idle_changed.wait()
+            finally:
+                self._waiting -= 1
+
+    def _retire_worker(self, worker: _Worker, terminate: bool = False) -> None:
+        with self._idle_changed:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            for session_id in [key for key, value in self._session_workers.items() if value is worker]:
+                logger.info(f"WorkerPool: Dropping session {session_id} held by worker {worker.process.pid}")
+                del self._session_workers[session_id]
+            # Wake up callers waiting for this worker, so they fall back to any idle worker
+            self._idle_changed.notify_all()
+        worker.stop(terminate=terminate)
+
+    def _replace_worker(self, worker: _Worker, terminate: bool = False) -> None:
+        self._retire_worker(worker, terminate=terminate)
+        if not self._closed:
+            self._put_idle(self._start_worker())
+
+    @staticmethod
+    def _check_limits(
+        worker: _Worker, execution_limits: ExecutionLimits, started: float, baseline: tuple[float | None, int | None]
+    ) -> ExecutionLimitExceeded | None:
+        """Return the limit the run exceeded past the kill grace period, if any."""
+        elapsed = time.monotonic() - started
+        if execution_limits.wall_clock_seconds is not None:
+            if elapsed > execution_limits.wall_clock_seconds + LIMIT_KILL_GRACE_SECONDS:
+                return ExecutionLimitExceeded("wall_clock_seconds", execution_limits.wall_clock_seconds)
+        baseline_cpu_seconds, baseline_rss_bytes = baseline
+        if execution_limits.cpu_seconds is not None and baseline_cpu_seconds is not None:
+            cpu_seconds = _process_cpu_seconds(worker.process.pid)
+            if (
+                cpu_seconds is not None
+                and cpu_seconds - baseline_cpu_seconds > execution_limits.cpu_seconds + LIMIT_KILL_GRACE_SECONDS
+            ):
+                return ExecutionLimitExceeded("cpu_seconds", execution_limits.cpu_seconds)
+        if execution_limits.memory_bytes is not None and baseline_rss_bytes is not None:
+            rss_bytes = _process_rss_bytes(worker.process.pid)
+            if rss_bytes is not None and rss_bytes - baseline_rss_bytes > execution_limits.memory_bytes:
+                return ExecutionLimitExceeded("memory_bytes", execution_limits.memory_bytes)
+        return None
+
+    def _wait_until_ready(self, worker: _Worker, cancel_event: threading.Event | None) -> None:
+        """Wait for the worker to import its preload modules, so their import time is not counted in the run."""
+        while not worker.ready:
+            if worker.conn.poll(CANCEL_POLL_INTERVAL_SECONDS):
+                message = worker.conn.recv()
+                if message[0] != "ready":
+                    self._replace_worker(worker, terminate=True)
+                    raise WorkerExecutionError(f"Unexpected message from worker {worker.process.pid}: {message[0]}")
+                worker.ready = True
+            elif cancel_event is not None and cancel_event.is_set():
+                logger.info(f"WorkerPool: Terminating worker {worker.process.pid} after cancellation")
+                self._replace_worker(worker, terminate=True)
+                raise WorkerExecutionError("The execution was cancelled")
+
+    def _release_worker(self, worker: _Worker, rss_bytes: int) -> None:
+        """Return the worker to the idle queue, replacing it first if it reached a recycle limit."""
+        recycle = self._closed
+        if self.max_tasks_per_worker and worker.tasks_run >= self.max_tasks_per_worker:
+            logger.info(f"WorkerPool: Recycling worker {worker.process.pid} after {worker.tasks_run} runs")
+            recycle = True
+        elif self.max_rss_bytes and rss_bytes > self.max_rss_bytes:
+            logger.info(f"WorkerPool: Recycling worker {worker.process.pid} with RSS of {rss_bytes} bytes")
+            recycle = True
+
+        if not recycle:
+            self._put_idle(worker)
+            return
+
+        self._replace_worker(worker)
+
+    # endregion
+
+    def run(
+        self,
+        code: str,
+        session_id: str | None = None,
+        cancel_event: threading.Event | None = None,
+        limits: OutputLimits | None = None,
+        on_output: Callable[[str, str], None] | None = None,
+        execution_limits: ExecutionLimits | None = None,
+        working_directory: str | None = None,
+        artifact_limits: ArtifactLimits | None = None,
+        evaluate_trailing_expression: bool = False,
+    ) -> ExecutionResult:
+        """Executes the provided Python code in an idle worker process.
+
+        Blocks until a worker is available and the snippet has finished.
+
+        Args:
+            code (str): The valid Python code to execute
+            session_id (str | None): The session whose namespace the code runs in. A fresh namespace
+                is used when not provided.
+            cancel_event (threading.Event | None): When set, the worker running the code is terminated
+                and replaced with a fresh one.
+            limits (OutputLimits | None): The size budgets of the result fields.
+            on_output (Callable[[str, str], None] | None): Called with the stream name and each chunk of
+                output as the worker produces it.
+            execution_limits (ExecutionLimits | None): The resource limits of the execution.
+            working_directory (str | None): The directory the code runs in, the worker's own if not provided.
+            artifact_limits (ArtifactLimits | None): Captures the figures and files the code produced, if given.
+            evaluate_trailing_expression (bool): Reports the value of the trailing expression as the result,
+                as a REPL does, instead of the variables the code defined.
+        Returns:
+            ExecutionResult: The result of the code execution, a failure reporting the exceeded limit if any
+        Raises:
+            WorkerExecutionError: If the worker process failed or died, or the execution was cancelled.
+        """
+        worker = self._acquire_worker(session_id)
+        with self._lock:
+            reset_sessions, worker.pending_resets = list(worker.pending_resets), set()
+        try:
+            self._wait_until_ready(worker, cancel_event)
+            baseline = (_process_cpu_seconds(worker.process.pid), _process_rss_bytes(worker.process.pid))
+            worker.conn.send({
+                "code": code,
+                "session_id": session_id,
+                "reset_sessions": reset_sessions,
+                "limits": limits,
+                "stream_output": on_output is not None,
+                "execution_limits": execution_limits,
+                "working_directory": working_directory,
+                "artifact_limits": artifact_limits,
+                "evaluate_trailing_expression": evaluate_trailing_expression,
+            })
+            started = time.monotonic()
+            watched = cancel_event is not None or execution_limits is not None
+            while True:
+                while watched and not worker.conn.poll(CANCEL_POLL_INTERVAL_SECONDS):
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info(f"WorkerPool: Terminating worker {worker.process.pid} after cancellation")
+                        self._replace_worker(worker, terminate=True)
+                        raise WorkerExecutionError("The execution was cancelled")
+                    exceeded = execution_limits and self._check_limits(worker, execution_limits, started, baseline)
+                    if exceeded:
+                        logger.warning(f"WorkerPool: Killing worker {worker.process.pid}: {exceeded}")
+                        self._replace_worker(worker, terminate=True)
+                        return ExecutionResult.from_limit_exceeded(exceeded)
+                message = worker.conn.recv()
+                if message[0] != "output":
+                    break
+                on_output(message[1], message[2])
+            status, payload, rss_bytes = message
+        except (EOFError, OSError) as e:
+            logger.error(f"WorkerPool: Worker {worker.process.pid} exited unexpectedly: {e}")
+            self._replace_worker(worker)
+            raise WorkerExecutionError("The worker process exited unexpectedly") from e
+        except WorkerExecutionError:
+            # The worker was already replaced, after a cancellation
+            raise
+        except BaseException:
+            # E.g. a failing on_output callback: the worker is left mid-run with unread messages
+            logger.warning(f"WorkerPool: Terminating worker {worker.process.pid} after the run was interrupted")
+            self._replace_worker(worker, terminate=True)
+            raise
+
+        worker.tasks_run += 1
+        self._release_worker(worker, rss_bytes)
+
+        if status == "error":
+            raise WorkerExecutionError(payload)
+        return payload
+
+    @property
+    def busy_workers(self) -> int:
+        """The number of workers running code."""
+        with self._lock:
+            return len(self._workers) - len(self._idle)
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of runs waiting for an idle worker."""
+        return self._waiting
+
+    def reset_session(self, session_id: str | None = None) -> None:
+        """Drop the namespace of the given session, or of every session if no identifier is given.
+
+        The worker holding the session drops its namespace before its next run, so this never waits
+        for a busy worker.
+        """
+        with self._lock:
+            session_ids = [session_id] if session_id is not None else list(self._session_workers)
+            for key in session_ids:
+                worker = self._session_workers.pop(key, None)
+                if worker is not None:
+                    worker.pending_resets.add(key)
+
+    def shutdown(self) -> None:
+        """Stops all worker processes."""
+        with self._idle_changed:
+            self._closed = True
+            self._idle_changed.notify_all()
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            self._retire_worker(worker)
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()